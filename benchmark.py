@@ -0,0 +1,409 @@
+import argparse
+import gc
+import json
+import os
+import platform
+import random
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+import pythonCMD
+
+
+class NullSink:
+    def write(self, channel, text):
+        pass
+
+    def close(self):
+        pass
+
+
+class Benchmark:
+    def __init__(self, name, function, setup=None, min_time=0.2, repeat=5, single=False):
+        self.name = name
+        self.function = function
+        self.setup = setup
+        # Each repeat runs the function in a loop for at least min_time seconds
+        self.min_time = min_time
+        self.repeat = repeat
+        # Cold measurements (a fresh cache, a first load) can only be taken once per setup
+        self.single = single
+
+    def run(self):
+        if self.single:
+            timings = []
+            for _ in range(self.repeat):
+                state = self.setup() if self.setup else None
+                started = time.perf_counter()
+                self.function(state)
+                timings.append(time.perf_counter() - started)
+            return self._result(timings, 1)
+        state = self.setup() if self.setup else None
+        # One untimed call first, so lazy start-up (imports, worker processes) is not measured
+        self.function(state)
+        number = self._calibrate(state)
+        timings = []
+        for _ in range(self.repeat):
+            started = time.perf_counter()
+            for _ in range(number):
+                self.function(state)
+            timings.append((time.perf_counter() - started) / number)
+        return self._result(timings, number)
+
+    def _calibrate(self, state):
+        number = 1
+        while True:
+            started = time.perf_counter()
+            for _ in range(number):
+                self.function(state)
+            elapsed = time.perf_counter() - started
+            if elapsed >= self.min_time or number >= 1 << 20:
+                return number
+            number = max(number * 2, int(number * self.min_time / max(elapsed, 1e-9)) + 1)
+
+    def _result(self, timings, number):
+        return {
+            'best': min(timings),
+            'median': statistics.median(timings),
+            'stdev': statistics.stdev(timings) if len(timings) > 1 else 0.0,
+            'loops': number,
+            'repeat': len(timings),
+        }
+
+
+class Workspace:
+    COMMANDS_CFG = (
+        "[hello]\n"
+        "command = true $1\n"
+        "help = Run a trivial external command\n"
+        "args = name\n"
+        "\n"
+        "[greet]\n"
+        "command = echo Hello, $1! | cat\n"
+        "help = Run a command through the shell\n"
+        "args = name\n"
+        "\n"
+        "[square]\n"
+        "command = python -c \"result = int('$1') ** 2\"\n"
+        "help = Run Python code in-process\n"
+        "args = number\n"
+        "\n"
+        "[aliases]\n"
+        "ll = ls -la\n"
+        "l1 = ll\n"
+        "l2 = l1\n"
+        "l3 = l2\n"
+        "gs = echo status\n"
+    )
+
+    def __init__(self):
+        self.root = tempfile.mkdtemp(prefix='pythoncmd-bench-')
+        self.previous_cwd = os.getcwd()
+        self.previous_env = dict(os.environ)
+
+    def __enter__(self):
+        # Keep the user's history, config and caches out of the measurements
+        os.environ['HOME'] = self.root
+        os.environ['PYTHONCMD_HISTFILE'] = os.path.join(self.root, 'history')
+        os.environ['PYTHONCMD_PAGER'] = '0'
+        os.environ['COLUMNS'] = '120'
+        os.environ['LINES'] = '40'
+        for name in ('PYTHONCMD_PYTHON_WORKER', 'PYTHONCMD_METRICS_JSONL', 'PYTHONCMD_METRICS_PROM'):
+            os.environ.pop(name, None)
+        os.chdir(self.root)
+        with open('commands.cfg', 'w', encoding='utf-8') as f:
+            f.write(self.COMMANDS_CFG)
+        return self
+
+    def __exit__(self, *exc):
+        os.chdir(self.previous_cwd)
+        os.environ.clear()
+        os.environ.update(self.previous_env)
+        shutil.rmtree(self.root, ignore_errors=True)
+
+    def shell(self, **env):
+        os.environ.update(env)
+        try:
+            with open(os.devnull, 'w') as devnull:
+                stdout, sys.stdout = sys.stdout, devnull
+                try:
+                    return pythonCMD.PythonCMD(fast=True)
+                finally:
+                    sys.stdout = stdout
+        finally:
+            for name in env:
+                os.environ.pop(name, None)
+
+    def history_file(self, entries, seed=42):
+        path = os.path.join(self.root, f'history-{entries}')
+        if os.path.exists(path):
+            return path
+        rng = random.Random(seed)
+        words = ['build', 'test', 'deploy', 'status', 'log', 'diff', 'commit', 'push', 'pull', 'run', 'serve',
+                 'install', 'update', 'clean', 'lint', 'format', 'release', 'docs', 'bench', 'migrate']
+        programs = ['git', 'make', 'npm', 'python', 'docker', 'kubectl', 'cargo', 'ls', 'cd', 'grep']
+        store = pythonCMD.HistoryStore(None)
+        started = time.time() - entries
+        with open(path, 'w', encoding='utf-8') as f:
+            for i in range(entries):
+                # A skewed mix: a few commands are run constantly, most only a handful of times
+                if rng.random() < 0.6:
+                    command = f"{rng.choice(programs[:4])} {rng.choice(words[:6])}"
+                else:
+                    command = (f"{rng.choice(programs)} {rng.choice(words)} "
+                               f"--{rng.choice(words)}={rng.randrange(entries // 10 + 1)}")
+                entry = pythonCMD.HistoryEntry(started + i, '/home/user/project', rng.choice((0, 0, 0, 1)),
+                                               rng.random() * 2, command)
+                f.write(store._format(entry) + "\n")
+        return path
+
+    def directory(self, files, seed=42):
+        path = os.path.join(self.root, f'dir-{files}')
+        if os.path.isdir(path):
+            return path
+        os.mkdir(path)
+        rng = random.Random(seed)
+        for i in range(files):
+            name = f"{'dir' if i % 50 == 0 else 'file'}_{rng.randrange(10 ** 9):09d}_{i}"
+            target = os.path.join(path, name)
+            if i % 50 == 0:
+                os.mkdir(target)
+                continue
+            fd = os.open(target + rng.choice(('.py', '.txt', '.log', '.json', '')), os.O_WRONLY | os.O_CREAT, 0o644)
+            try:
+                os.ftruncate(fd, rng.randrange(1 << 20))
+            finally:
+                os.close(fd)
+        return path
+
+
+def dispatch_benchmarks(workspace, options):
+    cmd = workspace.shell()
+    sink = NullSink()
+    yield Benchmark('dispatch.builtin.pwd', lambda _: cmd.execute_command('pwd', sink))
+    yield Benchmark('dispatch.builtin.echo', lambda _: cmd.execute_command('echo hello world', sink))
+    yield Benchmark('dispatch.builtin.pipeline', lambda _: cmd.execute_command('echo hello | search hel', sink))
+    yield Benchmark('dispatch.parse', lambda _: cmd.parser.parse('echo "a b" c && pwd; ls -la | search x',
+                                                                 cmd.aliases))
+
+
+def alias_benchmarks(workspace, options):
+    cmd = workspace.shell()
+    sink = NullSink()
+    yield Benchmark('alias.parse.direct', lambda _: cmd.parser.parse('gs', cmd.aliases))
+    yield Benchmark('alias.parse.chain4', lambda _: cmd.parser.parse('l3 /tmp', cmd.aliases))
+    yield Benchmark('alias.execute', lambda _: cmd.execute_command('gs', sink))
+
+    def redefine(_):
+        cmd.aliases.define('ll', 'ls -la')
+        cmd.aliases.expansion('l3')
+    yield Benchmark('alias.redefine', redefine)
+
+
+def custom_command_benchmarks(workspace, options):
+    cmd = workspace.shell()
+    cmd.load_custom_commands(quiet=True)
+    sink = NullSink()
+    yield Benchmark('custom.shell.argv', lambda _: cmd.execute_command('hello world', sink), repeat=3)
+    yield Benchmark('custom.shell.sh', lambda _: cmd.execute_command('greet world', sink), repeat=3)
+    yield Benchmark('custom.python.inprocess', lambda _: cmd.execute_command('square 12', sink))
+    yield Benchmark('custom.python.render', lambda _: cmd.custom_commands['square'].expand('12'))
+    if options.worker:
+        worker = workspace.shell(PYTHONCMD_PYTHON_WORKER='1')
+        worker.load_custom_commands(quiet=True)
+        yield Benchmark('custom.python.worker', lambda _: worker.execute_command('square 12', sink))
+        worker.python_worker.stop()
+
+
+def history_benchmarks(workspace, options):
+    for entries in options.history_sizes:
+        path = workspace.history_file(entries)
+
+        def fresh(path=path, entries=entries):
+            cmd = workspace.shell()
+            cmd.history = pythonCMD.HistoryStore(path, retention=entries)
+            return cmd
+
+        def loaded(fresh=fresh):
+            cmd = fresh()
+            cmd.search_history('git')
+            return cmd
+
+        yield Benchmark(f'history.{entries}.cold_search', lambda cmd: cmd.search_history('git'),
+                        setup=fresh, single=True, repeat=3)
+        for label, query in (('common', 'git'), ('rare', 'release --docs'), ('missing', 'zzzz')):
+            yield Benchmark(f'history.{entries}.search_{label}', lambda cmd, query=query: cmd.search_history(query),
+                            setup=loaded)
+        yield Benchmark(f'history.{entries}.append', lambda cmd: cmd.history.append('git status'),
+                        setup=loaded)
+
+
+def file_manager_benchmarks(workspace, options):
+    for files in options.directory_sizes:
+        path = workspace.directory(files)
+
+        def manager(path=path, scanner=None):
+            fm = pythonCMD.FileManager(scanner or pythonCMD.DirectoryScanner())
+            fm.current_dir = path
+            return fm
+
+        def warm(manager=manager):
+            fm = manager()
+            fm.get_sorted_items()
+            return fm
+
+        def sort(fm, sort_by):
+            fm.sort_by = sort_by
+            # A changed sort invalidates only the cached view, not the scan
+            fm.scanner.cache[fm.current_dir][2].clear()
+            return fm.get_sorted_items()
+
+        def display(fm):
+            stdout, sys.stdout = sys.stdout, open(os.devnull, 'w')
+            try:
+                fm.previous_frame = None
+                fm.display_interface()
+            finally:
+                sys.stdout.close()
+                sys.stdout = stdout
+
+        yield Benchmark(f'fm.{files}.get_sorted_items_cold', lambda fm: fm.get_sorted_items(),
+                        setup=manager, single=True)
+        yield Benchmark(f'fm.{files}.get_sorted_items_warm', lambda fm: fm.get_sorted_items(), setup=warm)
+        for sort_by in ('name', 'size', 'date'):
+            yield Benchmark(f'fm.{files}.sort_{sort_by}', lambda fm, sort_by=sort_by: sort(fm, sort_by),
+                            setup=warm)
+        yield Benchmark(f'fm.{files}.list_rows_page', lambda fm: fm.list_rows(fm.get_sorted_items()[:30], 120),
+                        setup=warm)
+        yield Benchmark(f'fm.{files}.list_rows_all', lambda fm: fm.list_rows(fm.get_sorted_items(), 120),
+                        setup=warm, repeat=3)
+        yield Benchmark(f'fm.{files}.display_list_view', display, setup=warm)
+
+
+SUITES = (
+    ('dispatch', dispatch_benchmarks),
+    ('alias', alias_benchmarks),
+    ('custom', custom_command_benchmarks),
+    ('history', history_benchmarks),
+    ('fm', file_manager_benchmarks),
+)
+
+
+def environment():
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                                cwd=os.path.dirname(os.path.abspath(__file__)), timeout=5).stdout.strip()
+    except (OSError, subprocess.SubprocessError):
+        commit = ''
+    return {
+        'python': platform.python_version(),
+        'implementation': platform.python_implementation(),
+        'platform': platform.platform(),
+        'machine': platform.machine(),
+        'cpus': os.cpu_count(),
+        'commit': commit or None,
+        'time': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+    }
+
+
+def run_suites(options):
+    results = {}
+    with Workspace() as workspace:
+        for suite, benchmarks in SUITES:
+            if options.suite and suite not in options.suite:
+                continue
+            for benchmark in benchmarks(workspace, options):
+                if options.filter and options.filter not in benchmark.name:
+                    continue
+                if options.quick:
+                    benchmark.min_time, benchmark.repeat = 0.05, min(benchmark.repeat, 3)
+                gc.collect()
+                result = benchmark.run()
+                results[benchmark.name] = result
+                print(f"{benchmark.name:<40} {format_time(result['best']):>10} {format_time(result['median']):>10}"
+                      f"  (x{result['loops']}, {result['repeat']} runs)", file=sys.stderr)
+    return results
+
+
+def compare(results, baseline, threshold):
+    regressions = []
+    print(f"\n{'benchmark':<40} {'baseline':>10} {'current':>10} {'change':>8}", file=sys.stderr)
+    for name, result in results.items():
+        previous = baseline.get(name)
+        if previous is None:
+            print(f"{name:<40} {'-':>10} {format_time(result['best']):>10} {'new':>8}", file=sys.stderr)
+            continue
+        # Best-of-N is the least noisy statistic on a shared machine
+        change = result['best'] / previous['best'] - 1 if previous['best'] else 0.0
+        marker = ''
+        if change > threshold:
+            marker = '  REGRESSION'
+            regressions.append(name)
+        elif change < -threshold:
+            marker = '  faster'
+        print(f"{name:<40} {format_time(previous['best']):>10} {format_time(result['best']):>10} "
+              f"{change:>+7.1%}{marker}", file=sys.stderr)
+    return regressions
+
+
+def format_time(seconds):
+    for unit, scale in (('s', 1), ('ms', 1e-3), ('us', 1e-6)):
+        if seconds >= scale:
+            return f"{seconds / scale:.2f}{unit}"
+    return f"{seconds / 1e-9:.0f}ns"
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the Python CMD Emulator's hot paths.")
+    parser.add_argument('suite', nargs='*', help=f"suites to run ({', '.join(name for name, _ in SUITES)}; "
+                                                 f"default: all)")
+    parser.add_argument('-k', '--filter', help="only run benchmarks whose name contains this text")
+    parser.add_argument('-o', '--output', help="write the results as JSON to this file ('-' for stdout)")
+    parser.add_argument('-b', '--baseline', help="compare against results saved earlier with --output")
+    parser.add_argument('--threshold', type=float, default=0.10,
+                        help="slowdown (fraction of the baseline) reported as a regression (default: 0.10)")
+    parser.add_argument('--quick', action='store_true', help="smaller data sets and shorter runs")
+    parser.add_argument('--no-worker', dest='worker', action='store_false',
+                        help="skip the Python worker process benchmark")
+    options = parser.parse_args(argv)
+    unknown = set(options.suite) - {name for name, _ in SUITES}
+    if unknown:
+        parser.error(f"unknown suite(s): {', '.join(sorted(unknown))}")
+    options.history_sizes = (10 ** 4, 10 ** 5) if options.quick else (10 ** 5, 10 ** 6)
+    options.directory_sizes = (10 ** 3, 10 ** 4) if options.quick else (10 ** 3, 10 ** 4, 10 ** 5)
+
+    baseline = None
+    if options.baseline:
+        with open(options.baseline, 'r', encoding='utf-8') as f:
+            saved = json.load(f)
+        # --quick shrinks the data sets, so its timings are not comparable with a full run
+        if saved.get('quick', False) != options.quick:
+            parser.error(f"{options.baseline} was recorded {'with' if saved.get('quick') else 'without'} --quick; "
+                         f"run {'with' if saved.get('quick') else 'without'} it to compare")
+        baseline = saved['results']
+
+    results = run_suites(options)
+    report = {'environment': environment(), 'quick': options.quick, 'results': results}
+    if options.output == '-':
+        json.dump(report, sys.stdout, indent=2)
+        sys.stdout.write("\n")
+    elif options.output:
+        with open(options.output, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2)
+            f.write("\n")
+
+    if baseline is not None:
+        regressions = compare(results, baseline, options.threshold)
+        if regressions:
+            print(f"\n{len(regressions)} benchmark(s) slower than the baseline by more than "
+                  f"{options.threshold:.0%}: {', '.join(regressions)}", file=sys.stderr)
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
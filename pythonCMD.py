@@ -1,11 +1,49 @@
+import time
+
+# Taken before the remaining imports so --profile-startup can report their cost
+IMPORT_STARTED = time.perf_counter()
+
 import os
 import sys
-import time
+import bisect
 import subprocess
 from typing import List, Optional
 import shutil
-import datetime
-import configparser
+import codecs
+import collections
+import contextlib
+import errno
+import fnmatch
+import heapq
+import io
+import locale
+import marshal
+import math
+import mmap
+import operator
+import queue
+import re
+import selectors
+import shlex
+import signal
+import stat
+import struct
+import tempfile
+import threading
+import zlib
+
+# argparse, configparser, concurrent.futures, hashlib and multiprocessing cost more to import
+# than the rest of startup combined, so they are imported where they are first needed
+
+try:
+    import readline
+except ImportError:
+    readline = None
+
+try:
+    import resource
+except ImportError:
+    resource = None
 
 
 class Style:
@@ -33,24 +71,38 @@ class Argument:
         self.required = required
         self.default = default
 
+class CommandError(Exception):
+    # Raised by a built-in to report a failure: the message is shown and the command's status is 1
+    pass
+
+
 class Command:
-    def __init__(self, name: str, function, help_text: str, arguments: List[Argument] = None):
+    def __init__(self, name: str, function, help_text: str, arguments: List[Argument] = None,
+                 reads_input: bool = False):
         self.name = name
         self.function = function
         self.help_text = help_text
         self.arguments = arguments or []
+        self.reads_input = reads_input
 
     def execute(self, *args):
+        return self.invoke(args)[0]
+
+    def invoke(self, args, stdin=None):
         try:
             if len(args) < sum(1 for arg in self.arguments if arg.required):
-                return self.get_help()
+                return self.get_help(), 2
             
             # Apply default values for optional arguments
             args = list(args) + [arg.default for arg in self.arguments[len(args):] if not arg.required]
             
-            return self.function(*args)
+            if self.reads_input and stdin is not None:
+                return self.function(*args, stdin=stdin), 0
+            return self.function(*args), 0
+        except CommandError as e:
+            return f"{Style.RED}{str(e)}{Style.RESET}", 1
         except Exception as e:
-            return f"Error executing {self.name}: {str(e)}"
+            return f"Error executing {self.name}: {str(e)}", 1
 
     def get_help(self):
         arg_help = " ".join(f"<{arg.name}>" if arg.required else f"[{arg.name}]" for arg in self.arguments)
@@ -58,380 +110,4528 @@ class Command:
                "\n".join(f"  {arg.name}: {'Required' if arg.required else 'Optional, default: ' + str(arg.default)}" 
                          for arg in self.arguments)
 
-class PythonCMD:
+class PagerQuit(Exception):
+    pass
+
+
+class Pager:
+    PROMPT = f"{Style.BACKGROUND_BLUE}{Style.WHITE} -- More -- Enter: line, Space: page, q: quit {Style.RESET}"
+
+    def __init__(self, stream):
+        self.stream = stream
+        self.columns, self.rows = shutil.get_terminal_size()
+        self.remaining = self.rows - 1
+        # Characters already on the current row, which a long line wraps beyond
+        self.column = 0
+        # Nothing shown on this page yet: its first line is shown even if it is taller than the page
+        self.fresh = True
+        self.quit = False
+
+    def fit(self, text):
+        # Where to stop writing text so the page is not overrun, or -1 when all of it fits. Rows are counted
+        # as the terminal shows them, so a line wider than the terminal takes several
+        position = 0
+        while position < len(text):
+            end = text.find("\n", position)
+            stop = len(text) if end == -1 else end + 1
+            line = text[position:end if end != -1 else stop]
+            width = len(CaptureSink.ANSI.sub('', line)) if '\033' in line else len(line)
+            column = self.column + width
+            # Rows completed by wrapping; the terminal only wraps when another character follows
+            rows = max(column - 1, 0) // self.columns - max(self.column - 1, 0) // self.columns
+            if end != -1:
+                rows += 1
+            if rows > self.remaining and not self.fresh and self.column == 0:
+                return position
+            self.remaining -= rows
+            self.column = 0 if end != -1 else column
+            self.fresh = False
+            position = stop
+            if self.remaining <= 0:
+                return position
+        return -1
+
+    def wait(self):
+        self.stream.write(self.PROMPT)
+        self.stream.flush()
+        try:
+            key = self.read_key()
+        except BaseException:
+            self.quit = True
+            raise
+        finally:
+            self.stream.write("\r\033[K")
+        if key in ('q', 'Q', '\x1b'):
+            self.quit = True
+            raise PagerQuit()
+        self.remaining = 1 if key in ('\r', '\n', 'j') else self.rows - 1
+        self.fresh = True
+
+    def read_key(self):
+        if os.name == 'nt':
+            import msvcrt
+            return msvcrt.getwch()
+        import termios
+        import tty
+        fd = sys.stdin.fileno()
+        saved = termios.tcgetattr(fd)
+        try:
+            tty.setcbreak(fd)
+            return os.read(fd, 1).decode(errors='replace')
+        finally:
+            termios.tcsetattr(fd, termios.TCSADRAIN, saved)
+
+
+class ConsoleSink:
+    HEADERS = {
+        'stdout': f"{Style.GREEN}Command Output:{Style.RESET}",
+        'stderr': f"{Style.RED}Error Output:{Style.RESET}",
+        'output': "",
+    }
+    BUFFER_SIZE = 64 * 1024
+    FLUSH_INTERVAL = 0.05
+
+    def __init__(self, stream=None, pager=False):
+        self.stream = stream or sys.stdout
+        self.channel = None
+        self.at_line_start = True
+        self.pager = Pager(self.stream) if pager else None
+        # Built-in output arrives a line at a time; it is batched and flushed by size or after a short delay
+        self.pending = []
+        self.pending_size = 0
+        self.timer = None
+        self.timed = self.stream.isatty()
+        self.lock = threading.RLock()
+
+    def write(self, channel, text):
+        if not text:
+            return
+        with self.lock:
+            if self.pager is not None and self.pager.quit:
+                return
+            if channel != self.channel:
+                if not self.at_line_start:
+                    self._emit("\n")
+                self._emit(self.HEADERS[channel] + "\n")
+                self.channel = channel
+            self._emit(text)
+            self.at_line_start = text.endswith("\n")
+            # External output already arrives in large chunks, so it is written straight away
+            if channel != 'output' or self.pending_size >= self.BUFFER_SIZE:
+                self.flush()
+            elif self.timed and self.timer is None:
+                self.timer = threading.Timer(self.FLUSH_INTERVAL, self.flush)
+                self.timer.daemon = True
+                self.timer.start()
+
+    def flush(self):
+        with self.lock:
+            if self.timer is not None:
+                self.timer.cancel()
+                self.timer = None
+            if self.pending:
+                self.stream.write("".join(self.pending))
+                self.pending = []
+                self.pending_size = 0
+            self.stream.flush()
+
+    def close(self):
+        with self.lock:
+            if not self.at_line_start:
+                if self.pager is None or not self.pager.quit:
+                    self.pending.append("\n")
+                self.at_line_start = True
+            self.flush()
+
+    def _emit(self, text):
+        pager = self.pager
+        while pager is not None and text:
+            cut = pager.fit(text)
+            if cut == -1:
+                break
+            if cut:
+                self.pending.append(text[:cut])
+                text = text[cut:]
+            self.flush()
+            pager.wait()
+        if text:
+            self.pending.append(text)
+            self.pending_size += len(text)
+
+
+class TaggedSink:
+    lock = threading.Lock()
+
+    def __init__(self, tag, stream=None):
+        self.tag = tag
+        self.stream = stream or sys.stdout
+        self.partial = {}
+
+    def write(self, channel, text):
+        lines = (self.partial.pop(channel, "") + text).split("\n")
+        if lines[-1]:
+            self.partial[channel] = lines[-1]
+        self._emit(channel, lines[:-1])
+
+    def close(self):
+        for channel, line in list(self.partial.items()):
+            self._emit(channel, [line])
+        self.partial.clear()
+
+    def _emit(self, channel, lines):
+        if not lines:
+            return
+        color = Style.RED if channel == 'stderr' else ''
+        prefix = f"{Style.YELLOW}[{self.tag}]{Style.RESET} {color}"
+        with self.lock:
+            self.stream.write("".join(f"{prefix}{line}{Style.RESET}\n" for line in lines))
+            self.stream.flush()
+
+
+class CaptureSink:
+    # Colour and cursor sequences, which only mean something on a terminal
+    ANSI = re.compile(r'\033\[[0-9;?]*[A-Za-z]')
+
+    def __init__(self, callback=None, capture=True, color=False, limit=None):
+        self.callback = callback
+        self.capture = capture
+        self.color = color
+        self.chunks = {'stdout': [], 'stderr': []}
+        # Captured output of a channel beyond limit characters is spilled to a temporary file
+        self.limit = limit
+        self.sizes = {'stdout': 0, 'stderr': 0}
+        self.spilled = {}
+
+    def write(self, channel, text):
+        # Built-in output is reported as stdout, like an external command's
+        channel = 'stderr' if channel == 'stderr' else 'stdout'
+        if not self.color and '\033' in text:
+            text = self.ANSI.sub('', text)
+        if not text:
+            return
+        if self.capture:
+            self._keep(channel, text)
+        if self.callback is not None:
+            self.callback(channel, text)
+
+    def close(self):
+        pass
+
+    def text(self, channel):
+        spill = self.spilled.get(channel)
+        if spill is None:
+            return "".join(self.chunks[channel])
+        spill.seek(0)
+        text = spill.read()
+        spill.seek(0, os.SEEK_END)
+        return text
+
+    def _keep(self, channel, text):
+        spill = self.spilled.get(channel)
+        if spill is not None:
+            spill.write(text)
+            return
+        chunks = self.chunks[channel]
+        chunks.append(text)
+        self.sizes[channel] += len(text)
+        if self.limit is not None and self.sizes[channel] > self.limit:
+            spill = self.spilled[channel] = tempfile.TemporaryFile(mode='w+', encoding='utf-8', errors='replace')
+            spill.writelines(chunks)
+            chunks.clear()
+
+
+class CommandResult:
+    __slots__ = ('command', 'status', 'stdout', 'stderr', 'duration', 'cwd')
+
+    def __init__(self, command, status, stdout, stderr, duration, cwd):
+        self.command = command
+        self.status = status
+        self.stdout = stdout
+        self.stderr = stderr
+        self.duration = duration
+        self.cwd = cwd
+
+    def as_dict(self):
+        return {name: getattr(self, name) for name in self.__slots__}
+
+
+class StreamingExecutor:
+    # Shared by every session of a runtime, so the timeout is passed in with each command
+    def __init__(self, chunk_size: int = 64 * 1024):
+        self.chunk_size = chunk_size
+        self.encoding = locale.getpreferredencoding(False)
+        self.last_returncode = None
+        # Resource usage of the processes reaped by the thread running a measured command
+        self.local = threading.local()
+
+    def run(self, command, sink=None, shell=True, cwd=None, env=None, stdin=None, timeout=None):
+        sink = sink or ConsoleSink()
+        try:
+            proc = subprocess.Popen(
+                command, shell=shell, cwd=cwd, env=env, stdin=stdin,
+                stdout=subprocess.PIPE, stderr=subprocess.PIPE
+            )
+        except OSError as e:
+            sink.write('stderr', f"Error executing command: {str(e)}\n")
+            sink.close()
+            self.last_returncode = 127
+            return self.last_returncode
+        self.last_returncode = self.stream([proc], sink, proc.stdout, proc.stderr, timeout)
+        return self.last_returncode
+
+    def stream(self, procs, sink, stdout=None, stderr=None, timeout=None):
+        deadline = time.monotonic() + timeout if timeout else None
+        pipes = {pipe: channel for pipe, channel in ((stdout, 'stdout'), (stderr, 'stderr')) if pipe is not None}
+        try:
+            if os.name == 'nt':
+                self._pump_threads(pipes, sink, deadline)
+            else:
+                self._pump_selectors(pipes, sink, deadline)
+            for proc in procs:
+                self.reap(proc, deadline)
+            returncode = procs[-1].returncode
+        except subprocess.TimeoutExpired:
+            for proc in procs:
+                self._kill(proc)
+            sink.write('stderr', f"Command execution timed out after {timeout} seconds.\n")
+            returncode = 124
+        except KeyboardInterrupt:
+            for proc in procs:
+                self._kill(proc)
+            sink.write('stderr', "Command interrupted.\n")
+            returncode = 130
+        except PagerQuit:
+            for proc in procs:
+                self._kill(proc)
+                proc.wait()
+            returncode = 0
+        finally:
+            for pipe in pipes:
+                pipe.close()
+            sink.close()
+        return returncode
+
+    def _pump_selectors(self, pipes, sink, deadline):
+        decoders = {pipe: self._decoder() for pipe in pipes}
+        with selectors.DefaultSelector() as selector:
+            for pipe, channel in pipes.items():
+                selector.register(pipe, selectors.EVENT_READ, channel)
+            while selector.get_map():
+                events = selector.select(self._remaining(deadline))
+                if not events:
+                    raise subprocess.TimeoutExpired(None, None)
+                for key, _ in events:
+                    data = os.read(key.fd, self.chunk_size)
+                    decoder = decoders[key.fileobj]
+                    if data:
+                        sink.write(key.data, decoder.decode(data))
+                    else:
+                        sink.write(key.data, decoder.decode(b"", final=True))
+                        selector.unregister(key.fileobj)
+
+    def _pump_threads(self, pipes, sink, deadline):
+        chunks = queue.Queue(maxsize=64)
+
+        def reader(pipe, channel):
+            fd = pipe.fileno()
+            while True:
+                data = os.read(fd, self.chunk_size)
+                chunks.put((channel, data))
+                if not data:
+                    break
+
+        decoders = {channel: self._decoder() for channel in pipes.values()}
+        for pipe, channel in pipes.items():
+            threading.Thread(target=reader, args=(pipe, channel), daemon=True).start()
+        open_pipes = len(pipes)
+        while open_pipes:
+            try:
+                channel, data = chunks.get(timeout=self._remaining(deadline))
+            except queue.Empty:
+                raise subprocess.TimeoutExpired(None, None)
+            sink.write(channel, decoders[channel].decode(data, final=not data))
+            if not data:
+                open_pipes -= 1
+
+    @contextlib.contextmanager
+    def measure(self):
+        # Adds up what the processes reaped on this thread used, so concurrent sessions and jobs are not counted
+        previous = getattr(self.local, 'usage', None)
+        usage = self.local.usage = {'cpu': 0.0, 'max_rss': 0, 'blocks_in': 0, 'blocks_out': 0}
+        try:
+            yield usage
+        finally:
+            self.local.usage = previous
+
+    def reap(self, proc, deadline=None):
+        usage = getattr(self.local, 'usage', None)
+        if usage is None or proc.returncode is not None or not hasattr(os, 'wait4'):
+            return proc.wait(timeout=self._remaining(deadline))
+        delay = 0.0005
+        while True:
+            try:
+                pid, status, rusage = os.wait4(proc.pid, 0 if deadline is None else os.WNOHANG)
+            except ChildProcessError:
+                return proc.wait()
+            if pid:
+                break
+            remaining = self._remaining(deadline)
+            if remaining == 0:
+                raise subprocess.TimeoutExpired(proc.args, None)
+            time.sleep(min(delay, remaining))
+            delay = min(delay * 2, 0.05)
+        proc.returncode = os.waitstatus_to_exitcode(status)
+        usage['cpu'] += rusage.ru_utime + rusage.ru_stime
+        usage['max_rss'] = max(usage['max_rss'], rusage.ru_maxrss)
+        usage['blocks_in'] += rusage.ru_inblock
+        usage['blocks_out'] += rusage.ru_oublock
+        return proc.returncode
+
+    def _decoder(self):
+        return codecs.getincrementaldecoder(self.encoding)(errors='replace')
+
+    def _remaining(self, deadline):
+        if deadline is None:
+            return None
+        return max(0, deadline - time.monotonic())
+
+    def _kill(self, proc):
+        if proc.poll() is None:
+            if os.name == 'posix' and self._leads_group(proc):
+                os.killpg(proc.pid, signal.SIGKILL)
+            else:
+                proc.kill()
+        proc.wait()
+
+    def _leads_group(self, proc):
+        try:
+            return os.getpgid(proc.pid) == proc.pid
+        except OSError:
+            return False
+
+
+class ParseError(Exception):
+    pass
+
+
+class SimpleCommand:
     def __init__(self):
-        self.history = []
-        self.aliases = {}
-        self.commands = {}
-        self.config_file = "commands.cfg"
-        self.register_commands()
-        self.load_config()
-        self.custom_commands = {}
-        self.load_custom_commands()
+        self.words = []
+        self.raw = []
+        # (fd, op, target) in source order: op is '>', '>>' or '<' with a file name, or '>&' with a descriptor
+        self.redirects = []
+        # A subshell or loop kept as source text for the system shell
+        self.compound = False
 
-    def register_commands(self):
-        self.add_command(
-            "cd", self.change_directory, "Change directory",
-            [Argument("path", required=False, default=".")]
-        )
-        self.add_command("dir", self.list_directory, "List directory contents")
-        self.add_command("ls", self.list_directory, "List directory contents")
-        self.add_command(
-            "echo", self.echo, "Display a line of text",
-            [Argument("text", required=False, default="")]
-        )
-        self.add_command("pwd", self.print_working_directory, "Print working directory")
-        self.add_command("cls", self.clear_screen, "Clear the screen")
-        self.add_command("clear", self.clear_screen, "Clear the screen")
-        self.add_command("history", self.show_history, "Show command history")
-        self.add_command(
-            "alias", self.create_alias, "Create an alias",
-            [Argument("name"), Argument("command")]
+    @property
+    def text(self):
+        # Original source of the words, quoting intact, for handing to the system shell
+        return " ".join(self.raw)
+
+
+class Pipeline:
+    def __init__(self, stages):
+        self.stages = stages
+
+
+class CommandList:
+    def __init__(self):
+        self.items = []  # (connector, Pipeline) pairs; connector is None, '&&' or '||'
+        self.background = False
+        self.raw = []
+
+    @property
+    def text(self):
+        return " ".join(self.raw)
+
+
+class CommandParser:
+    OPERATORS = ('&&', '||', '|', ';', '&', '(', ')')
+    # [n]>file, [n]>>file, [n]<file and [n]>&m; the descriptor number is only read at the start of a word
+    REDIRECT = re.compile(r'(\d*)(?:(>&)(\d+)|(>>|>|<))')
+    SHELL_KEYWORDS = ('for', 'while', 'until', 'if', 'case', '{')
+    COMPOUND_ENDS = {'for': 'done', 'while': 'done', 'until': 'done', 'if': 'fi', 'case': 'esac', '{': '}'}
+    # Words after which the next word is a command again inside a compound command
+    COMMAND_WORDS = ('if', 'then', 'elif', 'else', 'do', 'while', 'until', '{', '!')
+
+    def __init__(self, escapes=None):
+        # Backslashes are path separators on Windows, so only treat them as escapes elsewhere
+        self.escapes = os.name != 'nt' if escapes is None else escapes
+
+    def tokenize(self, line):
+        tokens = []
+        i, n = 0, len(line)
+        while i < n:
+            if line[i].isspace():
+                i += 1
+                continue
+            if line[i] == '#':
+                break
+            op = self._operator_at(line, i)
+            if op:
+                tokens.append(('op', op, op))
+                i += len(op)
+                continue
+            redirect = self.REDIRECT.match(line, i)
+            if redirect:
+                tokens.append(('redir', self._redirect(redirect), redirect.group()))
+                i = redirect.end()
+                continue
+            start = i
+            word = []
+            while i < n and not line[i].isspace() and not self._ends_word(line, i):
+                ch = line[i]
+                if ch == "'":
+                    end = line.find("'", i + 1)
+                    if end == -1:
+                        raise ParseError("unterminated single quote")
+                    word.append(line[i + 1:end])
+                    i = end + 1
+                elif ch == '"':
+                    i += 1
+                    while True:
+                        if i >= n:
+                            raise ParseError("unterminated double quote")
+                        ch = line[i]
+                        if ch == '"':
+                            i += 1
+                            break
+                        if ch == '\\' and self.escapes and i + 1 < n and line[i + 1] in '"\\$`':
+                            word.append(line[i + 1])
+                            i += 2
+                        else:
+                            word.append(ch)
+                            i += 1
+                elif ch == '\\' and self.escapes and i + 1 < n:
+                    word.append(line[i + 1])
+                    i += 2
+                elif ch == '$' and line.startswith('(', i + 1):
+                    # $(...) and $((...)) stay inside the word for the system shell
+                    end = self._closing_paren(line, i + 1)
+                    word.append(line[i:end])
+                    i = end
+                else:
+                    word.append(ch)
+                    i += 1
+            tokens.append(('word', ''.join(word), line[start:i]))
+        return tokens
+
+    def _operator_at(self, line, i):
+        for op in self.OPERATORS:
+            if line.startswith(op, i):
+                return op
+        return None
+
+    def _ends_word(self, line, i):
+        # A descriptor number only counts at the start of a word: 'a2>x' is the word 'a2' and '>x'
+        return line[i] in '<>' or self._operator_at(line, i) is not None
+
+    def _redirect(self, match):
+        fd, dup, target, op = match.groups()
+        if dup:
+            return (int(fd or 1), dup, int(target))
+        return (int(fd) if fd else (0 if op == '<' else 1), op, None)
+
+    def _closing_paren(self, line, i):
+        depth = 0
+        quote = None
+        while i < len(line):
+            ch = line[i]
+            if quote:
+                if ch == quote:
+                    quote = None
+            elif ch in '\'"':
+                quote = ch
+            elif ch == '(':
+                depth += 1
+            elif ch == ')':
+                depth -= 1
+                if depth == 0:
+                    return i + 1
+            i += 1
+        raise ParseError("missing ')'")
+
+    def _compound_end(self, tokens, start):
+        # Index of the token that closes the subshell or keyword compound opened at tokens[start]
+        closers = []
+        command_position = True
+        for index in range(start, len(tokens)):
+            kind, value, raw = tokens[index]
+            if kind == 'op':
+                if value == '(':
+                    closers.append(')')
+                elif value == ')' and closers and closers[-1] == ')':
+                    closers.pop()
+                command_position = True
+            elif kind == 'word' and command_position and raw == value:
+                if value in self.COMPOUND_ENDS:
+                    closers.append(self.COMPOUND_ENDS[value])
+                elif closers and value == closers[-1]:
+                    closers.pop()
+                command_position = value in self.COMMAND_WORDS
+            else:
+                command_position = False
+            if not closers:
+                return index
+        raise ParseError(f"missing '{closers[-1]}'")
+
+    def quote(self, word):
+        if word and not any(ch in word for ch in ' \t\'"\\|&;<>()#$`'):
+            return word
+        if "'" not in word:
+            return f"'{word}'"
+        if self.escapes:
+            word = re.sub(r'(["\\$`])', r'\\\1', word)
+        return f'"{word}"'
+
+    def parse(self, line, aliases=None):
+        tokens = self.tokenize(line)
+        if aliases:
+            tokens = aliases.expand(tokens)
+
+        command_lists = []
+        current = CommandList()
+        connector = None
+        stages = []
+        stage = SimpleCommand()
+        pending_redirect = None
+        index = 0
+        while index < len(tokens):
+            kind, value, raw = tokens[index]
+            index += 1
+            if kind != 'op' or value not in (';', '&'):
+                current.raw.append(raw)
+            if pending_redirect:
+                if kind != 'word':
+                    raise ParseError(f"expected a file name after '{pending_redirect[1]}'")
+                stage.redirects.append(pending_redirect[0][:2] + (value,))
+                pending_redirect = None
+            elif kind == 'redir':
+                if value[2] is None:
+                    pending_redirect = (value, raw)
+                else:
+                    stage.redirects.append(value)
+            elif not stage.words and ((kind == 'op' and value == '(')
+                                      or (kind == 'word' and raw == value and value in self.SHELL_KEYWORDS)):
+                # Subshells, loops and conditionals are handed to the system shell as they are written
+                end = self._compound_end(tokens, index - 1)
+                text = [raw] + [token[2] for token in tokens[index:end + 1]]
+                current.raw.extend(text[1:])
+                stage.words.append(" ".join(text))
+                stage.raw.extend(text)
+                stage.compound = True
+                index = end + 1
+            elif kind == 'word':
+                stage.words.append(value)
+                stage.raw.append(raw)
+            elif value in ('(', ')'):
+                raise ParseError(f"unexpected '{value}'")
+            else:
+                if not stage.words:
+                    raise ParseError(f"unexpected '{value}'")
+                stages.append(stage)
+                stage = SimpleCommand()
+                if value == '|':
+                    continue
+                current.items.append((connector, Pipeline(stages)))
+                stages = []
+                connector = value
+                if value in (';', '&'):
+                    current.background = value == '&'
+                    command_lists.append(current)
+                    current = CommandList()
+                    connector = None
+
+        if pending_redirect:
+            raise ParseError(f"expected a file name after '{pending_redirect[1]}'")
+        if stage.words:
+            stages.append(stage)
+        elif stage.redirects or stages:
+            raise ParseError("missing command")
+        elif connector in ('&&', '||'):
+            raise ParseError(f"missing command after '{connector}'")
+        if stages:
+            current.items.append((connector, Pipeline(stages)))
+        if current.items:
+            command_lists.append(current)
+        return command_lists
+
+class AliasResolver:
+    def __init__(self, parser):
+        self.parser = parser
+        self.definitions = {}
+        # Alias text tokenized once, when the alias is defined or loaded
+        self.tokens = {}
+        # Memoized full expansions, dropped when anything they looked up changes
+        self.expanded = {}
+        # word -> aliases whose expansion looked that word up in command position
+        self.dependents = collections.defaultdict(set)
+        # Aliases on a cycle; only possible for aliases loaded from an edited config file
+        self.cyclic = set()
+        self.errors = []
+
+    def __contains__(self, name):
+        return name in self.definitions
+
+    def __iter__(self):
+        return iter(self.definitions)
+
+    def __len__(self):
+        return len(self.definitions)
+
+    def __getitem__(self, name):
+        return self.definitions[name]
+
+    def items(self):
+        return self.definitions.items()
+
+    def load(self, aliases):
+        self.definitions.clear()
+        self.tokens.clear()
+        self.expanded.clear()
+        self.dependents.clear()
+        self.errors = []
+        for name, text in aliases.items():
+            try:
+                self.tokens[name] = self.parser.tokenize(text)
+            except ParseError as e:
+                self.errors.append(f"alias {name}: {str(e)}")
+                continue
+            self.definitions[name] = text
+        self.cyclic = set()
+        for name in self.definitions:
+            cycle = self._find_cycle(name, self.tokens[name])
+            if cycle:
+                self.cyclic.add(name)
+                self.errors.append(f"alias {name}: cycle {' -> '.join(cycle)}")
+
+    def define(self, name, text):
+        tokens = self.parser.tokenize(text)
+        cycle = self._find_cycle(name, tokens)
+        if cycle:
+            raise ValueError(f"alias cycle {' -> '.join(cycle)}")
+        self.definitions[name] = text
+        self.tokens[name] = tokens
+        self._changed(name)
+
+    def remove(self, name):
+        if name in self.definitions:
+            del self.definitions[name]
+            del self.tokens[name]
+            self._changed(name)
+
+    def expansion(self, name):
+        tokens = self.expanded.get(name)
+        if tokens is None:
+            tokens = self.expand(self.tokens[name], frozenset([name]), name)
+            if name not in self.cyclic:
+                self.expanded[name] = tokens
+        return tokens
+
+    def expand(self, tokens, seen=frozenset(), owner=None):
+        expanded = []
+        command_position = True
+        for token in tokens:
+            kind, value, raw = token
+            # Like sh, only unquoted words in command position are alias candidates,
+            # and an alias is never expanded inside its own expansion
+            if kind == 'word' and command_position and raw == value:
+                if owner is not None:
+                    self.dependents[value].add(owner)
+                if value in self.definitions and value not in seen:
+                    if value in self.cyclic:
+                        sub = self.expand(self.tokens[value], seen | {value}, owner)
+                    else:
+                        sub = self.expansion(value)
+                    expanded.extend(sub)
+                    command_position = bool(sub) and sub[-1][0] == 'op'
+                    continue
+            expanded.append(token)
+            command_position = kind == 'op'
+        return expanded
+
+    def _references(self, tokens):
+        command_position = True
+        for kind, value, raw in tokens:
+            if kind == 'word' and command_position and raw == value:
+                yield value
+            command_position = kind == 'op'
+
+    def _find_cycle(self, name, tokens):
+        # An alias may use its own name (ls='ls -F'); only longer loops are cycles
+        stack = [(ref, [name, ref]) for ref in self._references(tokens) if ref != name]
+        visited = set()
+        while stack:
+            current, path = stack.pop()
+            if current == name:
+                return path
+            if current in visited or current not in self.tokens:
+                continue
+            visited.add(current)
+            stack.extend((ref, path + [ref]) for ref in self._references(self.tokens[current]) if ref != current)
+        return None
+
+    def _changed(self, name):
+        stack = [name]
+        visited = set()
+        while stack:
+            current = stack.pop()
+            if current in visited:
+                continue
+            visited.add(current)
+            self.expanded.pop(current, None)
+            stack.extend(self.dependents.pop(current, ()))
+        if self.cyclic:
+            self.cyclic = {alias for alias in self.cyclic
+                           if alias in self.tokens and self._find_cycle(alias, self.tokens[alias])}
+
+
+class ShellContext:
+    # Where a session's commands run; passed to everything it starts instead of changing the process's directory
+    def __init__(self, cwd=None, env=None, sync_process=False, timeout=None):
+        self.cwd = os.path.abspath(os.path.expanduser(cwd or os.getcwd()))
+        # None stands for the process environment; it is copied on the first change
+        self.env = dict(env) if env is not None else None
+        # Seconds an external command or worker call may run, None for no limit
+        self.timeout = timeout
+        # The interactive shell mirrors its directory and environment into the process,
+        # so in-process Python code and line editing see the same place
+        self.sync_process = sync_process
+
+    def copy(self):
+        return ShellContext(self.cwd, self.env, timeout=self.timeout)
+
+    def resolve(self, path):
+        return os.path.normpath(os.path.join(self.cwd, os.path.expanduser(path)))
+
+    def chdir(self, path):
+        target = self.resolve(path)
+        if not os.path.isdir(target):
+            code = errno.ENOTDIR if os.path.exists(target) else errno.ENOENT
+            raise OSError(code, os.strerror(code), path)
+        if not os.access(target, os.X_OK):
+            raise PermissionError(errno.EACCES, os.strerror(errno.EACCES), path)
+        if self.sync_process:
+            os.chdir(target)
+        self.cwd = target
+        return target
+
+    def environ(self):
+        return self.env if self.env is not None else os.environ
+
+    def setenv(self, name, value):
+        if self.sync_process:
+            os.environ[name] = value
+            return
+        if self.env is None:
+            self.env = dict(os.environ)
+        self.env[name] = value
+
+    def unsetenv(self, name):
+        if self.sync_process:
+            os.environ.pop(name, None)
+            return
+        if self.env is None:
+            self.env = dict(os.environ)
+        self.env.pop(name, None)
+
+    def scandir(self):
+        if os.scandir not in os.supports_fd:
+            return os.scandir(self.cwd)
+        # Listing through a descriptor reads one directory even if the path is renamed meanwhile;
+        # scandir keeps its own duplicate, so ours can be closed straight away
+        fd = os.open(self.cwd, os.O_RDONLY | getattr(os, 'O_DIRECTORY', 0))
+        try:
+            return os.scandir(fd)
+        finally:
+            os.close(fd)
+
+
+class PipelineExecutor:
+    def __init__(self, shell):
+        self.shell = shell
+
+    def run(self, line, sink, job=None):
+        try:
+            command_lists = self.shell.parser.parse(line, self.shell.aliases)
+        except ParseError as e:
+            sink.write('output', f"{Style.RED}Syntax error: {str(e)}{Style.RESET}\n")
+            sink.close()
+            return 2
+
+        status = 0
+        for command_list in command_lists:
+            if command_list.background and job is None:
+                background = self.shell.jobs.submit(command_list)
+                sink.write('output', f"{Style.CYAN}[{background.id}] {background.text}{Style.RESET}\n")
+                sink.close()
+                status = 0
+            else:
+                status = self.run_list(command_list, sink, job)
+        return status
+
+    def run_list(self, command_list, sink, job=None):
+        status = 0
+        for connector, pipeline in command_list.items:
+            if job is not None and job.cancelled:
+                break
+            if (connector == '&&' and status != 0) or (connector == '||' and status == 0):
+                continue
+            status = self.run_pipeline(pipeline, sink, job)
+        return status
+
+    def run_pipeline(self, pipeline, sink, job=None):
+        context = self.shell.context
+        plans = [self.shell.resolve(stage, index > 0) for index, stage in enumerate(pipeline.stages)]
+        last = len(plans) - 1
+        procs = []
+        feeders = []
+        open_pipes = []
+        files = []
+        # upstream is None for the first stage, a binary pipe after an external stage,
+        # or an iterator of lines after a built-in
+        upstream = None
+        stderr_reader = stderr_writer = stderr_drain = None
+        if any(kind == 'external' for kind, _ in plans):
+            # Every external stage writes its errors to one pipe, so none of them bypasses the sink
+            read_fd, write_fd = os.pipe()
+            stderr_reader, stderr_writer = os.fdopen(read_fd, 'rb', buffering=0), write_fd
+            if plans[last][0] != 'external':
+                # Nothing streams it while a built-in produces the output, so it is collected and shown at the end
+                stderr_drain = self._drain(stderr_reader)
+
+        try:
+            for index, (stage, (kind, payload)) in enumerate(zip(pipeline.stages, plans)):
+                targets = self._open_redirects(stage, context, files)
+                if targets[0] is not None:
+                    # '<file' replaces whatever the previous stage writes
+                    if upstream is not None and hasattr(upstream, 'fileno'):
+                        upstream.close()
+                    upstream = targets[0]
+                if kind == 'external':
+                    stdin = subprocess.PIPE if upstream is not None and not hasattr(upstream, 'fileno') else upstream
+                    if stdin is None and job is not None:
+                        # Background jobs must not compete with the prompt for the terminal
+                        stdin = subprocess.DEVNULL
+                    stdout = self._target(targets[1], subprocess.PIPE, stderr_writer)
+                    proc = subprocess.Popen(
+                        payload, shell=isinstance(payload, str), stdin=stdin, cwd=context.cwd, env=context.env,
+                        stdout=stdout, stderr=self._target(targets[2], subprocess.STDOUT, stderr_writer),
+                        start_new_session=job is not None and os.name == 'posix'
+                    )
+                    procs.append(proc)
+                    if job is not None:
+                        job.add_process(proc)
+                    if stdin is subprocess.PIPE:
+                        feeders.append(self._feed(upstream, proc.stdin))
+                    elif upstream is not None:
+                        # The child holds its own copy of the pipe now
+                        upstream.close()
+                    if stdout is not subprocess.PIPE:
+                        upstream = iter(())
+                    elif index < last:
+                        upstream = proc.stdout
+                else:
+                    if upstream is not None and hasattr(upstream, 'fileno'):
+                        open_pipes.append(upstream)
+                        upstream = self._read_lines(upstream)
+                    output, status = payload(upstream)
+                    # Generators fail while they are read, after the stage has returned its status
+                    failures = []
+                    lines = self._lines(output, failures)
+                    if targets[1] == 'stderr':
+                        for line in lines:
+                            sink.write('stderr', line)
+                        upstream = iter(())
+                    elif targets[1] != 'stdout':
+                        targets[1].writelines(self._plain(lines))
+                        upstream = iter(())
+                    elif index == last:
+                        for line in lines:
+                            sink.write('output', line)
+                    else:
+                        upstream = lines
+                    if failures and status == 0:
+                        status = 1
+
+            if plans[last][0] == 'external':
+                os.close(stderr_writer)
+                stderr_writer = None
+                last_proc = procs[-1]
+                status = self.shell.executor.stream(procs, sink, last_proc.stdout, stderr_reader, context.timeout)
+            else:
+                for pipe in open_pipes:
+                    pipe.close()
+                open_pipes = []
+                for proc in procs:
+                    self.shell.executor.reap(proc)
+                if stderr_drain is not None:
+                    os.close(stderr_writer)
+                    stderr_writer = None
+                    thread, chunks = stderr_drain
+                    thread.join()
+                    if chunks:
+                        sink.write('stderr', b"".join(chunks).decode(self.shell.executor.encoding, errors='replace'))
+                sink.close()
+        except KeyboardInterrupt:
+            for proc in procs:
+                if proc.poll() is None:
+                    proc.kill()
+            sink.write('stderr', "Command interrupted.\n")
+            sink.close()
+            status = 130
+        except PagerQuit:
+            # Like a reader closing its end of a pipe: stop the producers quietly
+            for proc in procs:
+                if proc.poll() is None:
+                    proc.kill()
+            sink.close()
+            status = 0
+        except OSError as e:
+            sink.write('stderr', f"Error executing command: {str(e)}\n")
+            sink.close()
+            status = 127
+        finally:
+            if stderr_writer is not None:
+                os.close(stderr_writer)
+            if stderr_reader is not None and stderr_drain is None:
+                stderr_reader.close()
+            for feeder in feeders:
+                feeder.join()
+            for pipe in open_pipes:
+                pipe.close()
+            for f in files:
+                f.close()
+        return status
+
+    def _open_redirects(self, stage, context, files):
+        # Where fds 0, 1 and 2 of a stage go, applied left to right like sh: an open file, or
+        # 'stdout'/'stderr' for the pipeline's own streams (fd 0 is None when it is not redirected)
+        targets = {0: None, 1: 'stdout', 2: 'stderr'}
+        for fd, op, target in stage.redirects:
+            if fd not in targets or (op == '>&' and target not in (1, 2)):
+                raise OSError(errno.EBADF, f"unsupported file descriptor in redirection: {fd}")
+            if op == '>&':
+                targets[fd] = targets[target]
+            elif op == '<':
+                targets[fd] = open(context.resolve(target), 'rb')
+                files.append(targets[fd])
+            else:
+                targets[fd] = open(context.resolve(target), 'a' if op == '>>' else 'w',
+                                   encoding=self.shell.executor.encoding)
+                files.append(targets[fd])
+        return targets
+
+    def _target(self, target, stdout, stderr):
+        if target == 'stdout':
+            return stdout
+        if target == 'stderr':
+            return stderr
+        return target
+
+    def _drain(self, pipe):
+        chunks = []
+
+        def drain():
+            with pipe:
+                for chunk in iter(lambda: pipe.read(64 * 1024), b""):
+                    chunks.append(chunk)
+
+        thread = threading.Thread(target=drain, daemon=True)
+        thread.start()
+        return thread, chunks
+
+    def _feed(self, lines, pipe):
+        encoding = self.shell.executor.encoding
+        # A lazy built-in such as ls does its work as the feeder pulls its lines, so the feeder takes on
+        # the directory, environment and message sink of the session, batch line or job that started it
+        local = self.shell.local
+        context, sink = getattr(local, 'context', None), getattr(local, 'sink', None)
+
+        def feed():
+            local.context, local.sink = context, sink
+            try:
+                for line in self._plain(lines):
+                    pipe.write(line.encode(encoding, errors='replace'))
+            except (BrokenPipeError, OSError):
+                pass
+            finally:
+                try:
+                    pipe.close()
+                except OSError:
+                    pass
+
+        feeder = threading.Thread(target=feed, daemon=True)
+        feeder.start()
+        return feeder
+
+    def _plain(self, lines):
+        # Colour is for the terminal; a program or a file reading built-in output gets the bare text
+        ansi = CaptureSink.ANSI
+        for line in lines:
+            yield ansi.sub('', line) if '\033' in line else line
+
+    def _read_lines(self, pipe):
+        yield from io.TextIOWrapper(pipe, encoding=self.shell.executor.encoding, errors='replace')
+
+    def _lines(self, output, failures=None):
+        if output is None:
+            return
+        if isinstance(output, str):
+            output = output.splitlines()
+        try:
+            for line in output:
+                yield line if line.endswith("\n") else line + "\n"
+        except Exception as e:
+            if failures is not None:
+                failures.append(e)
+            if isinstance(e, CommandError):
+                yield f"{Style.RED}{str(e)}{Style.RESET}\n"
+            else:
+                yield f"{Style.RED}Error: {str(e)}{Style.RESET}\n"
+
+
+class JobSink:
+    def __init__(self, tail_lines=200):
+        self.tail = collections.deque(maxlen=tail_lines)
+        self.partial = {}
+        self.attached = None
+        self.lock = threading.Lock()
+
+    def write(self, channel, text):
+        if not text:
+            return
+        with self.lock:
+            lines = (self.partial.pop(channel, "") + text).split("\n")
+            if lines[-1]:
+                self.partial[channel] = lines[-1]
+            self.tail.extend((channel, line) for line in lines[:-1])
+            if self.attached:
+                self.attached.write(channel, text)
+
+    def close(self):
+        with self.lock:
+            if self.attached:
+                self.attached.close()
+
+    def finish(self):
+        with self.lock:
+            for channel, line in self.partial.items():
+                self.tail.append((channel, line))
+            self.partial.clear()
+
+    def attach(self, sink):
+        with self.lock:
+            for channel, line in self.tail:
+                sink.write(channel, line + "\n")
+            for channel, line in self.partial.items():
+                sink.write(channel, line)
+            self.attached = sink
+
+    def detach(self):
+        with self.lock:
+            if self.attached:
+                self.attached.close()
+            self.attached = None
+
+    def lines(self):
+        with self.lock:
+            return [line for _, line in self.tail] + list(self.partial.values())
+
+
+class Job:
+    def __init__(self, job_id, text, tail_lines=200, context=None):
+        self.id = job_id
+        self.text = text
+        self.context = context
+        self.status = 'Queued'
+        self.returncode = None
+        self.procs = []
+        self.started = None
+        self.finished = None
+        self.sink = JobSink(tail_lines)
+        self.future = None
+        self.reported = False
+        # Set by a terminating signal: processes started afterwards get it too, and the rest of the list is skipped
+        self.kill_signal = None
+        # Signals sent while no process was running, delivered to the next one that starts
+        self.pending_signals = []
+        self.lock = threading.Lock()
+
+    @property
+    def pids(self):
+        return [proc.pid for proc in self.procs]
+
+    @property
+    def cancelled(self):
+        return self.kill_signal is not None
+
+    def add_process(self, proc):
+        with self.lock:
+            self.procs.append(proc)
+            signals = self.pending_signals
+            self.pending_signals = []
+            if self.kill_signal is not None:
+                signals.append(self.kill_signal)
+        for sig in signals:
+            self.send(proc, sig)
+
+    def signal(self, sig, terminate=False):
+        with self.lock:
+            if terminate:
+                self.kill_signal = sig
+            procs = [proc for proc in self.procs if proc.poll() is None]
+            if not procs and not terminate:
+                self.pending_signals.append(sig)
+        for proc in procs:
+            self.send(proc, sig)
+
+    def send(self, proc, sig):
+        if proc.poll() is not None:
+            return
+        if os.name == 'posix':
+            # Each background stage leads its own session, so signal the whole group
+            os.killpg(proc.pid, sig)
+        else:
+            proc.send_signal(sig)
+
+    @property
+    def runtime(self):
+        if self.started is None:
+            return 0.0
+        return (self.finished or time.monotonic()) - self.started
+
+    @property
+    def done(self):
+        return self.finished is not None or (self.future is not None and self.future.cancelled())
+
+
+class JobManager:
+    def __init__(self, shell, max_workers=16, tail_lines=200):
+        self.shell = shell
+        self.tail_lines = tail_lines
+        self.max_workers = max_workers
+        self.pool = None
+        self.jobs = {}
+        self.next_id = 1
+        self.lock = threading.Lock()
+
+    def submit(self, command_list):
+        with self.lock:
+            # Like a subshell, a job keeps the directory and environment it was started with
+            job = Job(self.next_id, command_list.text, self.tail_lines, self.shell.context.copy())
+            self.jobs[job.id] = job
+            self.next_id += 1
+        if self.pool is None:
+            import concurrent.futures
+            self.pool = concurrent.futures.ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix='job')
+        job.future = self.pool.submit(self._run, job, command_list)
+        return job
+
+    def _run(self, job, command_list):
+        job.status = 'Running'
+        job.started = time.monotonic()
+        self.shell.local.context = job.context
+        try:
+            with self.shell.reporting_to(job.sink):
+                job.returncode = self.shell.pipeline.run_list(command_list, job.sink, job)
+        except SystemExit as e:
+            job.returncode = e.code if isinstance(e.code, int) else 1
+        except BaseException as e:
+            job.sink.write('stderr', f"{str(e) or type(e).__name__}\n")
+            job.returncode = 1
+        finally:
+            self.shell.local.context = None
+            job.finished = time.monotonic()
+            job.sink.finish()
+            if job.status != 'Killed':
+                job.status = 'Done' if job.returncode == 0 else f'Exit {job.returncode}'
+        return job.returncode
+
+    def get(self, job_id=None):
+        with self.lock:
+            if job_id is None:
+                if not self.jobs:
+                    raise ValueError("no current job")
+                return self.jobs[max(self.jobs)]
+            job = self.jobs.get(int(str(job_id).lstrip('%')))
+        if job is None:
+            raise ValueError(f"no such job: {job_id}")
+        return job
+
+    def all(self):
+        with self.lock:
+            return list(self.jobs.values())
+
+    def signal(self, job, sig=signal.SIGTERM):
+        if job.done:
+            raise ValueError(f"job {job.id} has already finished")
+        if job.future.cancel():
+            job.status = 'Killed'
+            return
+        terminate = sig in (signal.SIGTERM, signal.SIGINT) or sig == getattr(signal, 'SIGKILL', None)
+        # A job that has not started its processes yet (or is between them) gets the signal when it does
+        job.signal(sig, terminate)
+        if terminate:
+            job.status = 'Killed'
+        elif sig == getattr(signal, 'SIGSTOP', None):
+            job.status = 'Stopped'
+        elif sig == getattr(signal, 'SIGCONT', None):
+            job.status = 'Running'
+
+    def collect_finished(self):
+        finished = [job for job in self.all() if job.done and not job.reported]
+        for job in finished:
+            job.reported = True
+        return finished
+
+    def shutdown(self):
+        for job in self.all():
+            if not job.done:
+                try:
+                    self.signal(job)
+                except ValueError:
+                    pass
+        if self.pool is not None:
+            self.pool.shutdown(wait=False, cancel_futures=True)
+
+
+class HistoryEntry:
+    __slots__ = ('timestamp', 'cwd', 'status', 'duration', 'command')
+
+    def __init__(self, timestamp, cwd, status, duration, command):
+        self.timestamp = timestamp
+        self.cwd = cwd
+        self.status = status
+        self.duration = duration
+        self.command = command
+
+
+class CommandStats:
+    __slots__ = ('id', 'command', 'count', 'last_used')
+
+    def __init__(self, command_id, command):
+        self.id = command_id
+        self.command = command
+        self.count = 0
+        self.last_used = 0.0
+
+    def frecency(self, now):
+        age = now - self.last_used
+        if age < 3600:
+            weight = 4.0
+        elif age < 86400:
+            weight = 2.0
+        elif age < 7 * 86400:
+            weight = 0.5
+        else:
+            weight = 0.25
+        return self.count * weight
+
+
+class HistoryStore:
+    ESCAPES = (('\\', '\\\\'), ('\t', '\\t'), ('\n', '\\n'), ('\r', '\\r'))
+
+    def __init__(self, path, retention=100000):
+        self.path = path
+        self.retention = retention
+        # Raw tab-separated records; fields are only decoded when an entry is displayed
+        self.records = collections.deque()
+        self.stats = {}
+        # command id -> stats of every command still in the retention window; ids are never reused
+        self.unique = {}
+        self.next_id = 0
+        self.index = None
+        # Ids in the index whose command has since left the window
+        self.stale = 0
+        self.loaded = False
+        # Held while loading, compacting or appending, so a reader on another thread (a job, the prompt)
+        # never sees a half-loaded store and an append never lands in a file that is being replaced
+        self.lock = threading.RLock()
+
+    def __len__(self):
+        self._ensure_loaded()
+        return len(self.records)
+
+    def __iter__(self):
+        self._ensure_loaded()
+        with self.lock:
+            records = list(self.records)
+        return (self._command_of(record) for record in records)
+
+    def count(self):
+        # The number of entries if they are already in memory, else None; never reads the file
+        return len(self.records) if self.loaded else None
+
+    def append(self, command, cwd=None, status=None, duration=None):
+        with self.lock:
+            self._ensure_loaded()
+            entry = HistoryEntry(time.time(), cwd or "", status, duration, command)
+            record = self._format(entry)
+            self._remember(record, entry.timestamp, command)
+            if self.path:
+                try:
+                    with open(self.path, 'a', encoding='utf-8') as f:
+                        f.write(record + "\n")
+                except OSError:
+                    pass
+        return entry
+
+    def tail(self, count):
+        if self.loaded:
+            with self.lock:
+                return [self._command_of(record) for record in list(self.records)[-count:]]
+        text, _, _ = self._read_tail(count)
+        return [self._command_of(record) for record in text.splitlines() if record.count('\t') >= 4]
+
+    def recent(self, count=None):
+        return list(self.entries(count))
+
+    def entries(self, count=None):
+        self._ensure_loaded()
+        with self.lock:
+            records = list(self.records)
+        if count is not None:
+            records = records[-count:] if count > 0 else []
+        # Decoded one at a time so callers can stream them
+        return (self._parse(record) for record in records)
+
+    def search(self, query, limit=50):
+        self._ensure_loaded()
+        with self.lock:
+            return self._search(query, limit)
+
+    def _search(self, query, limit):
+        self._ensure_index()
+        # Smart case: an all-lowercase query matches case-insensitively
+        folded = query.lower()
+        ignore_case = query == folded
+        grams = {folded[i:i + 3] for i in range(len(folded) - 2)}
+        if grams:
+            postings = [self.index.get(gram) for gram in grams]
+            if any(posting is None for posting in postings):
+                return []
+            candidates = min(postings, key=len)
+        else:
+            candidates = self.unique
+
+        unique = self.unique
+        if ignore_case and len(folded) == 3:
+            # The posting list of a single trigram is already exact
+            matches = [unique[command_id] for command_id in candidates if command_id in unique]
+        else:
+            needle = folded if ignore_case else query
+            matches = []
+            for command_id in candidates:
+                stats = unique.get(command_id)
+                if stats is not None and needle in (stats.command.lower() if ignore_case else stats.command):
+                    matches.append(stats)
+        now = time.time()
+        return heapq.nlargest(limit, matches, key=lambda stats: stats.frecency(now))
+
+    def _remember(self, record, timestamp, command):
+        self.records.append(record)
+        stats = self.stats.get(command)
+        if stats is None:
+            stats = self.stats[command] = CommandStats(self.next_id, command)
+            self.unique[stats.id] = stats
+            self.next_id += 1
+            if self.index is not None:
+                self._index_command(stats.id, command)
+        stats.count += 1
+        stats.last_used = timestamp
+        while len(self.records) > self.retention:
+            self._forget(self._command_of(self.records.popleft()))
+
+    def _forget(self, command):
+        stats = self.stats[command]
+        stats.count -= 1
+        if stats.count:
+            return
+        # Gone from the window: drop it everywhere, so memory follows the window and not every command ever run
+        del self.stats[command]
+        del self.unique[stats.id]
+        if self.index is not None:
+            self.stale += 1
+            if self.stale > len(self.unique):
+                # Rebuilt on the next search, from live commands only
+                self.index = None
+
+    def _ensure_index(self):
+        if self.index is None:
+            self.index = collections.defaultdict(list)
+            self.stale = 0
+            for command_id, stats in self.unique.items():
+                self._index_command(command_id, stats.command)
+
+    def _index_command(self, command_id, command):
+        folded = command.lower()
+        index = self.index
+        for gram in {folded[i:i + 3] for i in range(len(folded) - 2)}:
+            index[gram].append(command_id)
+
+    def _read_tail(self, count):
+        if not self.path:
+            return "", 0, 0
+        try:
+            f = open(self.path, 'rb')
+        except OSError:
+            return "", 0, 0
+        with f:
+            size = os.fstat(f.fileno()).st_size
+            if size == 0:
+                return "", 0, 0
+            # Only the last `count` lines are decoded: walk newlines back from the end
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+                start, lines, end = 0, 0, size - 1
+                while lines < count:
+                    newline = data.rfind(b"\n", 0, end)
+                    if newline == -1:
+                        start = 0
+                        break
+                    start, end = newline + 1, newline
+                    lines += 1
+                return data[start:].decode('utf-8', errors='replace'), start, size
+
+    def _ensure_loaded(self):
+        if self.loaded:
+            return
+        with self.lock:
+            if not self.loaded:
+                self._load()
+                # Only now: a thread that sees loaded set must also see every entry
+                self.loaded = True
+
+    def _load(self):
+        tail, start, size = self._read_tail(self.retention)
+        for record in tail.splitlines():
+            fields = record.split('\t', 4)
+            if len(fields) != 5:
+                continue
+            try:
+                timestamp = float(fields[0])
+            except ValueError:
+                continue
+            command = fields[4]
+            if '\\' in command:
+                command = self._unescape(command)
+            self._remember(record, timestamp, command)
+        if start > size // 2:
+            self._compact()
+
+    def _compact(self):
+        temp_path = f"{self.path}.tmp"
+        try:
+            with open(temp_path, 'w', encoding='utf-8') as f:
+                f.writelines(record + "\n" for record in self.records)
+            os.replace(temp_path, self.path)
+        except OSError:
+            pass
+
+    def _format(self, entry):
+        status = "" if entry.status is None else str(entry.status)
+        duration = "" if entry.duration is None else f"{entry.duration:.6f}"
+        return f"{entry.timestamp:.3f}\t{status}\t{duration}\t{self._escape(entry.cwd)}\t{self._escape(entry.command)}"
+
+    def _parse(self, record):
+        timestamp, status, duration, cwd, command = record.split('\t', 4)
+        return HistoryEntry(
+            float(timestamp), self._unescape(cwd), int(status) if status else None,
+            float(duration) if duration else None, self._unescape(command)
         )
-        self.add_command("help", self.show_help, "Show help")
+
+    def _command_of(self, record):
+        return self._unescape(record.split('\t', 4)[4])
+
+    def _escape(self, text):
+        for raw, escaped in self.ESCAPES:
+            text = text.replace(raw, escaped)
+        return text
+
+    def _unescape(self, text):
+        if '\\' not in text:
+            return text
+        result = []
+        chars = iter(text)
+        for ch in chars:
+            if ch == '\\':
+                ch = {'t': '\t', 'n': '\n', 'r': '\r'}.get(next(chars, ''), '\\')
+            result.append(ch)
+        return "".join(result)
+
+
+class Completer:
+    DELIMITERS = ' \t\n;|&><'
+    COMMAND_SEPARATORS = ('|', '&', ';')
+
+    def __init__(self, shell, max_directories=256):
+        self.shell = shell
+        self.max_directories = max_directories
+        self.directories = collections.OrderedDict()  # path -> (mtime_ns, sorted names)
+        self.executables = []
+        self.executables_key = None
+        self.matches = []
+
+    def install(self):
+        readline.set_completer(self.complete)
+        readline.set_completer_delims(self.DELIMITERS)
+        if 'libedit' in (readline.__doc__ or ''):
+            readline.parse_and_bind("bind ^I rl_complete")
+        else:
+            readline.parse_and_bind("tab: complete")
+
+    def complete(self, text, state):
+        if state == 0:
+            try:
+                line = readline.get_line_buffer()[:readline.get_begidx()]
+                self.matches = self.candidates(text, line)
+            except Exception:
+                self.matches = []
+        return self.matches[state] if state < len(self.matches) else None
+
+    def candidates(self, text, line_before):
+        stripped = line_before.rstrip()
+        if not stripped or stripped.endswith(self.COMMAND_SEPARATORS):
+            if os.sep in text or (os.altsep and os.altsep in text) or text.startswith(('.', '~')):
+                return self.complete_path(text, executables_only=False)
+            return self.complete_command(text)
+        return self.complete_path(text)
+
+    def complete_command(self, text):
+        names = set()
+        for table in (self.shell.commands, self.shell.custom_commands, self.shell.aliases):
+            names.update(name for name in table if name.startswith(text))
+        names.update(self._prefixed(self.path_executables(), text))
+        return sorted(name + " " for name in names)
+
+    def complete_path(self, text, executables_only=False):
+        directory, prefix = os.path.split(text)
+        listing = self.listing(os.path.expanduser(directory) or os.curdir)
+        if not prefix.startswith('.'):
+            listing = [name for name in self._prefixed(listing, prefix) if not name.startswith('.')]
+        else:
+            listing = self._prefixed(listing, prefix)
+        matches = [os.path.join(directory, name) if directory else name for name in listing]
+        if len(matches) == 1 and not matches[0].endswith(os.sep):
+            matches[0] += " "
+        return matches
+
+    def listing(self, path):
+        try:
+            mtime = os.stat(path).st_mtime_ns
+        except OSError:
+            return []
+        cached = self.directories.get(path)
+        if cached and cached[0] == mtime:
+            self.directories.move_to_end(path)
+            return cached[1]
+        try:
+            with os.scandir(path) as entries:
+                names = sorted(entry.name + os.sep if self._is_dir(entry) else entry.name for entry in entries)
+        except OSError:
+            return []
+        self.directories[path] = (mtime, names)
+        while len(self.directories) > self.max_directories:
+            self.directories.popitem(last=False)
+        return names
+
+    def path_executables(self):
+        directories = [d for d in os.environ.get('PATH', '').split(os.pathsep) if d]
+        key = []
+        for directory in directories:
+            try:
+                key.append((directory, os.stat(directory).st_mtime_ns))
+            except OSError:
+                pass
+        key = tuple(key)
+        if key != self.executables_key:
+            names = set()
+            for directory, _ in key:
+                names.update(self._executables_in(directory))
+            self.executables = sorted(names)
+            self.executables_key = key
+        return self.executables
+
+    def _executables_in(self, directory):
+        extensions = [ext.lower() for ext in os.environ.get('PATHEXT', '').split(os.pathsep) if ext]
+        names = []
+        try:
+            with os.scandir(directory) as entries:
+                for entry in entries:
+                    try:
+                        if not entry.is_file():
+                            continue
+                    except OSError:
+                        continue
+                    if extensions:
+                        base, ext = os.path.splitext(entry.name)
+                        if ext.lower() in extensions:
+                            names.append(base)
+                    elif os.access(entry.path, os.X_OK):
+                        names.append(entry.name)
+        except OSError:
+            pass
+        return names
+
+    def _is_dir(self, entry):
+        try:
+            return entry.is_dir()
+        except OSError:
+            return False
+
+    def _prefixed(self, names, prefix):
+        start = bisect.bisect_left(names, prefix)
+        end = bisect.bisect_left(names, prefix + '\U0010ffff', start)
+        return names[start:end]
+
+
+class FileSearch:
+    MMAP_THRESHOLD = 1024 * 1024
+    TASK_BUDGET = 2000
+    MAX_LINE = 240
+    patterns = {}
+
+    def __init__(self, workers=None):
+        self.workers = workers or os.cpu_count() or 1
+        self.pool = None
+        self.lock = threading.Lock()
+
+    def find(self, root, pattern, limit=1000, base=None):
+        if not any(ch in pattern for ch in '*?['):
+            pattern = f"*{pattern}*"
+        return self._run(root, 'find', pattern, limit, base)
+
+    def grep(self, root, pattern, limit=1000, base=None):
+        re.compile(pattern)  # report a bad expression now, not from inside a worker
+        return self._run(root, 'grep', pattern, limit, base)
+
+    def shutdown(self):
+        if self.pool is not None:
+            self.pool.shutdown(wait=False, cancel_futures=True)
+            self.pool = None
+
+    @staticmethod
+    def process_context():
+        # The shell is multi-threaded by the time workers start, and a forked child inherits any lock
+        # another thread held at that moment; start them from a clean interpreter instead
+        import multiprocessing
+        if 'forkserver' in multiprocessing.get_all_start_methods():
+            return multiprocessing.get_context('forkserver')
+        return multiprocessing.get_context('spawn')
+
+    def _run(self, root, mode, pattern, limit, base=None):
+        import concurrent.futures
+        with self.lock:
+            if self.pool is None:
+                self.pool = concurrent.futures.ProcessPoolExecutor(
+                    max_workers=self.workers, mp_context=self.process_context()
+                )
+            pool = self.pool
+        # A relative root is searched under base, but results are still shown relative to it
+        start = os.path.join(base, root) if base else root
+        pending = {pool.submit(FileSearch.scan, start, (), mode, pattern, self.TASK_BUDGET)}
+        found = 0
+        try:
+            while pending:
+                done, pending = concurrent.futures.wait(pending, return_when=concurrent.futures.FIRST_COMPLETED)
+                for future in done:
+                    results, leftover = future.result()
+                    # Hand unfinished subtrees back to the pool before reporting, so workers stay busy
+                    for directory, rules in leftover:
+                        pending.add(pool.submit(FileSearch.scan, directory, rules, mode, pattern, self.TASK_BUDGET))
+                    for result in results:
+                        if start is not root:
+                            result = (root + result[0][len(start):],) + result[1:]
+                        yield self._format(root, mode, result)
+                        found += 1
+                        if found >= limit:
+                            yield f"{Style.YELLOW}Stopped after {limit} result(s).{Style.RESET}"
+                            return
+        finally:
+            for future in pending:
+                future.cancel()
+
+    def _format(self, root, mode, result):
+        if mode == 'find':
+            path, is_dir = result
+            path = self._relative(root, path)
+            return f"{Style.BLUE}{path}{os.sep}{Style.RESET}" if is_dir else path
+        path, line_number, text = result
+        return f"{Style.MAGENTA}{self._relative(root, path)}{Style.RESET}:{Style.GREEN}{line_number}{Style.RESET}:{text}"
+
+    def _relative(self, root, path):
+        prefix = os.curdir + os.sep
+        return path[len(prefix):] if root == os.curdir and path.startswith(prefix) else path
+
+    @staticmethod
+    def scan(directory, rules, mode, pattern, budget):
+        if mode == 'grep':
+            regex = FileSearch.patterns.get(pattern)
+            if regex is None:
+                regex = FileSearch.patterns[pattern] = re.compile(pattern.encode('utf-8'))
+        results = []
+        stack = [(directory, rules)]
+        work = 0
+        while stack:
+            if work >= budget:
+                return results, stack
+            current, rules = stack.pop()
+            try:
+                with os.scandir(current) as it:
+                    entries = list(it)
+            except OSError:
+                continue
+            if any(entry.name == '.gitignore' for entry in entries):
+                rules = rules + FileSearch.read_ignore(current)
+            for entry in entries:
+                work += 1
+                try:
+                    is_dir = entry.is_dir(follow_symlinks=False)
+                except OSError:
+                    continue
+                if entry.name == '.git' or FileSearch.ignored(entry.path, entry.name, is_dir, rules):
+                    continue
+                if is_dir:
+                    stack.append((entry.path, rules))
+                    if mode == 'find' and fnmatch.fnmatch(entry.name, pattern):
+                        results.append((entry.path, True))
+                elif mode == 'find':
+                    if fnmatch.fnmatch(entry.name, pattern):
+                        results.append((entry.path, False))
+                elif entry.is_file():
+                    matches, size = FileSearch.grep_file(entry.path, regex)
+                    results.extend(matches)
+                    work += size // 65536
+        return results, []
+
+    @staticmethod
+    def grep_file(path, regex):
+        results = []
+        try:
+            with open(path, 'rb') as f:
+                size = os.fstat(f.fileno()).st_size
+                if size == 0:
+                    return results, 0
+                if size >= FileSearch.MMAP_THRESHOLD:
+                    data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+                else:
+                    data = f.read()
+        except (OSError, ValueError):
+            return results, 0
+        try:
+            if b"\0" in data[:8192]:
+                return results, size  # binary file
+            line_number, counted_to, line_end = 1, 0, -1
+            for match in regex.finditer(data):
+                start = match.start()
+                if start < line_end:
+                    continue  # one result per line
+                line_number += data[counted_to:start].count(b"\n")
+                counted_to = start
+                line_start = data.rfind(b"\n", 0, start) + 1
+                line_end = data.find(b"\n", start)
+                if line_end == -1:
+                    line_end = size
+                text = data[line_start:min(line_end, line_start + FileSearch.MAX_LINE)]
+                results.append((path, line_number, text.decode('utf-8', errors='replace').rstrip("\r")))
+                line_end += 1
+        finally:
+            if isinstance(data, mmap.mmap):
+                data.close()
+        return results, size
+
+    @staticmethod
+    def read_ignore(directory):
+        try:
+            with open(os.path.join(directory, '.gitignore'), 'r', encoding='utf-8', errors='replace') as f:
+                lines = f.read().splitlines()
+        except OSError:
+            return ()
+        rules = []
+        for line in lines:
+            line = line.strip()
+            if not line or line.startswith('#'):
+                continue
+            negate = line.startswith('!')
+            line = line[1:] if negate else line
+            dir_only = line.endswith('/')
+            line = line.rstrip('/')
+            if line.startswith('**/'):
+                line = line[3:]
+            # Like git, a pattern containing a slash is relative to the .gitignore's directory
+            anchored = '/' in line
+            rules.append((directory, line.lstrip('/'), negate, dir_only, anchored))
+        return tuple(rules)
+
+    @staticmethod
+    def ignored(path, name, is_dir, rules):
+        ignored = False
+        for base, pattern, negate, dir_only, anchored in rules:
+            if dir_only and not is_dir:
+                continue
+            if anchored:
+                hit = fnmatch.fnmatch(path[len(base) + 1:].replace(os.sep, '/'), pattern)
+            else:
+                hit = fnmatch.fnmatch(name, pattern)
+            if hit:
+                ignored = not negate
+        return ignored
+
+
+class ConfigStore:
+    ALIAS_SECTION = 'aliases'
+    SECTION = re.compile(r'^\[([^\]]+)\]\s*$')
+    SNAPSHOT_VERSION = 3
+
+    def __init__(self, path, snapshot_dir='~/.pythoncmd_cache'):
+        self.path = os.path.abspath(path)
+        digest = zlib.crc32(self.path.encode('utf-8'))
+        self.snapshot_path = os.path.join(os.path.expanduser(snapshot_dir), f"config-{digest:08x}.snapshot")
+        self.aliases = {}
+        # name -> {'command', 'help', 'args', 'worker', 'cache'}
+        self.commands = {}
+        self.errors = []
+        # (mtime_ns, size) of the file as last loaded or written, None when it does not exist
+        self.signature = None
+
+    @property
+    def exists(self):
+        return self.signature is not None
+
+    def changed(self):
+        return self._signature() != self.signature
+
+    def load(self):
+        self.signature = self._signature()
+        if self.signature is None:
+            self.aliases.clear()
+            self.commands.clear()
+            self.errors = []
+            return
+        if self._load_snapshot():
+            return
+        self._parse(self._read_text())
+        self._save_snapshot()
+
+    def set_alias(self, name, value):
+        self._sync()
+        self.aliases[name] = value
+        self._write_section(self.ALIAS_SECTION, self.aliases)
+
+    def remove_alias(self, name):
+        self._sync()
+        self.aliases.pop(name, None)
+        self._write_section(self.ALIAS_SECTION, self.aliases or None)
+
+    def set_command(self, name, command, help_text, args, worker=True):
+        self._sync()
+        self.commands[name] = {'command': command, 'help': help_text, 'args': ' '.join(args), 'worker': worker,
+                               'cache': ''}
+        values = {'command': command, 'help': help_text, 'args': ' '.join(args)}
+        if not worker:
+            values['worker'] = 'no'
+        self._write_section(name, values)
+
+    def remove_command(self, name):
+        self._sync()
+        if self.commands.pop(name, None) is not None:
+            self._write_section(name, None)
+
+    def _sync(self):
+        # Pick up edits made behind our back before rewriting part of the file
+        if self.changed():
+            self.load()
+
+    def _signature(self):
+        try:
+            st = os.stat(self.path)
+        except OSError:
+            return None
+        return (st.st_mtime_ns, st.st_size)
+
+    def _read_text(self, newline=None):
+        try:
+            with open(self.path, 'r', encoding='utf-8', newline=newline) as f:
+                return f.read()
+        except FileNotFoundError:
+            return ''
+
+    def _parse(self, text):
+        import configparser
+        self.aliases.clear()
+        self.commands.clear()
+        self.errors = []
+        lines = text.splitlines(keepends=True)
+        first = self._first_section(lines)
+        # Files written by older versions start with bare name=value alias lines
+        for line in lines[:first]:
+            if '=' in line and not line.lstrip().startswith(('#', ';')):
+                key, value = line.strip().split('=', 1)
+                self.aliases[key.strip()] = value.strip()
+        parser = configparser.ConfigParser(interpolation=None, strict=False)
+        # Alias names are case-sensitive, as they are when set from the prompt and kept in the snapshot
+        parser.optionxform = str
+        try:
+            parser.read_string(''.join(lines[first:]), source=self.path)
+        except configparser.Error as e:
+            self.errors.append((os.path.basename(self.path), f"Configuration error: {str(e)}"))
+            return
+        for section in parser.sections():
+            if section == self.ALIAS_SECTION:
+                self.aliases.update(parser.items(section))
+                continue
+            try:
+                self.commands[section] = {
+                    'command': parser.get(section, 'command'),
+                    'help': parser.get(section, 'help', fallback='No help available'),
+                    'args': parser.get(section, 'args', fallback=''),
+                    'worker': parser.getboolean(section, 'worker', fallback=True),
+                    'cache': parser.get(section, 'cache', fallback=''),
+                }
+            except (configparser.Error, ValueError) as e:
+                self.errors.append((section, f"Configuration error: {str(e)}"))
+
+    def _first_section(self, lines):
+        for index, line in enumerate(lines):
+            if self.SECTION.match(line):
+                return index
+        return len(lines)
+
+    def _write_section(self, section, values):
+        text = self._read_text(newline='')
+        # Rewrite the file with the line endings it already uses; a new file gets the platform's own
+        newline = '\r\n' if '\r\n' in text else '\n' if text else None
+        lines = text.replace('\r\n', '\n').splitlines(keepends=True)
+        if lines and not lines[-1].endswith('\n'):
+            lines[-1] += '\n'
+        if section == self.ALIAS_SECTION:
+            # Migrate old-style alias lines into the [aliases] section
+            first = self._first_section(lines)
+            lines[:first] = [line for line in lines[:first] if '=' not in line or line.lstrip().startswith(('#', ';'))]
+        block = []
+        if values is not None:
+            block.append(f"[{section}]\n")
+            for key, value in values.items():
+                value = str(value).replace('\n', '\n\t')
+                block.append(f"{key} = {value}\n")
+        start = end = None
+        for index, line in enumerate(lines):
+            match = self.SECTION.match(line)
+            if start is None:
+                if match and match.group(1).strip() == section:
+                    start = index
+            elif match:
+                end = index
+                break
+        if start is None:
+            if not block:
+                return
+            if lines and lines[-1].strip():
+                block.insert(0, '\n')
+            lines.extend(block)
+        else:
+            end = len(lines) if end is None else end
+            # Keep the blank lines that separate this section from the next one
+            while block and end > start + 1 and not lines[end - 1].strip():
+                end -= 1
+            lines[start:end] = block
+        self._write(''.join(lines), newline)
+
+    def _write(self, text, newline=None):
+        directory = os.path.dirname(self.path)
+        fd, temp_path = tempfile.mkstemp(prefix='.' + os.path.basename(self.path), suffix='.tmp', dir=directory)
+        try:
+            with os.fdopen(fd, 'w', encoding='utf-8', newline=newline) as f:
+                f.write(text)
+                f.flush()
+                os.fsync(f.fileno())
+            if self.signature is not None:
+                shutil.copymode(self.path, temp_path)
+            os.replace(temp_path, self.path)
+        except BaseException:
+            try:
+                os.unlink(temp_path)
+            except OSError:
+                pass
+            raise
+        self.signature = self._signature()
+        self._save_snapshot()
+
+    def _load_snapshot(self):
+        try:
+            with open(self.snapshot_path, 'rb') as f:
+                snapshot = marshal.load(f)
+        except (OSError, EOFError, ValueError, TypeError):
+            return False
+        if (not isinstance(snapshot, dict) or snapshot.get('version') != self.SNAPSHOT_VERSION
+                or snapshot.get('path') != self.path or snapshot.get('signature') != self.signature):
+            return False
+        self.aliases.clear()
+        self.aliases.update(snapshot['aliases'])
+        self.commands.clear()
+        self.commands.update(snapshot['commands'])
+        self.errors = [tuple(error) for error in snapshot['errors']]
+        return True
+
+    def _save_snapshot(self):
+        snapshot = {
+            'version': self.SNAPSHOT_VERSION, 'path': self.path, 'signature': self.signature,
+            'aliases': self.aliases, 'commands': self.commands, 'errors': self.errors,
+        }
+        try:
+            os.makedirs(os.path.dirname(self.snapshot_path), exist_ok=True)
+            temp_path = f"{self.snapshot_path}.{os.getpid()}.tmp"
+            with open(temp_path, 'wb') as f:
+                marshal.dump(snapshot, f)
+            os.replace(temp_path, self.snapshot_path)
+        except OSError:
+            pass  # the snapshot is only a cache
+
+
+class MeteredSink:
+    def __init__(self, sink):
+        self.sink = sink
+        self.bytes = 0
+
+    def write(self, channel, text):
+        self.bytes += len(text)
+        self.sink.write(channel, text)
+
+    def close(self):
+        self.sink.close()
+
+    def __getattr__(self, name):
+        return getattr(self.sink, name)
+
+
+class LatencyHistogram:
+    __slots__ = ('buckets', 'count', 'total', 'maximum')
+    # Log-scale buckets 10% wide starting at 10us, so percentiles are within 10%
+    BASE = 1e-5
+    LOG_FACTOR = math.log(1.1)
+
+    def __init__(self):
+        self.buckets = {}
+        self.count = 0
+        self.total = 0.0
+        self.maximum = 0.0
+
+    def add(self, seconds):
+        index = 0 if seconds <= self.BASE else int(math.log(seconds / self.BASE) / self.LOG_FACTOR) + 1
+        self.buckets[index] = self.buckets.get(index, 0) + 1
+        self.count += 1
+        self.total += seconds
+        self.maximum = max(self.maximum, seconds)
+
+    def percentile(self, fraction):
+        if not self.count:
+            return 0.0
+        rank = fraction * self.count
+        seen = 0
+        for index in sorted(self.buckets):
+            seen += self.buckets[index]
+            if seen >= rank:
+                return min(self.BASE * math.exp(index * self.LOG_FACTOR), self.maximum)
+        return self.maximum
+
+
+class CommandMetrics:
+    __slots__ = ('name', 'latency', 'failures', 'cpu', 'child_cpu', 'max_rss', 'blocks_in', 'blocks_out',
+                 'output_bytes')
+
+    def __init__(self, name):
+        self.name = name
+        self.latency = LatencyHistogram()
+        self.failures = 0
+        self.cpu = 0.0
+        self.child_cpu = 0.0
+        self.max_rss = 0
+        self.blocks_in = 0
+        self.blocks_out = 0
+        self.output_bytes = 0
+
+
+class MetricsRecorder:
+    PROMETHEUS_INTERVAL = 10.0
+    ASSIGNMENT = re.compile(r'^[A-Za-z_][A-Za-z0-9_]*=')
+
+    def __init__(self, jsonl_path=None, prometheus_path=None, parser=None):
+        self.commands = {}
+        self.parser = parser or CommandParser()
+        self.session = f"{os.getpid()}"
+        # Either path may contain {pid} so that concurrent sessions write separate files
+        self.jsonl_path = jsonl_path.replace('{pid}', self.session) if jsonl_path else None
+        self.prometheus_path = prometheus_path.replace('{pid}', self.session) if prometheus_path else None
+        self.prometheus_written = 0.0
+        self.lock = threading.Lock()
+
+    def start(self):
+        # CPU time of the thread running the command; pipes fed by built-ins run on threads of their own
+        return time.perf_counter(), time.thread_time()
+
+    def finish(self, started, line, status, output_bytes, usage=None):
+        # usage is what the command's own processes used, as added up by StreamingExecutor.measure
+        wall = time.perf_counter() - started[0]
+        cpu = time.thread_time() - started[1]
+        usage = usage or {}
+        child_cpu = usage.get('cpu', 0.0)
+        max_rss = usage.get('max_rss', 0)
+        blocks_in = usage.get('blocks_in', 0)
+        blocks_out = usage.get('blocks_out', 0)
+        name = self.key(line)
+        with self.lock:
+            metrics = self.commands.get(name)
+            if metrics is None:
+                metrics = self.commands[name] = CommandMetrics(name)
+            metrics.latency.add(wall)
+            metrics.failures += status != 0
+            metrics.cpu += cpu
+            metrics.child_cpu += child_cpu
+            metrics.max_rss = max(metrics.max_rss, max_rss)
+            metrics.blocks_in += blocks_in
+            metrics.blocks_out += blocks_out
+            metrics.output_bytes += output_bytes
+        if self.jsonl_path:
+            self.write_jsonl({
+                'time': time.time(), 'session': self.session, 'command': name, 'status': status,
+                'wall': round(wall, 6), 'cpu': round(cpu, 6), 'child_cpu': round(child_cpu, 6),
+                'max_rss_kb': max_rss, 'blocks_in': blocks_in, 'blocks_out': blocks_out,
+                'output_bytes': output_bytes,
+            })
+        if self.prometheus_path and time.monotonic() - self.prometheus_written >= self.PROMETHEUS_INTERVAL:
+            self.write_prometheus()
+
+    def key(self, line):
+        # Commands are grouped by the programs a line runs, so 'ls | grep x' and 'ls -l' are told apart
+        # while arguments, variable assignments and redirect targets are left out
+        try:
+            tokens = self.parser.tokenize(line)
+        except ParseError:
+            words = line.split(None, 1)
+            return words[0] if words else ''
+        parts = []
+        command_position = True
+        skip = False
+        for kind, value, raw in tokens:
+            if skip:
+                skip = False
+            elif kind == 'op':
+                parts.append(value)
+                command_position = True
+            elif kind == 'redir':
+                skip = value[1] != '>&'
+            elif command_position and not self.ASSIGNMENT.match(value):
+                parts.append(value)
+                command_position = False
+        return ' '.join(parts)
+
+    def write_jsonl(self, record):
+        import json
+        try:
+            with open(self.jsonl_path, 'a', encoding='utf-8') as f:
+                f.write(json.dumps(record) + "\n")
+        except OSError:
+            pass
+
+    def write_prometheus(self):
+        self.prometheus_written = time.monotonic()
+        with self.lock:
+            commands = list(self.commands.values())
+        families = (
+            ('pythoncmd_command_duration_seconds', 'summary', "Wall time of commands run in a session."),
+            ('pythoncmd_command_failures_total', 'counter', "Commands that exited with a non-zero status."),
+            ('pythoncmd_command_output_bytes_total', 'counter', "Characters of output written by commands."),
+        )
+        lines = []
+        for family, kind, help_text in families:
+            lines.append(f"# HELP {family} {help_text}")
+            lines.append(f"# TYPE {family} {kind}")
+            for metrics in commands:
+                label = f'session="{self.session}",command="{self._escape_label(metrics.name)}"'
+                if kind == 'summary':
+                    for quantile in (0.5, 0.95, 0.99):
+                        lines.append(f'{family}{{{label},quantile="{quantile}"}} '
+                                     f'{metrics.latency.percentile(quantile):.6f}')
+                    lines.append(f"{family}_sum{{{label}}} {metrics.latency.total:.6f}")
+                    lines.append(f"{family}_count{{{label}}} {metrics.latency.count}")
+                elif family == 'pythoncmd_command_failures_total':
+                    lines.append(f"{family}{{{label}}} {metrics.failures}")
+                else:
+                    lines.append(f"{family}{{{label}}} {metrics.output_bytes}")
+        # The textfile collector may read at any moment, so replace the file atomically
+        temp_path = f"{self.prometheus_path}.{self.session}.tmp"
+        try:
+            with open(temp_path, 'w', encoding='utf-8') as f:
+                f.write("\n".join(lines) + "\n")
+            os.replace(temp_path, self.prometheus_path)
+        except OSError:
+            pass
+
+    def _escape_label(self, value):
+        return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+    def report(self, limit=10):
+        with self.lock:
+            commands = list(self.commands.values())
+        if not commands:
+            yield f"{Style.YELLOW}No commands recorded yet.{Style.RESET}"
+            return
+        header = (f"{Style.CYAN}{'command':<20} {'runs':>6} {'fail':>5} {'p50':>9} {'p95':>9} {'p99':>9} "
+                  f"{'max':>9} {'cpu':>8} {'child':>8} {'rss':>9} {'output':>9}{Style.RESET}")
+        sections = (
+            ("Slowest commands (p95)", lambda m: m.latency.percentile(0.95)),
+            ("Most frequent commands", lambda m: m.latency.count),
+        )
+        for title, key in sections:
+            yield f"{Style.BOLD}{title}{Style.RESET}"
+            yield header
+            for metrics in heapq.nlargest(limit, commands, key=key):
+                yield self._row(metrics)
+            yield ""
+
+    def _row(self, metrics):
+        latency = metrics.latency
+        rss = TransferEngine.format_size(metrics.max_rss * 1024) if metrics.max_rss else '-'
+        return (f"{metrics.name[:20]:<20} {latency.count:>6} {metrics.failures:>5} "
+                f"{self._duration(latency.percentile(0.5)):>9} {self._duration(latency.percentile(0.95)):>9} "
+                f"{self._duration(latency.percentile(0.99)):>9} {self._duration(latency.maximum):>9} "
+                f"{metrics.cpu:>7.2f}s {metrics.child_cpu:>7.2f}s {rss:>9} "
+                f"{TransferEngine.format_size(metrics.output_bytes):>9}")
+
+    def _duration(self, seconds):
+        if seconds < 1:
+            return f"{seconds * 1000:.1f}ms"
+        return f"{seconds:.2f}s"
+
+
+class StartupProfile:
+    def __init__(self, started=None, enabled=False):
+        self.started = started if started is not None else time.perf_counter()
+        self.last = self.started
+        self.enabled = enabled
+        self.phases = []
+
+    def lap(self, name):
+        now = time.perf_counter()
+        self.phases.append((name, now - self.last))
+        self.last = now
+
+    def report(self):
+        lines = [f"{Style.CYAN}Startup profile:{Style.RESET}"]
+        for name, seconds in self.phases:
+            lines.append(f"  {name:<24}{seconds * 1000:8.2f} ms")
+        lines.append(f"  {Style.BOLD}{'total':<24}{(self.last - self.started) * 1000:8.2f} ms{Style.RESET}")
+        return "\n".join(lines)
+
+
+class PromptStatus:
+    # Prompt segments that may wait on the disk (a hung NFS mount, a large history file) run on their own
+    # threads. The prompt waits at most a segment's timeout and otherwise shows the last value it has;
+    # the late result is kept for the next prompt. A segment still running for a key is never started twice
+    def __init__(self):
+        self.segments = {}
+        self.values = {}
+        self.running = {}
+        self.lock = threading.Lock()
+
+    def add(self, name, compute, timeout=0.05, ttl=0.0):
+        self.segments[name] = (compute, timeout, ttl)
+
+    def get(self, key=None):
+        # key is what the values depend on (the working directory); a value computed for another key is not shown
+        import concurrent.futures
+        now = time.monotonic()
+        values = {}
+        waiting = []
+        for name, (compute, timeout, ttl) in self.segments.items():
+            cached = self.values.get(name)
+            if cached is not None and cached[1] == key:
+                values[name] = cached[0]
+                if now - cached[2] < ttl:
+                    continue
+            with self.lock:
+                future = self.running.get((name, key)) or self._start(name, compute, key)
+            waiting.append((name, future, now + timeout))
+        for name, future, deadline in waiting:
+            try:
+                values[name] = future.result(max(0.0, deadline - time.monotonic()))
+            except concurrent.futures.TimeoutError:
+                pass
+            except Exception:
+                values.pop(name, None)
+        return values
+
+    def _start(self, name, compute, key):
+        import concurrent.futures
+        future = concurrent.futures.Future()
+        self.running[name, key] = future
+
+        def work():
+            try:
+                value = compute(key)
+            except BaseException as e:
+                future.set_exception(e)
+            else:
+                self.values[name] = (value, key, time.monotonic())
+                future.set_result(value)
+            finally:
+                with self.lock:
+                    self.running.pop((name, key), None)
+
+        # Daemon threads, so a computation stuck in the kernel cannot hold up exit
+        threading.Thread(target=work, name=f"prompt-{name}", daemon=True).start()
+        return future
+
+    @staticmethod
+    def git_branch(cwd):
+        # Read straight from .git rather than running git: one small file per prompt
+        directory = cwd
+        while True:
+            dot_git = os.path.join(directory, '.git')
+            if os.path.isdir(dot_git):
+                git_dir = dot_git
+                break
+            if os.path.isfile(dot_git):
+                # Worktrees and submodules: .git is a file pointing at the real directory
+                with open(dot_git) as f:
+                    line = f.readline().strip()
+                if not line.startswith('gitdir:'):
+                    return None
+                git_dir = os.path.join(directory, line[len('gitdir:'):].strip())
+                break
+            parent = os.path.dirname(directory)
+            if parent == directory:
+                return None
+            directory = parent
+        try:
+            with open(os.path.join(git_dir, 'HEAD')) as f:
+                head = f.read().strip()
+        except OSError:
+            return None
+        if head.startswith('ref:'):
+            ref = head[len('ref:'):].strip()
+            return ref[len('refs/heads/'):] if ref.startswith('refs/heads/') else ref
+        return head[:7]
+
+
+class Runtime:
+    # What every session in a process shares: the config, the custom commands built from it and the caches
+    def __init__(self, config_file="commands.cfg"):
+        self.config_file = config_file
+        self.config = ConfigStore(config_file)
+        self.executor = StreamingExecutor()
+        self.scanner = DirectoryScanner()
+        self.file_search = FileSearch()
+        self.disk_usage = DiskUsage()
+        self.output_cache = OutputCache()
+        self.python_worker = None
+        if os.environ.get('PYTHONCMD_PYTHON_WORKER', '') not in ('', '0'):
+            self.python_worker = PythonWorker(memory_limit=int(os.environ.get('PYTHONCMD_WORKER_MEMORY', 1024)))
+        self.custom_commands = None
+        # Bumped on every config load, so sessions can tell that their aliases are stale
+        self.generation = 0
+        self.lock = threading.RLock()
+
+    def load_config(self, force=False):
+        with self.lock:
+            if force or not self.generation or self.config.changed():
+                self.config.load()
+                self.custom_commands = None
+                self.generation += 1
+            return self.generation
+
+    def shutdown(self):
+        self.file_search.shutdown()
+        self.disk_usage.shutdown()
+        if self.python_worker is not None:
+            self.python_worker.stop()
+
+
+class PythonCMD:
+    def __init__(self, profile=None, fast=False, runtime=None, history=None, context=None):
+        self.profile = profile or StartupProfile()
+        self.fast = fast
+        self.runtime = runtime or Runtime()
+        self.session_context = context or ShellContext(sync_process=True)
+        # Background jobs run with their own copy of the context, set for the thread running them
+        self.local = threading.local()
+        self.history = history if history is not None else HistoryStore(
+            os.path.expanduser(os.environ.get('PYTHONCMD_HISTFILE', '~/.pythoncmd_history')),
+            retention=int(os.environ.get('PYTHONCMD_HISTSIZE', 100000))
+        )
+        self.commands = {}
+        self.config_file = self.runtime.config_file
+        self.config = self.runtime.config
+        self.config_generation = 0
+        self.executor = self.runtime.executor
+        self.parser = CommandParser()
+        self.aliases = AliasResolver(self.parser)
+        # Aliases are written to the config unless they are meant to stay in this session
+        self.persist_aliases = True
+        self.session_aliases = {}
+        self.pipeline = PipelineExecutor(self)
+        self.jobs = JobManager(self)
+        self.completer = None
+        self.scanner = self.runtime.scanner
+        self.file_search = self.runtime.file_search
+        self.metrics = MetricsRecorder(os.environ.get('PYTHONCMD_METRICS_JSONL'),
+                                       os.environ.get('PYTHONCMD_METRICS_PROM'), self.parser)
+        self.python_worker = self.runtime.python_worker
+        self.readline_history = 1000
+        self.last_status = 0
+        self.last_duration = None
+        self.interactive = sys.stdin.isatty() and sys.stdout.isatty()
+        # Long output pauses page by page, but only when a person is reading it
+        self.paging = self.interactive and os.environ.get('PYTHONCMD_PAGER', '1') not in ('', '0')
+        self.show_status_line = self.interactive and os.environ.get('PYTHONCMD_STATUS', '0') not in ('', '0')
+        self.prompt_status = PromptStatus()
+        self.prompt_status.add('git', PromptStatus.git_branch, ttl=2.0)
+        self.profile.lap('subsystems')
+        self.register_commands()
+        self.profile.lap('built-in commands')
+        self.load_config()
+        self.profile.lap('config')
+
+    @property
+    def context(self):
+        return getattr(self.local, 'context', None) or self.session_context
+
+    @property
+    def custom_commands(self):
+        # Built on first use, so startup only has to read the config
+        commands = self.runtime.custom_commands
+        if commands is None:
+            with self.runtime.lock:
+                if self.runtime.custom_commands is None:
+                    self.load_custom_commands(quiet=True)
+                commands = self.runtime.custom_commands
+        return commands
+
+    def register_commands(self):
+        self.add_command(
+            "cd", self.change_directory, "Change directory",
+            [Argument("path", required=False, default=".")]
+        )
+        self.add_command("dir", self.list_directory, "List directory contents")
+        self.add_command("ls", self.list_directory, "List directory contents")
+        self.add_command(
+            "echo", self.echo, "Display a line of text",
+            [Argument("text", required=False, default="")]
+        )
+        self.add_command("pwd", self.print_working_directory, "Print working directory")
+        self.add_command(
+            "export", self.export_variables, "Set environment variables for commands run from now on (NAME=value ...)",
+            [Argument("assignment", required=False)]
+        )
+        self.add_command("unset", self.unset_variables, "Remove environment variables", [Argument("name")])
+        self.add_command("cls", self.clear_screen, "Clear the screen")
+        self.add_command("clear", self.clear_screen, "Clear the screen")
+        self.add_command(
+            "history", self.show_history, "Show command history (optionally only the last <count> entries)",
+            [Argument("count", required=False)]
+        )
+        self.add_command(
+            "alias", self.create_alias, "Create an alias",
+            [Argument("name"), Argument("command")]
+        )
+        self.add_command("unalias", self.remove_alias, "Remove an alias", [Argument("name")])
+        self.add_command(
+            "stats", self.show_stats, "Show timing statistics for the commands run in this session",
+            [Argument("limit", required=False, default="10")]
+        )
+        self.add_command(
+            "cache", self.show_cache, "Show output cache hit rates, or clear cached results (cache clear [command]). "
+            "Cached commands show their output only once they have finished",
+            [Argument("action", required=False), Argument("name", required=False)]
+        )
+        self.add_command("status", self.display_status, "Show the working directory, git branch, history and last command")
+        self.add_command("help", self.show_help, "Show help")
         self.add_command("exit", self.exit, "Exit the program")
         self.add_command("fm", self.file_manager, "Open file manager")
         self.add_command(
-            "search", self.search_history, "Search command history",
-            [Argument("query")]
+            "search", self.search_history, "Search command history, most frecent first (or filter piped input)",
+            [Argument("query"), Argument("limit", required=False, default="50")], reads_input=True
+        )
+        self.add_command(
+            "ffind", self.find_files, "Find files whose name matches a glob, skipping .gitignore'd paths",
+            [Argument("pattern"), Argument("path", required=False, default="."),
+             Argument("limit", required=False, default="1000")]
+        )
+        self.add_command(
+            "du", self.disk_usage, "Show disk usage of a directory tree, largest first "
+            "(-x: stay on one file system, -f: ignore cached sizes)",
+            [Argument("path", required=False, default="."), Argument("depth", required=False, default="1")]
+        )
+        self.add_command(
+            "fsearch", self.search_files, "Search file contents for a regular expression, skipping .gitignore'd paths",
+            [Argument("regex"), Argument("path", required=False, default="."),
+             Argument("limit", required=False, default="1000")]
         )
         
         self.add_command("addcmd", self.add_custom_command_interactive, "Add a new custom command")
         self.add_command("rmcmd", self.remove_custom_command, "Remove a custom command")
         self.add_command("listcmd", self.list_custom_commands, "List all custom commands")
         self.add_command("refresh_commands", self.refresh_commands, "Reload custom commands from commands.cfg")
+        self.add_command(
+            "timeout", self.set_timeout, "Show or set the external command timeout in seconds ('off' to disable)",
+            [Argument("seconds", required=False)]
+        )
+        self.add_command(
+            "jobs", self.list_jobs, "List background jobs, or show the output tail of one job",
+            [Argument("job", required=False)]
+        )
+        self.add_command(
+            "fg", self.foreground_job, "Bring a background job to the foreground",
+            [Argument("job", required=False)]
+        )
+        self.add_command(
+            "bg", self.background_job, "Resume a stopped background job",
+            [Argument("job", required=False)]
+        )
+        self.add_command(
+            "wait", self.wait_jobs, "Wait for a background job, or all of them, to finish",
+            [Argument("job", required=False)]
+        )
+        self.add_command(
+            "kill", self.kill_job, "Send a signal to a job (%n) or process id, e.g. kill -STOP %1",
+            [Argument("target")]
+        )
+
+    def add_command(self, name, function, help_text, arguments=None, reads_input=False):
+        self.commands[name] = Command(name, function, help_text, arguments, reads_input)
+
+    def add_custom_command_interactive(self):
+        name = input("Enter command name: ").strip()
+        command = input("Enter command to execute: ").strip()
+        help_text = input("Enter help text: ").strip()
+        args = input("Enter argument names (space-separated): ").strip().split()
+        self.add_custom_command(name, command, help_text, args)
+        return f"{Style.GREEN}Custom command '{name}' added successfully.{Style.RESET}"
+
+    def set_timeout(self, seconds=None):
+        context = self.context
+        if seconds is None:
+            current = f"{context.timeout} seconds" if context.timeout else "disabled"
+            return f"Command timeout: {current}"
+        if seconds.lower() in ('off', 'none'):
+            context.timeout = None
+            return f"{Style.GREEN}Command timeout disabled.{Style.RESET}"
+        try:
+            timeout = float(seconds)
+        except ValueError:
+            timeout = None
+        if timeout is None or not math.isfinite(timeout) or timeout <= 0:
+            raise CommandError(f"Invalid timeout '{seconds}': give a positive number of seconds, or 'off'")
+        context.timeout = timeout
+        return f"{Style.GREEN}Command timeout set to {timeout} seconds.{Style.RESET}"
+
+    def format_job(self, job):
+        pids = ",".join(str(pid) for pid in job.pids) or "-"
+        return (f"{Style.YELLOW}[{job.id}]{Style.RESET} {job.status:<10} {job.runtime:8.1f}s  "
+                f"pid {pids:<12} {job.text}")
+
+    def list_jobs(self, job_id=None):
+        if job_id is not None:
+            job = self.jobs.get(job_id)
+            return "\n".join([self.format_job(job)] + job.sink.lines())
+        jobs = self.jobs.all()
+        if not jobs:
+            return f"{Style.YELLOW}No background jobs.{Style.RESET}"
+        return "\n".join(self.format_job(job) for job in jobs)
+
+    def foreground_job(self, job_id=None):
+        import concurrent.futures
+        job = self.jobs.get(job_id)
+        sink = getattr(self.local, 'sink', None) or ConsoleSink()
+        sink.write('output', self.format_job(job) + "\n")
+        job.sink.attach(sink)
+        try:
+            job.future.result()
+        except KeyboardInterrupt:
+            return f"{Style.YELLOW}[{job.id}] continues in the background.{Style.RESET}"
+        except concurrent.futures.CancelledError:
+            pass
+        finally:
+            job.sink.detach()
+        job.reported = True
+        return self.format_job(job)
+
+    def background_job(self, job_id=None):
+        job = self.jobs.get(job_id)
+        if job.status != 'Stopped':
+            raise CommandError(f"[{job.id}] is not stopped.")
+        if not hasattr(signal, 'SIGCONT'):
+            raise CommandError("Resuming jobs is not supported on this platform.")
+        self.jobs.signal(job, signal.SIGCONT)
+        return self.format_job(job)
+
+    def wait_jobs(self, job_id=None):
+        import concurrent.futures
+        jobs = [self.jobs.get(job_id)] if job_id is not None else self.jobs.all()
+        try:
+            concurrent.futures.wait([job.future for job in jobs])
+        except KeyboardInterrupt:
+            pass
+        for job in jobs:
+            if job.done:
+                job.reported = True
+        return "\n".join(self.format_job(job) for job in jobs)
+
+    def kill_job(self, *args):
+        sig = signal.SIGTERM
+        targets = []
+        for arg in args:
+            if arg.startswith('-') and len(arg) > 1:
+                name = arg[1:].upper()
+                if name.isdigit():
+                    sig = signal.Signals(int(name))
+                else:
+                    sig = signal.Signals[name if name.startswith('SIG') else f'SIG{name}']
+            else:
+                targets.append(arg)
+        if not targets:
+            return self.commands['kill'].get_help()
+        messages = []
+        for target in targets:
+            if target.startswith('%'):
+                job = self.jobs.get(target)
+                self.jobs.signal(job, sig)
+                messages.append(self.format_job(job))
+            else:
+                os.kill(int(target), sig)
+                messages.append(f"Sent {sig.name} to process {target}")
+        return "\n".join(messages)
+
+    def list_custom_commands(self):
+        if not self.custom_commands:
+            return f"{Style.YELLOW}No custom commands defined.{Style.RESET}"
+        return "\n".join(f"{name}: {cmd.help_text}" for name, cmd in self.custom_commands.items())
+
+    def load_config(self):
+        self.runtime.load_config()
+        self.load_aliases()
+
+    def load_aliases(self):
+        self.config_generation = self.runtime.generation
+        aliases = dict(self.config.aliases)
+        for name, command in self.session_aliases.items():
+            if command is None:
+                aliases.pop(name, None)
+            else:
+                aliases[name] = command
+        self.aliases.load(aliases)
+        for error in self.aliases.errors:
+            self.notify(f"{Style.YELLOW}Warning: {error}{Style.RESET}")
+
+    def reload_config(self, quiet=False):
+        self.runtime.load_config(force=True)
+        self.load_aliases()
+        return self.load_custom_commands(quiet)
+
+    def print_colored(self, text, color):
+        print(f"{color}{text}{Style.RESET}")
+
+    def print_typewriter(self, text, delay=0.002):
+        for char in text:
+            sys.stdout.write(char)
+            sys.stdout.flush()
+            time.sleep(delay)
+        print()
+
+    def display_header(self):
+        term_width = shutil.get_terminal_size().columns
+        header = f"{Style.BACKGROUND_BLUE}{Style.WHITE}{Style.BOLD} Python CMD Emulator {Style.RESET}"
+        print(header.center(term_width))
+        print(f"{Style.YELLOW}{'─' * term_width}{Style.RESET}")
+
+    def display_status(self):
+        current_dir = self.context.cwd
+        segments = self.prompt_status.get(current_dir)
+        # A segment that has not answered yet shows as '…' rather than holding up the line
+        parts = [f"Dir: {self.short_path(current_dir)}"]
+        if segments.get('git'):
+            parts.append(f"Branch: {segments['git']}")
+        # Only counted once history is in memory, so drawing the status line never waits for the file
+        count = self.history.count()
+        parts.append(f"History: {'…' if count is None else count}")
+        parts.append(f"Aliases: {len(self.aliases)}")
+        parts.append(f"Last: {self.last_status}")
+        if self.last_duration is not None:
+            parts.append(f"Took: {self.format_duration(self.last_duration)}")
+        return f"{Style.CYAN}{' | '.join(parts)}{Style.RESET}"
+
+    def build_prompt(self):
+        current_dir = self.context.cwd
+        if not self.interactive:
+            # Piped or scripted: no colors, and nothing that could wait on the disk
+            return f"{current_dir}> "
+        segments = self.prompt_status.get(current_dir)
+        top = f"┌─[{self.short_path(current_dir)}]"
+        if segments.get('git'):
+            top += f"─[{Style.MAGENTA}{segments['git']}{Style.BLUE}]"
+        if self.last_status:
+            top += f"─[{Style.RED}✗ {self.last_status}{Style.BLUE}]"
+        if self.last_duration is not None and self.last_duration >= 1.0:
+            top += f"─[{Style.YELLOW}{self.format_duration(self.last_duration)}{Style.BLUE}]"
+        return self.readline_prompt(f"{Style.BOLD}{Style.BLUE}{top}\n└─▶ {Style.RESET}")
+
+    @staticmethod
+    def short_path(path):
+        home = os.path.expanduser('~')
+        if home not in ('', '/') and (path == home or path.startswith(home + os.sep)):
+            return '~' + path[len(home):]
+        return path
+
+    @staticmethod
+    def format_duration(seconds):
+        if seconds < 1:
+            return f"{seconds * 1000:.0f}ms"
+        if seconds < 60:
+            return f"{seconds:.1f}s"
+        minutes, seconds = divmod(int(seconds), 60)
+        return f"{minutes}m{seconds:02d}s"
+  
+    def print_centered(self, text):
+        terminal_width = 80  # Assuming a default width
+        for line in text.split('\n'):
+            print(line.center(terminal_width))
+
+    def clear_screen(self):
+        if os.name == 'nt':
+            os.system('cls')
+        else:
+            # The same sequence `clear` sends, without forking it
+            sys.stdout.write("\033[H\033[2J\033[3J")
+            sys.stdout.flush()
+        return ""
+
+    def change_directory(self, path="."):
+        try:
+            return f"Changed directory to {self.context.chdir(path)}"
+        except Exception as e:
+            raise CommandError(f"Error changing directory: {str(e)}")
+
+    def list_directory(self):
+        try:
+            with self.context.scandir() as it:
+                for entry in it:
+                    yield f"{Style.BLUE if entry.is_dir() else Style.GREEN}{entry.name}{Style.RESET}"
+        except OSError as e:
+            raise CommandError(f"Error listing directory: {str(e)}")
+
+    def echo(self, *words):
+        return " ".join(words)
+
+    def print_working_directory(self):
+        return self.context.cwd
+
+    def export_variables(self, *assignments):
+        if not assignments:
+            return "\n".join(f"{name}={value}" for name, value in sorted(self.context.environ().items()))
+        for assignment in assignments:
+            name, sep, value = assignment.partition('=')
+            if not sep or not name:
+                raise CommandError("Usage: export NAME=value ...")
+            self.context.setenv(name, value)
+        return ""
+
+    def unset_variables(self, *names):
+        for name in names:
+            self.context.unsetenv(name)
+        return ""
+
+    def show_history(self, count=None):
+        count = int(count) if count else None
+        total = len(self.history)
+        first = 1 if count is None else max(1, total - max(count, 0) + 1)
+        return (f"{Style.YELLOW}{i}{Style.RESET}: {entry.command}"
+                for i, entry in enumerate(self.history.entries(count), first))
+
+    def create_alias(self, name, command, *words):
+        if re.search(r'[=:\s]', name):
+            # The name would not survive being written to and read back from commands.cfg
+            raise CommandError(f"Cannot create alias {name!r}: names cannot contain '=', ':' or whitespace")
+        if words:
+            # alias ll ls -la: keep each word intact, quoting it if needed
+            command = ' '.join(self.parser.quote(word) for word in (command,) + words)
+        try:
+            self.aliases.define(name, command)
+        except (ParseError, ValueError) as e:
+            raise CommandError(f"Cannot create alias {name}: {str(e)}")
+        if self.persist_aliases:
+            self.config.set_alias(name, command)
+        else:
+            self.session_aliases[name] = command
+        return f"Alias created: {name} -> {command}"
+
+    def show_stats(self, limit="10"):
+        return self.metrics.report(int(limit))
+
+    def show_cache(self, action=None, name=None):
+        cache = self.runtime.output_cache
+        if action is None:
+            policies = {name: command.cache for name, command in self.custom_commands.items()
+                        if command.cache is not None}
+            return cache.report(policies)
+        if action != 'clear':
+            raise CommandError(f"Unknown action: {action} (expected 'clear')")
+        removed = cache.clear(name)
+        target = f" for {name}" if name else ""
+        return f"{Style.GREEN}Removed {removed} cached result(s){target}.{Style.RESET}"
+
+    def remove_alias(self, name):
+        if name not in self.aliases:
+            raise CommandError(f"No such alias: {name}")
+        self.aliases.remove(name)
+        if self.persist_aliases:
+            self.config.remove_alias(name)
+        else:
+            self.session_aliases[name] = None
+        return f"Alias removed: {name}"
+
+    def show_help(self, command=None):
+        if command:
+            if command in self.commands:
+                return self.format_command_help(self.commands[command])
+            elif command in self.custom_commands:
+                return self.format_command_help(self.custom_commands[command])
+            else:
+                raise CommandError(f"No help available for '{command}'.")
+        
+        term_width = shutil.get_terminal_size().columns
+        
+        help_text = self.create_header("PYTHON CMD EMULATOR HELP", term_width)
+        
+        help_text += self.format_command_section("Base Commands", self.commands)
+        
+        if self.custom_commands:
+            help_text += self.format_command_section("Custom Commands", self.custom_commands)
+        
+        help_text += f"\n{Style.CYAN}For more information on a specific command, type: {Style.BOLD}help <command>{Style.RESET}\n"
+        help_text += "=" * term_width + "\n"
+        
+        return help_text
+
+    def create_header(self, text, width):
+        padding = "=" * ((width - len(text) - 2) // 2)
+        return f"\n{Style.BOLD}{Style.BLUE}{padding} {text} {padding}{Style.RESET}\n\n"
+
+    def format_command_section(self, title, commands):
+        section = f"{Style.YELLOW}{title}:{Style.RESET}\n"
+        max_name_length = max(len(cmd.name) for cmd in commands.values())
+        for cmd in commands.values():
+            if cmd.name != 'help':
+                section += f"  {Style.GREEN}{cmd.name.ljust(max_name_length)}{Style.RESET} : {cmd.help_text}\n"
+        return section + "\n"
+
+    def format_command_help(self, command):
+        term_width = shutil.get_terminal_size().columns
+        help_text = self.create_header(f"HELP: {command.name.upper()}", term_width)
+        help_text += f"{Style.CYAN}Usage:{Style.RESET} {command.name} "
+        help_text += " ".join(f"<{arg.name}>" if arg.required else f"[{arg.name}]" for arg in command.arguments)
+        help_text += f"\n\n{Style.YELLOW}Description:{Style.RESET}\n  {command.help_text}\n\n"
+        
+        if command.arguments:
+            help_text += f"{Style.MAGENTA}Arguments:{Style.RESET}\n"
+            for arg in command.arguments:
+                status = f"{Style.GREEN}Required{Style.RESET}" if arg.required else f"{Style.BLUE}Optional{Style.RESET}"
+                default = f" (Default: {arg.default})" if arg.default is not None else ""
+                help_text += f"  {Style.BOLD}{arg.name}{Style.RESET}: {status}{default}\n"
+        
+        return help_text
+
+    def display_welcome(self):
+        self.clear_screen()
+        term_width = shutil.get_terminal_size().columns
+        
+        welcome_text = [
+            f"{Style.BOLD}{Style.BLUE}╔{'═' * (term_width - 2)}╗{Style.RESET}",
+            f"{Style.BOLD}{Style.BLUE}║{' ' * (term_width - 2)}║{Style.RESET}",
+            f"{Style.BOLD}{Style.BLUE}║{Style.GREEN}{'Welcome to the Python CMD Emulator'.center(term_width - 2)}{Style.BLUE}║{Style.RESET}",
+            f"{Style.BOLD}{Style.BLUE}║{' ' * (term_width - 2)}║{Style.RESET}",
+            f"{Style.BOLD}{Style.BLUE}╚{'═' * (term_width - 2)}╝{Style.RESET}",
+        ]
+        
+        print("\n".join(welcome_text))
+
+        print(f"\n{Style.CYAN}Type 'help' for a list of commands.{Style.RESET}\n")
+   
+    def exit(self):
+        self.print_typewriter(f"{Style.GREEN}Thank you for using Advanced Python CMD. Goodbye!{Style.RESET}")
+        sys.exit(0)
+
+    def file_manager(self):
+        fm = FileManager(self.scanner, self.context.cwd, self.runtime.disk_usage)
+        return fm.run()
+
+    def search_history(self, query, limit="50", stdin=None):
+        if stdin is not None:
+            return (line for line in stdin if query in line)
+        results = self.history.search(query, int(limit))
+        return "\n".join(f"{Style.YELLOW}{i}{Style.RESET}: {stats.command} {Style.DIM}({stats.count}x){Style.RESET}"
+                         for i, stats in enumerate(results, 1))
+
+    def setup_readline(self):
+        if readline is None:
+            return
+        self.completer = Completer(self)
+        self.completer.install()
+        # Seed readline's own list so Ctrl-R searches previous sessions too
+        readline.clear_history()
+        for command in self.history.tail(self.readline_history):
+            readline.add_history(command)
+
+    def readline_prompt(self, text):
+        if readline is None:
+            return text
+        # Mark colour codes as zero-width so readline measures the prompt correctly
+        return re.sub(r'(\033\[[0-9;]*m)', '\001\\1\002', text)
+
+    def find_files(self, pattern, path=".", limit="1000"):
+        return self.file_search.find(os.path.expanduser(path), pattern, int(limit), self.context.cwd)
+
+    def disk_usage(self, *args):
+        flags = {arg for arg in args if arg.startswith('-') and len(arg) > 1}
+        unknown = flags - {'-x', '-f'}
+        if unknown:
+            raise CommandError(f"Unknown option: {' '.join(sorted(unknown))}")
+        positional = [arg for arg in args if arg not in flags]
+        path = positional[0] if positional else "."
+        depth = int(positional[1]) if len(positional) > 1 else 1
+        return self.runtime.disk_usage.report(self.context.resolve(path), depth, '-x' in flags, '-f' in flags,
+                                              label=path)
+
+    def search_files(self, regex, path=".", limit="1000"):
+        return self.file_search.grep(os.path.expanduser(path), regex, int(limit), self.context.cwd)
+
+    def run(self):
+        if not self.fast:
+            self.display_welcome()
+            self.profile.lap('welcome banner')
+            if self.runtime.custom_commands is None:
+                self.load_custom_commands()
+                self.profile.lap('custom commands')
+        self.setup_readline()
+        self.profile.lap('readline')
+        if self.profile.enabled:
+            print(self.profile.report(), file=sys.stderr)
+
+        while True:
+            try:
+                for job in self.jobs.collect_finished():
+                    print(self.format_job(job))
+                self.check_config()
+                current_dir = self.context.cwd
+                if self.show_status_line:
+                    print(self.display_status())
+                user_input = input(self.build_prompt())
+                
+                if user_input.strip():
+                    started = time.monotonic()
+                    status = self.execute_command(user_input, ConsoleSink(pager=self.paging))
+                    self.last_duration = time.monotonic() - started
+                    self.history.append(user_input.strip(), current_dir, status, self.last_duration)
+            except KeyboardInterrupt:
+                print(f"\n{Style.YELLOW}Use 'exit' to quit.{Style.RESET}")
+            except EOFError:
+                self.exit()
+
+    def execute_command(self, command, sink=None):
+        sink = MeteredSink(sink or ConsoleSink())
+        started = self.metrics.start()
+        status = 1
+        with self.executor.measure() as usage:
+            try:
+                with self.reporting_to(sink):
+                    status = self.pipeline.run(command, sink)
+            finally:
+                self.metrics.finish(started, command, status, sink.bytes, usage)
+        self.last_status = status
+        return self.last_status
+
+    @contextlib.contextmanager
+    def reporting_to(self, sink):
+        # Messages about the shell itself (config reloads, alias warnings) follow the command being run,
+        # so a session's client sees them instead of the server's terminal
+        previous = getattr(self.local, 'sink', None)
+        self.local.sink = sink
+        try:
+            yield sink
+        finally:
+            self.local.sink = previous
+
+    def cached(self, custom, args, context):
+        output, errors, status = self.runtime.output_cache.run(custom, args, context)
+        if errors:
+            # Error output goes to the command's sink, not down a pipe with the output
+            self.notify(errors.rstrip("\n"))
+        return output, status
+
+    def notify(self, text, channel='stderr'):
+        sink = getattr(self.local, 'sink', None)
+        if sink is None:
+            print(text)
+        else:
+            sink.write(channel, text + "\n")
+
+    def resolve(self, stage, piped=False):
+        if stage.compound:
+            return 'external', stage.text
+        name, args = stage.words[0], stage.words[1:]
+        if name in self.commands:
+            command = self.commands[name]
+            return 'python', lambda stdin: command.invoke(args, stdin)
+        if name in self.custom_commands:
+            custom = self.custom_commands[name]
+            # Output that depends on piped or redirected input is never cached
+            if custom.cache is not None and not piped and not any(op == '<' for _, op, _ in stage.redirects):
+                context = self.context
+                return 'python', lambda stdin: self.cached(custom, args, context)
+            if custom.python:
+                context = self.context
+                return 'python', lambda stdin: custom.invoke(args, stdin, context.cwd, context.timeout)
+            return 'external', custom.external(args, self.context.cwd, self.context.env)
+        return 'external', stage.text
+
+    def exit(self):
+        if getattr(self.local, 'context', None) is not None:
+            # In a background job or a batch line, exit ends that command list only, like exit in a subshell
+            raise SystemExit(0)
+        if self.metrics.prometheus_path:
+            self.metrics.write_prometheus()
+        self.jobs.shutdown()
+        self.runtime.shutdown()
+        term_width = shutil.get_terminal_size().columns
+        goodbye_msg = f"{Style.GREEN}Thank you for using Python CMD Emulator. Goodbye!{Style.RESET}"
+        print(goodbye_msg.center(term_width))
+        sys.exit(0)
+
+    def load_custom_commands(self, quiet=False):
+        successful_loads = 0
+        failed_commands = list(self.config.errors)
+        commands = {}
+
+        with self.runtime.lock:
+            for name, entry in self.config.commands.items():
+                try:
+                    worker = self.python_worker if entry['worker'] else None
+                    commands[name] = CustomCommand(
+                        name, entry['command'], entry['help'], entry['args'].split(), self.executor, worker,
+                        entry.get('cache', '')
+                    )
+                    successful_loads += 1
+                except ValueError as e:
+                    failed_commands.append((name, f"Configuration error: {str(e)}"))
+                except Exception as e:
+                    failed_commands.append((name, f"Unexpected error: {str(e)}"))
+            # Published whole, so other sessions never see a half-built table
+            self.runtime.custom_commands = commands
+
+        if self.config.exists:
+            if not quiet:
+                self.notify(f"{Style.GREEN}Successfully loaded {successful_loads} custom command(s).{Style.RESET}")
+
+            if failed_commands:
+                self.notify(f"{Style.YELLOW}The following commands failed to load:{Style.RESET}")
+                for name, error in failed_commands:
+                    self.notify(f"{Style.RED}- {name}: {error}{Style.RESET}")
+                self.notify(f"{Style.YELLOW}Please check your {self.config_file} file and correct these "
+                            f"issues.{Style.RESET}")
+        elif not quiet:
+            self.notify(f"{Style.YELLOW}No {self.config_file} file found. Custom commands will not be "
+                        f"loaded.{Style.RESET}")
+
+        return successful_loads, failed_commands
+
+    def add_custom_command(self, name, command, help_text, args):
+        self.custom_commands[name] = CustomCommand(name, command, help_text, args, self.executor, self.python_worker)
+        self.config.set_command(name, command, help_text, args)
+
+    def remove_custom_command(self, name):
+        if name in self.custom_commands:
+            del self.custom_commands[name]
+            self.config.remove_command(name)
+
+    def refresh_commands(self):
+        self.notify(f"{Style.CYAN}Refreshing custom commands...{Style.RESET}", 'output')
+        successful_loads, failed_commands = self.reload_config(quiet=True)
+        return f"Refresh complete. {successful_loads} commands loaded successfully."
+
+    def check_config(self):
+        # One stat per prompt; reloading here never races a running command
+        if self.config.changed():
+            self.notify(f"{Style.CYAN}{self.config_file} changed on disk, reloading...{Style.RESET}")
+            self.reload_config()
+        elif self.config_generation != self.runtime.generation:
+            # Another session already reloaded the shared config; only the aliases are per session
+            self.load_aliases()
+
+class CommandTemplate:
+    # $N, ${N}, ${N:-default} and $@ (all arguments); any other $ is left to the shell
+    SLOT = re.compile(r'\$(?:(\d+)|(@)|\{(\d+)(?::-([^}]*))?\})')
+    SHELL_CHARS = '|&;<>()`*?[]{}~#\n' if os.name != 'nt' else '|&<>()^%\n'
+    # Runs of characters that are never special, consumed in one step
+    PLAIN = re.compile(r'[^$\\\'"\s|&;<>()`*?\[\]{}~#^%]+')
+
+    def __init__(self, text, language='shell'):
+        self.text = text
+        self.language = language
+        self.posix = os.name != 'nt'
+        # Literal strings and (index, default, quote) slots; index 0 stands for $@
+        self.parts = []
+        # argv words (lists of parts) when the command needs no shell features, else None
+        self.words = None
+        self.program = None
+        self._compile()
+
+    def _compile(self):
+        text = self.text
+        python = self.language == 'python'
+        quotes = '"\'' if python or self.posix else '"'
+        escapes = python or self.posix
+        words, word, quote = [], None, None
+        direct = not python
+        i, n = 0, len(text)
+        while i < n:
+            plain = self.PLAIN.match(text, i)
+            if plain:
+                self._append(self.parts, plain.group())
+                word = word or []
+                self._append(word, plain.group())
+                i = plain.end()
+                continue
+            ch = text[i]
+            match = self.SLOT.match(text, i) if ch == '$' else None
+            if match:
+                index = int(match.group(1) or match.group(3) or 0)
+                slot = (index, match.group(4), quote)
+                self.parts.append(slot)
+                word = (word or []) + [slot]
+                i = match.end()
+                continue
+            if escapes and ch == '\\' and i + 1 < n and (python or quote != "'"):
+                self._append(self.parts, text[i:i + 2])
+                direct = False
+                i += 2
+                continue
+            self._append(self.parts, ch)
+            i += 1
+            if ch in quotes and quote in (None, ch):
+                quote = ch if quote is None else None
+                word = word or []
+            elif ch in ' \t' and quote is None:
+                if word is not None:
+                    words.append(word)
+                word = None
+            else:
+                if (quote is None and ch in self.SHELL_CHARS) or (ch in '$`' and quote != "'"):
+                    direct = False
+                word = word or []
+                self._append(word, ch)
+        if word is not None:
+            words.append(word)
+        if direct and quote is None and words and len(words[0]) == 1 and isinstance(words[0][0], str):
+            program = words[0][0]
+            if '=' not in program and program not in CommandParser.SHELL_KEYWORDS:
+                self.words = words
+
+    def _append(self, parts, text):
+        if parts and isinstance(parts[-1], str):
+            parts[-1] += text
+        else:
+            parts.append(text)
+
+    def render(self, args):
+        out = []
+        for part in self.parts:
+            if isinstance(part, str):
+                out.append(part)
+            else:
+                out.append(self._quote(self._values(part, args), part[2]))
+        return ''.join(out)
+
+    def argv(self, args):
+        argv = []
+        for word in self.words:
+            if len(word) == 1 and not isinstance(word[0], str):
+                # A bare slot may expand to several words ($@) or to none (unquoted, missing)
+                values = self._values(word[0], args)
+                argv.extend(values if values or word[0][2] is None else [''])
+            else:
+                argv.append(''.join(
+                    part if isinstance(part, str) else ' '.join(self._values(part, args)) for part in word
+                ))
+        return argv
+
+    def executable(self, cwd=None, env=None):
+        # Looked up the way the session will start it: its own PATH, relative names under its directory
+        name = self.words[0][0]
+        cwd = cwd or os.getcwd()
+        if '/' in name or os.sep in name:
+            return shutil.which(os.path.join(cwd, name))
+        path = (env if env is not None else os.environ).get('PATH', os.defpath)
+        path = os.pathsep.join(os.path.join(cwd, entry) for entry in path.split(os.pathsep))
+        if self.program is None or self.program[0] != path:
+            self.program = (path, shutil.which(name, path=path))
+        return self.program[1]
+
+    def _values(self, slot, args):
+        index, default, quote = slot
+        if index == 0:
+            return list(args) if quote is not None else [arg for arg in args if arg != '']
+        value = args[index - 1] if index <= len(args) else ''
+        if value == '' and default is not None:
+            value = default
+        return [value] if value != '' or quote is not None else []
+
+    def _quote(self, values, quote):
+        if self.language == 'python':
+            if quote is None:
+                return ' '.join(values)
+            text = ' '.join(values).replace('\\', '\\\\').replace(quote, '\\' + quote)
+            return text.replace('\n', '\\n').replace('\r', '\\r')
+        # Inside quotes "$@" still gives one word per argument, as it does when the template runs directly
+        separator = f"{quote} {quote}"
+        if not self.posix:
+            if quote is None:
+                return subprocess.list2cmdline(values)
+            return separator.join(value.replace('"', '\\"') for value in values)
+        if quote is None:
+            return ' '.join(shlex.quote(value) for value in values)
+        if quote == "'":
+            return separator.join(value.replace("'", "'\\''") for value in values)
+        return separator.join(re.sub(r'([\\"$`])', r'\\\1', value) for value in values)
+
+
+class CodeCache:
+    def __init__(self, max_entries=128):
+        self.max_entries = max_entries
+        self.entries = collections.OrderedDict()
+        # Shared by every session and job thread running in-process commands
+        self.lock = threading.Lock()
+
+    def compile(self, source, name='<command>'):
+        with self.lock:
+            code = self.entries.get(source)
+            if code is not None:
+                self.entries.move_to_end(source)
+                return code
+        code = compile(source, name, 'exec')
+        with self.lock:
+            self.entries[source] = code
+            if len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+        return code
+
+
+class ThreadOutput:
+    # Stands in for sys.stdout or sys.stderr so print() from in-process code can be captured. Only the
+    # thread running the code is redirected; prompts, jobs and other sessions keep the real stream
+    lock = threading.Lock()
+
+    def __init__(self, stream):
+        self.stream = stream
+        self.local = threading.local()
+
+    def write(self, text):
+        buffer = getattr(self.local, 'buffer', None)
+        return (self.stream if buffer is None else buffer).write(text)
+
+    def flush(self):
+        if getattr(self.local, 'buffer', None) is None:
+            self.stream.flush()
+
+    def __getattr__(self, name):
+        return getattr(self.stream, name)
+
+    @classmethod
+    @contextlib.contextmanager
+    def capture(cls):
+        buffer = io.StringIO()
+        with cls.lock:
+            streams = []
+            for name in ('stdout', 'stderr'):
+                stream = getattr(sys, name)
+                if not isinstance(stream, cls):
+                    stream = cls(stream)
+                    setattr(sys, name, stream)
+                streams.append(stream)
+        previous = [getattr(stream.local, 'buffer', None) for stream in streams]
+        for stream in streams:
+            stream.local.buffer = buffer
+        try:
+            yield buffer
+        finally:
+            for stream, saved in zip(streams, previous):
+                stream.local.buffer = saved
+
+
+class CachePolicy:
+    # `cache = ...` in a command's section: a lifetime (300, 90s, 10m, 2h, 1d), files:<glob> patterns
+    # whose files invalidate the result when they change, are added or are removed, or both, comma separated
+    DURATION = re.compile(r'^(\d+(?:\.\d+)?)\s*([smhd]?)$')
+    UNITS = {'': 1, 's': 1, 'm': 60, 'h': 3600, 'd': 86400}
+
+    def __init__(self, ttl=None, patterns=()):
+        self.ttl = ttl
+        self.patterns = tuple(patterns)
+
+    @classmethod
+    def parse(cls, text):
+        text = (text or '').strip()
+        if text.lower() in ('', '0', 'no', 'off', 'false'):
+            return None
+        ttl, patterns = None, []
+        for item in text.split(','):
+            item = item.strip()
+            if item.startswith('files:'):
+                pattern = item[len('files:'):].strip()
+                if not pattern:
+                    raise ValueError("cache = files: needs a glob pattern")
+                patterns.append(pattern)
+                continue
+            match = cls.DURATION.match(item)
+            if not match:
+                raise ValueError(f"invalid cache setting '{item}' (expected a lifetime such as 300 or 10m, "
+                                 f"or files:<glob>)")
+            ttl = float(match.group(1)) * cls.UNITS[match.group(2)]
+        return cls(ttl, patterns)
+
+    def files(self, cwd):
+        # (path, mtime_ns, size) of every file the patterns match right now
+        import glob
+        found = set()
+        for pattern in self.patterns:
+            found.update(glob.glob(os.path.join(cwd, os.path.expanduser(pattern)), recursive=True))
+        signature = []
+        for path in sorted(found):
+            try:
+                st = os.stat(path)
+            except OSError:
+                continue
+            signature.append((path, st.st_mtime_ns, st.st_size))
+        return signature
+
+    def fresh(self, entry, files):
+        if self.ttl is not None and time.time() - entry['created'] >= self.ttl:
+            return False
+        return not self.patterns or entry['files'] == files
+
+    def __str__(self):
+        items = []
+        if self.ttl is not None:
+            unit = next(unit for unit in 'dhms' if unit == 's' or self.ttl % self.UNITS[unit] == 0)
+            items.append(f"{self.ttl / self.UNITS[unit]:g}{unit}")
+        items.extend(f"files:{pattern}" for pattern in self.patterns)
+        return ', '.join(items)
+
+
+class OutputCache:
+    # Results of custom commands that opt in with `cache = ...`, keyed on the command name, the expanded
+    # command, the working directory and the arguments. Recent results stay in memory; every result is also
+    # written to a file of its own, so other sessions and later runs reuse it. Only successful runs are kept
+    def __init__(self, cache_dir='~/.pythoncmd_cache/output', max_entries=256, max_bytes=32 * 1024 * 1024,
+                 max_disk_bytes=256 * 1024 * 1024):
+        self.cache_dir = os.path.expanduser(cache_dir) if cache_dir else None
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.max_disk_bytes = max_disk_bytes
+        # file name -> entry, least recently used first
+        self.entries = collections.OrderedDict()
+        self.memory_bytes = 0
+        self.disk_bytes = None
+        # command name -> [hits, misses, invalidated, seconds saved]
+        self.stats = {}
+        self.lock = threading.Lock()
+
+    def run(self, command, args, context):
+        import hashlib
+        policy = command.cache
+        key = repr((command.name, command.expand(*args), context.cwd, tuple(args)))
+        # The file name starts with the command's own prefix, so its results can be cleared without reading them
+        ident = self.prefix(command.name) + hashlib.sha256(key.encode('utf-8', 'surrogatepass')).hexdigest()[:32]
+        # Taken before running, so a file that changes while the command runs invalidates the result
+        files = policy.files(context.cwd) if policy.patterns else None
+        with self.lock:
+            stats = self.stats.setdefault(command.name, [0, 0, 0, 0.0])
+            entry = self.entries.get(ident)
+            if entry is not None:
+                self.entries.move_to_end(ident)
+        if entry is None:
+            entry = self._read(ident)
+        if entry is not None:
+            if entry['key'] == key and policy.fresh(entry, files):
+                with self.lock:
+                    stats[0] += 1
+                    stats[3] += entry['duration']
+                    self._remember(ident, entry)
+                return entry['output'], entry['errors'], 0
+            with self.lock:
+                stats[2] += 1
+                self._forget(ident)
+            self._unlink(ident)
+        with self.lock:
+            stats[1] += 1
+        started = time.monotonic()
+        output, errors, status = command.capture(args, context.cwd, context.env, context.timeout)
+        if status == 0:
+            entry = {'key': key, 'name': command.name, 'output': str(output or ''), 'errors': errors,
+                     'created': time.time(), 'duration': time.monotonic() - started, 'files': files}
+            with self.lock:
+                self._remember(ident, entry)
+            self._write(ident, entry)
+        return output, errors, status
+
+    def clear(self, name=None):
+        prefix = self.prefix(name) if name else ''
+        with self.lock:
+            removed = {ident for ident in self.entries if ident.startswith(prefix)}
+            for ident in removed:
+                self._forget(ident)
+            self.disk_bytes = None
+        for entry in self._files():
+            if entry.name.startswith(prefix):
+                removed.add(entry.name)
+                self._unlink(entry.name)
+        return len(removed)
+
+    def report(self, policies):
+        with self.lock:
+            stats = {name: list(values) for name, values in self.stats.items()}
+            memory = collections.Counter(ident[:9] for ident in self.entries)
+            memory_entries, memory_bytes = len(self.entries), self.memory_bytes
+        disk = collections.Counter()
+        disk_bytes = 0
+        for entry in self._files():
+            disk[entry.name[:9]] += 1
+            try:
+                disk_bytes += entry.stat().st_size
+            except OSError:
+                pass
+        names = sorted(set(policies) | set(stats))
+        if not names:
+            yield f"{Style.YELLOW}No cached commands. Add 'cache = <lifetime>' or 'cache = files:<glob>' to a command in commands.cfg.{Style.RESET}"
+            return
+        yield (f"{Style.CYAN}{'command':<16} {'policy':<24} {'hits':>6} {'misses':>6} {'stale':>6} "
+               f"{'hit rate':>8} {'memory':>6} {'disk':>6} {'saved':>9}{Style.RESET}")
+        for name in names:
+            hits, misses, stale, saved = stats.get(name, (0, 0, 0, 0.0))
+            policy = str(policies[name]) if name in policies else '(removed)'
+            rate = f"{hits * 100 / (hits + misses):.0f}%" if hits + misses else '-'
+            prefix = self.prefix(name)
+            yield (f"{name[:16]:<16} {policy[:24]:<24} {hits:>6} {misses:>6} {stale:>6} {rate:>8} "
+                   f"{memory[prefix]:>6} {disk[prefix]:>6} {self._duration(saved):>9}")
+        yield ""
+        yield (f"Memory: {memory_entries} result(s), {TransferEngine.format_size(memory_bytes)} of "
+               f"{TransferEngine.format_size(self.max_bytes)}; disk: {sum(disk.values())} result(s), "
+               f"{TransferEngine.format_size(disk_bytes)} of {TransferEngine.format_size(self.max_disk_bytes)}")
+
+    @staticmethod
+    def prefix(name):
+        return f"{zlib.crc32(name.encode('utf-8', 'surrogatepass')):08x}-"
+
+    def _duration(self, seconds):
+        if seconds < 1:
+            return f"{seconds * 1000:.0f}ms"
+        return f"{seconds:.1f}s"
+
+    def _remember(self, ident, entry):
+        # Called with the lock held. Results too large to keep in memory are still served from disk
+        self._forget(ident)
+        size = len(entry['output']) + len(entry['errors'])
+        if size > self.max_bytes // 8:
+            return
+        self.entries[ident] = entry
+        self.memory_bytes += size
+        while len(self.entries) > self.max_entries or self.memory_bytes > self.max_bytes:
+            _, oldest = self.entries.popitem(last=False)
+            self.memory_bytes -= len(oldest['output']) + len(oldest['errors'])
+
+    def _forget(self, ident):
+        entry = self.entries.pop(ident, None)
+        if entry is not None:
+            self.memory_bytes -= len(entry['output']) + len(entry['errors'])
+
+    def _read(self, ident):
+        if not self.cache_dir:
+            return None
+        path = os.path.join(self.cache_dir, ident)
+        try:
+            with open(path, 'rb') as f:
+                entry = marshal.load(f)
+            # The modification time orders files for eviction, so a hit makes a result recent again
+            os.utime(path)
+        except (OSError, EOFError, ValueError, TypeError):
+            return None
+        # Results written before error output was kept apart have it mixed into 'output'; they are run again
+        return entry if isinstance(entry, dict) and 'key' in entry and 'errors' in entry else None
+
+    def _write(self, ident, entry):
+        if not self.cache_dir:
+            return
+        data = marshal.dumps(entry)
+        if len(data) > self.max_disk_bytes // 8:
+            return
+        try:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            fd, temp_path = tempfile.mkstemp(dir=self.cache_dir, prefix='.out-')
+            with os.fdopen(fd, 'wb') as f:
+                f.write(data)
+            os.replace(temp_path, os.path.join(self.cache_dir, ident))
+        except OSError:
+            return
+        with self.lock:
+            if self.disk_bytes is not None:
+                self.disk_bytes += len(data)
+        if self.disk_bytes is None or self.disk_bytes > self.max_disk_bytes:
+            self._trim()
+
+    def _trim(self):
+        # Least recently used files go first, down to three quarters of the limit
+        files = []
+        for entry in self._files():
+            try:
+                st = entry.stat()
+            except OSError:
+                continue
+            files.append((st.st_mtime_ns, st.st_size, entry.name))
+        total = sum(size for _, size, _ in files)
+        if total > self.max_disk_bytes:
+            files.sort()
+            for _, size, name in files:
+                if total <= self.max_disk_bytes * 3 // 4:
+                    break
+                self._unlink(name)
+                total -= size
+        with self.lock:
+            self.disk_bytes = total
+
+    def _files(self):
+        if not self.cache_dir:
+            return []
+        try:
+            with os.scandir(self.cache_dir) as it:
+                return [entry for entry in it if not entry.name.startswith('.')]
+        except OSError:
+            return []
+
+    def _unlink(self, ident):
+        try:
+            os.unlink(os.path.join(self.cache_dir, ident))
+        except (OSError, TypeError):
+            pass
+
+
+class PythonWorker:
+    def __init__(self, memory_limit=None):
+        # memory_limit is in megabytes and only enforced where the resource module exists. It is the
+        # only limit: the code runs with the shell's own user, files and environment
+        self.memory_limit = memory_limit
+        self.process = None
+        self.connection = None
+        self.lock = threading.Lock()
+
+    def run(self, source, name, args=(), timeout=None, cwd=None):
+        with self.lock:
+            if self.process is None or not self.process.is_alive():
+                self.start()
+            try:
+                self.connection.send((source, name, list(args), cwd or os.getcwd()))
+                if not self.connection.poll(timeout):
+                    self.stop()
+                    return f"{Style.RED}Python worker timed out after {timeout}s{Style.RESET}", 124
+                status, output = self.connection.recv()
+            except KeyboardInterrupt:
+                # The worker may still be running the code; start a fresh one next time
+                self.stop()
+                raise
+            except (EOFError, OSError):
+                self.stop()
+                return f"{Style.RED}Python worker exited unexpectedly{Style.RESET}", 1
+        return output, status
+
+    def start(self):
+        context = FileSearch.process_context()
+        self.connection, child = context.Pipe()
+        self.process = context.Process(
+            target=PythonWorker.serve, args=(child, self.memory_limit), daemon=True
+        )
+        self.process.start()
+        child.close()
+
+    def stop(self):
+        if self.process is not None:
+            self.process.kill()
+            self.process.join()
+            self.connection.close()
+        self.process = None
+        self.connection = None
+
+    @staticmethod
+    def serve(connection, memory_limit):
+        signal.signal(signal.SIGINT, signal.SIG_IGN)
+        if resource is not None and memory_limit:
+            limit = memory_limit * 1024 * 1024
+            resource.setrlimit(resource.RLIMIT_AS, (limit, limit))
+        cache = CodeCache()
+        while True:
+            try:
+                source, name, args, cwd = connection.recv()
+            except EOFError:
+                return
+            buffer = io.StringIO()
+            stdout, stderr = sys.stdout, sys.stderr
+            sys.stdout = sys.stderr = buffer
+            try:
+                os.chdir(cwd)
+                namespace = {'__name__': '__main__', 'args': args, 'cwd': cwd}
+                exec(cache.compile(source, name), namespace)
+                result = namespace.get('result')
+                status = 0
+            except BaseException as e:
+                result = f"{Style.RED}Error executing command: {str(e)}{Style.RESET}"
+                status = 1
+            finally:
+                sys.stdout, sys.stderr = stdout, stderr
+            output = buffer.getvalue()
+            if result is not None and str(result) != '':
+                output += str(result)
+            connection.send((status, output))
+
+
+class CustomCommand:
+    code_cache = CodeCache()
+
+    def __init__(self, name, command, help_text, args=None, executor=None, worker=None, cache=''):
+        self.name = name
+        self.command = command
+        self.help_text = help_text
+        self.args = args or []
+        self.executor = executor or StreamingExecutor()
+        self.worker = worker
+        self.cache = CachePolicy.parse(cache)
+        # Parsed once; each call only fills in the argument slots
+        self.python = self.is_python(command)
+        if self.python:
+            self.template = CommandTemplate(self.python_source(command), 'python')
+        else:
+            self.template = CommandTemplate(command)
+
+    def expand(self, *args):
+        return self.template.render(args)
+
+    def external(self, args, cwd=None, env=None):
+        # An argv list is run directly, without starting a shell
+        if self.template.words is not None and self.template.executable(cwd, env):
+            return self.template.argv(args)
+        return self.template.render(args)
+
+    def is_python(self, cmd):
+        return cmd.startswith('python -c')
+
+    def python_source(self, cmd):
+        source = cmd[len('python -c'):].strip()
+        # Remove exactly one pair of enclosing quotes, leaving quotes inside the code alone
+        for quote in ('"""', "'''", '"', "'"):
+            if len(source) >= 2 * len(quote) and source.startswith(quote) and source.endswith(quote):
+                return source[len(quote):-len(quote)]
+        return source
+
+    def run_python(self, source, args=(), cwd=None, timeout=None):
+        name = f"<{self.name}>"
+        if self.worker is not None:
+            return self.worker.run(source, name, args, timeout, cwd)
+        # In-process code shares the shell's working directory; cwd names the session's own
+        exec_globals = {'__name__': '__main__', 'args': list(args), 'cwd': cwd or os.getcwd()}
+        # What the code prints is part of its output, as it is in the worker, so it reaches the sink or pipe
+        with ThreadOutput.capture() as buffer:
+            try:
+                exec(self.code_cache.compile(source, name), exec_globals)
+                result, status = exec_globals.get('result'), 0
+            except Exception as e:
+                result, status = f"{Style.RED}Error executing command: {str(e)}{Style.RESET}", 1
+        output = buffer.getvalue()
+        if result is not None and str(result) != '':
+            output += str(result)
+        return output, status
+
+    def execute(self, *args):
+        try:
+            if self.python:
+                return self.run_python(self.expand(*args), args)[0]
+            # Execute as a system command, streaming its output
+            command = self.external(args)
+            self.executor.run(command, shell=isinstance(command, str))
+            return ""
+        except Exception as e:
+            return f"{Style.RED}Error executing command: {str(e)}{Style.RESET}"
+
+    def invoke(self, args, stdin=None, cwd=None, timeout=None):
+        try:
+            return self.run_python(self.expand(*args), args, cwd, timeout)
+        except Exception as e:
+            return f"{Style.RED}Error executing command: {str(e)}{Style.RESET}", 1
+
+    def capture(self, args, cwd=None, env=None, timeout=None):
+        # Runs to completion, for the output cache, and returns (output, error output, status). Nothing is
+        # shown until the command has finished
+        if self.python:
+            output, status = self.invoke(args, None, cwd, timeout)
+            return output, '', status
+        command = self.external(args, cwd, env)
+        try:
+            proc = subprocess.run(
+                command, shell=isinstance(command, str), cwd=cwd, env=env, stdin=subprocess.DEVNULL,
+                stdout=subprocess.PIPE, stderr=subprocess.PIPE, timeout=timeout
+            )
+        except subprocess.TimeoutExpired:
+            return '', f"Command execution timed out after {timeout} seconds.\n", 124
+        encoding = self.executor.encoding
+        output = proc.stdout.decode(encoding, errors='replace')
+        errors = proc.stderr.decode(encoding, errors='replace')
+        return output, errors, proc.returncode
+
+    def get_help(self):
+        args_help = ' '.join(f'<{arg}>' for arg in self.args)
+        return f"{self.name} {args_help}\n  {self.help_text}"
+
+class FileEntry:
+    __slots__ = ('name', 'is_dir', 'size', 'mtime')
+
+    def __init__(self, name, is_dir, size, mtime):
+        self.name = name
+        self.is_dir = is_dir
+        self.size = size
+        self.mtime = mtime
+
+
+class DirectoryScanner:
+    SORT_KEYS = {
+        'name': lambda entry: entry.name.lower(),
+        'size': operator.attrgetter('size'),
+        'date': operator.attrgetter('mtime'),
+    }
+
+    def __init__(self, max_directories=64):
+        self.max_directories = max_directories
+        # path -> (directory mtime_ns, entries by name, sorted views by sort key)
+        self.cache = collections.OrderedDict()
+
+    def scan(self, path):
+        mtime = os.stat(path).st_mtime_ns
+        cached = self.cache.get(path)
+        if cached and cached[0] == mtime:
+            self.cache.move_to_end(path)
+            return cached[1].values()
+        entries = {}
+        with os.scandir(path) as it:
+            for entry in it:
+                try:
+                    st = entry.stat()
+                except OSError:
+                    try:
+                        st = entry.stat(follow_symlinks=False)
+                    except OSError:
+                        continue
+                entries[entry.name] = FileEntry(entry.name, stat.S_ISDIR(st.st_mode), st.st_size, st.st_mtime)
+        self.cache[path] = (mtime, entries, {})
+        while len(self.cache) > self.max_directories:
+            self.cache.popitem(last=False)
+        return entries.values()
+
+    def sorted(self, path, sort_by='name', reverse=False):
+        self.scan(path)
+        views = self.cache[path][2]
+        view = views.get((sort_by, reverse))
+        if view is None:
+            if reverse:
+                view = self.sorted(path, sort_by)[::-1]
+            else:
+                view = sorted(self.cache[path][1].values(), key=self.SORT_KEYS[sort_by])
+            views[(sort_by, reverse)] = view
+        return view
+
+    def update(self, path, names):
+        # Applies a watcher's list of changed names to a cached listing instead of scanning it again
+        cached = self.cache.get(path)
+        if cached is None:
+            return
+        entries, views = cached[1], cached[2]
+        # Reversed views are cheap copies of the forward ones; they are rebuilt on demand
+        for key in [key for key in views if key[1]]:
+            del views[key]
+        for name in names:
+            old = entries.pop(name, None)
+            new = self._entry(path, name)
+            for (sort_by, _), view in views.items():
+                key = self.SORT_KEYS[sort_by]
+                if old is not None:
+                    index = self._locate(view, key, key(old))
+                    while view[index] is not old:
+                        index += 1
+                    del view[index]
+                if new is not None:
+                    view.insert(self._locate(view, key, key(new)), new)
+            if new is not None:
+                entries[name] = new
+        try:
+            mtime = os.stat(path).st_mtime_ns
+        except OSError:
+            self.invalidate(path)
+            return
+        self.cache[path] = (mtime, entries, views)
+
+    def _entry(self, path, name):
+        full_path = os.path.join(path, name)
+        try:
+            st = os.stat(full_path)
+        except OSError:
+            try:
+                st = os.lstat(full_path)
+            except OSError:
+                return None
+        return FileEntry(name, stat.S_ISDIR(st.st_mode), st.st_size, st.st_mtime)
+
+    def _locate(self, view, key, value):
+        low, high = 0, len(view)
+        while low < high:
+            middle = (low + high) // 2
+            if key(view[middle]) < value:
+                low = middle + 1
+            else:
+                high = middle
+        return low
+
+    def invalidate(self, path):
+        self.cache.pop(path, None)
+
+
+class DirectoryWatcher:
+    # inotify(7) constants
+    IN_MODIFY = 0x2
+    IN_ATTRIB = 0x4
+    IN_CLOSE_WRITE = 0x8
+    IN_MOVED_FROM = 0x40
+    IN_MOVED_TO = 0x80
+    IN_CREATE = 0x100
+    IN_DELETE = 0x200
+    IN_DELETE_SELF = 0x400
+    IN_MOVE_SELF = 0x800
+    IN_Q_OVERFLOW = 0x4000
+    IN_IGNORED = 0x8000
+    IN_ONLYDIR = 0x1000000
+    MASK = (IN_MODIFY | IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE
+            | IN_DELETE_SELF | IN_MOVE_SELF | IN_ONLYDIR)
+    EVENT = struct.Struct('iIII')
+
+    def __init__(self, interval=1.0):
+        # Seconds between checks when inotify is not available
+        self.interval = interval
+        self.path = None
+        self.mtime = None
+        self.libc = None
+        self.fd = None
+        self.wd = None
+        if sys.platform.startswith('linux'):
+            try:
+                self._init_inotify()
+            except (OSError, AttributeError):
+                self.fd = None
 
-    def add_command(self, name, function, help_text, arguments=None):
-        self.commands[name] = Command(name, function, help_text, arguments)
+    def _init_inotify(self):
+        import ctypes
+        import ctypes.util
+        libc = ctypes.CDLL(ctypes.util.find_library('c') or None, use_errno=True)
+        fd = libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if fd < 0:
+            code = ctypes.get_errno()
+            raise OSError(code, os.strerror(code))
+        self.libc = libc
+        self.fd = fd
 
-    def add_custom_command_interactive(self):
-        name = input("Enter command name: ").strip()
-        command = input("Enter command to execute: ").strip()
-        help_text = input("Enter help text: ").strip()
-        args = input("Enter argument names (space-separated): ").strip().split()
-        self.add_custom_command(name, command, help_text, args)
-        return f"{Style.GREEN}Custom command '{name}' added successfully.{Style.RESET}"
+    def fileno(self):
+        # Readable when events are waiting; None while polling
+        return self.fd if self.wd is not None else None
 
-    def list_custom_commands(self):
-        if not self.custom_commands:
-            return f"{Style.YELLOW}No custom commands defined.{Style.RESET}"
-        return "\n".join(f"{name}: {cmd.help_text}" for name, cmd in self.custom_commands.items())
+    @property
+    def timeout(self):
+        return None if self.wd is not None else self.interval
 
-    def load_config(self):
-        if os.path.exists(self.config_file):
-            with open(self.config_file, 'r') as f:
-                for line in f:
-                    if '=' in line:
-                        key, value = line.strip().split('=', 1)
-                        self.aliases[key] = value
-
-    def save_config(self):
-        with open(self.config_file, 'w') as f:
-            for key, value in self.aliases.items():
-                f.write(f"{key}={value}\n")
+    def watch(self, path):
+        if path == self.path:
+            return
+        self.unwatch()
+        self.path = path
+        self.mtime = self._mtime()
+        if self.fd is not None:
+            wd = self.libc.inotify_add_watch(self.fd, os.fsencode(path), self.MASK)
+            # Out of watches (or a file system without inotify): poll this directory instead
+            self.wd = wd if wd >= 0 else None
 
-    def print_colored(self, text, color):
-        print(f"{color}{text}{Style.RESET}")
+    def unwatch(self):
+        if self.wd is not None:
+            self.libc.inotify_rm_watch(self.fd, self.wd)
+            self.wd = None
+        self.path = None
 
-    def print_typewriter(self, text, delay=0.002):
-        for char in text:
-            sys.stdout.write(char)
-            sys.stdout.flush()
-            time.sleep(delay)
-        print()
+    def read(self):
+        # The names that changed in the watched directory since the last call, or None if the
+        # whole directory has to be read again
+        if self.path is None:
+            return set()
+        if self.wd is None:
+            mtime = self._mtime()
+            if mtime == self.mtime:
+                return set()
+            self.mtime = mtime
+            return None
+        names = set()
+        rescan = False
+        while True:
+            try:
+                data = os.read(self.fd, 64 * 1024)
+            except BlockingIOError:
+                break
+            offset = 0
+            while offset < len(data):
+                wd, mask, _, length = self.EVENT.unpack_from(data, offset)
+                name = data[offset + self.EVENT.size:offset + self.EVENT.size + length].rstrip(b'\0')
+                offset += self.EVENT.size + length
+                if mask & self.IN_Q_OVERFLOW:
+                    rescan = True
+                elif wd != self.wd:
+                    continue
+                elif mask & (self.IN_DELETE_SELF | self.IN_MOVE_SELF | self.IN_IGNORED) or not name:
+                    rescan = True
+                else:
+                    names.add(os.fsdecode(name))
+        return None if rescan else names
 
-    def display_header(self):
-        term_width = os.get_terminal_size().columns
-        header = f"{Style.BACKGROUND_BLUE}{Style.WHITE}{Style.BOLD} Python CMD Emulator {Style.RESET}"
-        print(header.center(term_width))
-        print(f"{Style.YELLOW}{'─' * term_width}{Style.RESET}")
+    def close(self):
+        self.unwatch()
+        if self.fd is not None:
+            os.close(self.fd)
+            self.fd = None
 
-    def display_status(self):
-        term_width = os.get_terminal_size().columns
-        current_dir = os.getcwd()
-        status = f"{Style.CYAN}Dir: {current_dir} | History: {len(self.history)} | Aliases: {len(self.aliases)}{Style.RESET}"
-        print(status.ljust(term_width))
-  
-    def print_centered(self, text):
-        terminal_width = 80  # Assuming a default width
-        for line in text.split('\n'):
-            print(line.center(terminal_width))
+    def _mtime(self):
+        try:
+            return os.stat(self.path).st_mtime_ns
+        except OSError:
+            return None
 
-    def clear_screen(self):
-        os.system('cls' if os.name == 'nt' else 'clear')
-        return ""
 
-    def change_directory(self, path="."):
+class DiskUsage:
+    def __init__(self, cache_path='~/.pythoncmd_cache/du.cache', workers=None, max_entries=500000):
+        self.cache_path = os.path.expanduser(cache_path) if cache_path else None
+        # scandir and stat wait on the disk, not the interpreter, so threads overlap them well
+        self.workers = workers or min(32, (os.cpu_count() or 1) * 4)
+        self.max_entries = max_entries
+        # (st_dev, st_ino) of a directory -> (st_mtime_ns, bytes, files, hardlinks, subdirectory names).
+        # A directory's mtime only changes when entries are added, removed or renamed, so a matching
+        # record stands in for reading it again; its subdirectories are still checked one by one
+        self.entries = None
+        self.dirty = False
+        self.pool = None
+        self.lock = threading.Lock()
+
+    def measure(self, root, one_filesystem=False, refresh=False):
+        # Returns ({directory: [bytes, files]} for every directory under root, unreadable entries)
+        import concurrent.futures
+        root = os.path.abspath(root)
+        root_stat = os.lstat(root)
+        if not stat.S_ISDIR(root_stat.st_mode):
+            return {root: [self.usage(root_stat), 1]}, 0
+        with self.lock:
+            if self.entries is None:
+                self.entries = self._load()
+            if self.pool is None:
+                self.pool = concurrent.futures.ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='du')
+        records = {}
+        errors = 0
+        pending = {self.pool.submit(self._visit, root, root_stat, refresh): root}
         try:
-            os.chdir(os.path.expanduser(path))
-            return f"Changed directory to {os.getcwd()}"
-        except Exception as e:
-            return f"Error changing directory: {str(e)}"
+            while pending:
+                done, _ = concurrent.futures.wait(pending, return_when=concurrent.futures.FIRST_COMPLETED)
+                for future in done:
+                    path = pending.pop(future)
+                    record, children, failed = future.result()
+                    errors += failed
+                    records[path] = record + ([child for child, _ in children],)
+                    for child, child_stat in children:
+                        if one_filesystem and child_stat.st_dev != root_stat.st_dev:
+                            continue
+                        pending[self.pool.submit(self._visit, child, child_stat, refresh)] = child
+        finally:
+            for future in pending:
+                future.cancel()
+        self.save()
+        return self._totals(records), errors
 
-    def list_directory(self):
+    def _visit(self, path, st, refresh):
+        key = (st.st_dev, st.st_ino)
+        cached = None if refresh else self.entries.get(key)
+        if cached is not None and cached[0] == st.st_mtime_ns:
+            children = []
+            for name in cached[4]:
+                child = os.path.join(path, name)
+                try:
+                    child_stat = os.lstat(child)
+                except OSError:
+                    break
+                if not stat.S_ISDIR(child_stat.st_mode):
+                    break
+                children.append((child, child_stat))
+            else:
+                return cached[1:4], children, 0
+        size = self.usage(st)
+        files = 0
+        errors = 0
+        links = []
+        names = []
+        children = []
         try:
-            files = os.listdir()
-            return "\n".join([f"{Style.BLUE if os.path.isdir(f) else Style.GREEN}{f}{Style.RESET}" for f in files])
-        except Exception as e:
-            return f"Error listing directory: {str(e)}"
+            with os.scandir(path) as it:
+                for entry in it:
+                    try:
+                        entry_stat = entry.stat(follow_symlinks=False)
+                    except OSError:
+                        errors += 1
+                        continue
+                    if stat.S_ISDIR(entry_stat.st_mode):
+                        names.append(entry.name)
+                        children.append((entry.path, entry_stat))
+                    elif entry_stat.st_nlink > 1:
+                        # Counted once per file however many names it has, in _totals
+                        links.append((entry_stat.st_dev, entry_stat.st_ino, self.usage(entry_stat)))
+                    else:
+                        size += self.usage(entry_stat)
+                        files += 1
+        except OSError:
+            return (size, 0, ()), [], 1
+        record = (st.st_mtime_ns, size, files, tuple(links), tuple(names))
+        with self.lock:
+            self.entries.pop(key, None)
+            self.entries[key] = record
+            self.dirty = True
+        return record[1:4], children, errors
 
-    def echo(self, text=""):
-        return text
+    def _totals(self, records):
+        totals = {path: [size, files] for path, (size, files, _, _) in records.items()}
+        seen = set()
+        for path in sorted(records):
+            for dev, ino, size in records[path][2]:
+                if (dev, ino) not in seen:
+                    seen.add((dev, ino))
+                    totals[path][0] += size
+                    totals[path][1] += 1
+        # Deepest directories first, so every child is complete before it is added to its parent
+        for path in sorted(records, key=lambda path: path.count(os.sep), reverse=True):
+            for child in records[path][3]:
+                if child in totals:
+                    totals[path][0] += totals[child][0]
+                    totals[path][1] += totals[child][1]
+        return totals
 
-    def print_working_directory(self):
-        return os.getcwd()
+    def usage(self, st):
+        # Space actually allocated, like du; sparse files count for less than their length
+        blocks = getattr(st, 'st_blocks', None)
+        return blocks * 512 if blocks is not None else st.st_size
 
-    def show_history(self):
-        return "\n".join(f"{Style.YELLOW}{i}{Style.RESET}: {cmd}" for i, cmd in enumerate(self.history, 1))
+    def report(self, root, depth=1, one_filesystem=False, refresh=False, label=None):
+        started = time.monotonic()
+        totals, errors = self.measure(root, one_filesystem, refresh)
+        root = os.path.abspath(root)
+        label = label or root
+        base = root.rstrip(os.sep).count(os.sep)
+        rows = [(size, files, path) for path, (size, files) in totals.items()
+                if path != root and path.count(os.sep) - base <= depth]
+        for size, files, path in sorted(rows, reverse=True):
+            name = os.path.join(label, os.path.relpath(path, root))
+            yield f"{TransferEngine.format_size(size):>10} {files:>10,} files  {Style.BLUE}{name}{Style.RESET}"
+        size, files = totals[root]
+        yield (f"{Style.BOLD}{TransferEngine.format_size(size):>10} {files:>10,} files  {label}{Style.RESET} "
+               f"{Style.DIM}({len(totals):,} directories, {time.monotonic() - started:.2f}s){Style.RESET}")
+        if errors:
+            yield f"{Style.YELLOW}{errors} entries could not be read.{Style.RESET}"
 
-    def create_alias(self, name, command):
-        self.aliases[name] = command
-        self.save_config()
-        return f"Alias created: {name} -> {command}"
+    def save(self):
+        with self.lock:
+            if not self.dirty or not self.cache_path:
+                return
+            self.dirty = False
+            # Oldest records go first; a record moves to the end whenever its directory is read again
+            while len(self.entries) > self.max_entries:
+                del self.entries[next(iter(self.entries))]
+            data = marshal.dumps(self.entries)
+        try:
+            os.makedirs(os.path.dirname(self.cache_path), exist_ok=True)
+            fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(self.cache_path), prefix='.du-')
+            with os.fdopen(fd, 'wb') as f:
+                f.write(data)
+            os.replace(temp_path, self.cache_path)
+        except OSError:
+            pass
 
-    def show_help(self, command=None):
-        if command:
-            if command in self.commands:
-                return self.format_command_help(self.commands[command])
-            elif command in self.custom_commands:
-                return self.format_command_help(self.custom_commands[command])
-            else:
-                return f"{Style.RED}No help available for '{command}'.{Style.RESET}"
-        
-        term_width = shutil.get_terminal_size().columns
-        
-        help_text = self.create_header("PYTHON CMD EMULATOR HELP", term_width)
-        
-        help_text += self.format_command_section("Base Commands", self.commands)
-        
-        if self.custom_commands:
-            help_text += self.format_command_section("Custom Commands", self.custom_commands)
-        
-        help_text += f"\n{Style.CYAN}For more information on a specific command, type: {Style.BOLD}help <command>{Style.RESET}\n"
-        help_text += "=" * term_width + "\n"
-        
-        return help_text
+    def _load(self):
+        if not self.cache_path:
+            return {}
+        try:
+            with open(self.cache_path, 'rb') as f:
+                entries = marshal.load(f)
+        except (OSError, EOFError, ValueError, TypeError):
+            return {}
+        return entries if isinstance(entries, dict) else {}
 
-    def create_header(self, text, width):
-        padding = "=" * ((width - len(text) - 2) // 2)
-        return f"\n{Style.BOLD}{Style.BLUE}{padding} {text} {padding}{Style.RESET}\n\n"
+    def shutdown(self):
+        if self.pool is not None:
+            self.pool.shutdown(wait=False, cancel_futures=True)
+            self.pool = None
 
-    def format_command_section(self, title, commands):
-        section = f"{Style.YELLOW}{title}:{Style.RESET}\n"
-        max_name_length = max(len(cmd.name) for cmd in commands.values())
-        for cmd in commands.values():
-            if cmd.name != 'help':
-                section += f"  {Style.GREEN}{cmd.name.ljust(max_name_length)}{Style.RESET} : {cmd.help_text}\n"
-        return section + "\n"
 
-    def format_command_help(self, command):
-        term_width = shutil.get_terminal_size().columns
-        help_text = self.create_header(f"HELP: {command.name.upper()}", term_width)
-        help_text += f"{Style.CYAN}Usage:{Style.RESET} {command.name} "
-        help_text += " ".join(f"<{arg.name}>" if arg.required else f"[{arg.name}]" for arg in command.arguments)
-        help_text += f"\n\n{Style.YELLOW}Description:{Style.RESET}\n  {command.help_text}\n\n"
-        
-        if command.arguments:
-            help_text += f"{Style.MAGENTA}Arguments:{Style.RESET}\n"
-            for arg in command.arguments:
-                status = f"{Style.GREEN}Required{Style.RESET}" if arg.required else f"{Style.BLUE}Optional{Style.RESET}"
-                default = f" (Default: {arg.default})" if arg.default is not None else ""
-                help_text += f"  {Style.BOLD}{arg.name}{Style.RESET}: {status}{default}\n"
-        
-        return help_text
+class TransferCancelled(Exception):
+    pass
 
-    def display_welcome(self):
-        self.clear_screen()
-        term_width = os.get_terminal_size().columns
-        
-        welcome_text = [
-            f"{Style.BOLD}{Style.BLUE}╔{'═' * (term_width - 2)}╗{Style.RESET}",
-            f"{Style.BOLD}{Style.BLUE}║{' ' * (term_width - 2)}║{Style.RESET}",
-            f"{Style.BOLD}{Style.BLUE}║{Style.GREEN}{'Welcome to the Python CMD Emulator'.center(term_width - 2)}{Style.BLUE}║{Style.RESET}",
-            f"{Style.BOLD}{Style.BLUE}║{' ' * (term_width - 2)}║{Style.RESET}",
-            f"{Style.BOLD}{Style.BLUE}╚{'═' * (term_width - 2)}╝{Style.RESET}",
-        ]
-        
-        for line in welcome_text:
-            self.print_typewriter(line)
-        
-        print(f"\n{Style.CYAN}Type 'help' for a list of commands.{Style.RESET}\n")
-   
-    def exit(self):
-        self.print_typewriter(f"{Style.GREEN}Thank you for using Advanced Python CMD. Goodbye!{Style.RESET}")
-        sys.exit(0)
 
-    def file_manager(self):
-        fm = FileManager()
-        return fm.run()
+class TransferEngine:
+    CHUNK_SIZE = 8 * 1024 * 1024
+    BUFFER_SIZE = 1024 * 1024
 
-    def search_history(self, query):
-        results = [cmd for cmd in self.history if query in cmd]
-        return "\n".join(f"{Style.YELLOW}{i}{Style.RESET}: {cmd}" for i, cmd in enumerate(results, 1))
+    def __init__(self, workers=4, zero_copy_threshold=1024 * 1024, journal_dir=None, stream=None):
+        self.workers = workers
+        self.zero_copy_threshold = zero_copy_threshold
+        self.journal_dir = journal_dir or os.path.expanduser('~/.pythoncmd_transfers')
+        self.stream = stream or sys.stdout
+        self.lock = threading.Lock()
+        self._reset()
 
-    def run(self):
-        self.display_welcome()
-        
-        while True:
+    @property
+    def succeeded(self):
+        return not self.interrupted and not self.errors
+
+    def copy(self, sources, target_dir, move=False):
+        self._reset()
+        target_dir = os.path.abspath(target_dir)
+        verb = "Moved" if move else "Copied"
+        if move:
+            # Within one file system a move is just a rename, whatever the size of the tree
+            remaining = []
+            for src in sources:
+                if self._same_device(src, target_dir):
+                    try:
+                        os.rename(src, os.path.join(target_dir, os.path.basename(src)))
+                        self.renamed += 1
+                        continue
+                    except OSError:
+                        pass
+                remaining.append(src)
+            sources = remaining
+            if not sources:
+                return f"{Style.GREEN}Moved {self.renamed} item(s) by rename{Style.RESET}"
+
+        directories, files, links = self._plan(sources, target_dir)
+        journal_path = self._journal_path('move' if move else 'copy', sources, target_dir)
+        completed = self._read_journal(journal_path)
+        for _, dst in directories:
+            os.makedirs(dst, exist_ok=True)
+        for src, dst in links:
+            if not os.path.lexists(dst):
+                os.symlink(os.readlink(src), dst)
+        pending = [task for task in files if task[1] not in completed]
+        self.total_files = len(pending)
+        self.total_bytes = sum(size for _, _, size in pending)
+        resumed = len(files) - len(pending)
+
+        os.makedirs(self.journal_dir, exist_ok=True)
+        with open(journal_path, 'a', encoding='utf-8') as journal:
+            self._run(pending, lambda task: self._copy_file(task, journal))
+        if self.interrupted:
+            return (f"{Style.YELLOW}Transfer interrupted after {self.files_done} of {self.total_files} file(s); "
+                    f"run it again to resume.{Style.RESET}")
+        if self.errors:
+            path, error = self.errors[0]
+            return (f"{Style.RED}{len(self.errors)} file(s) failed (first: {path}: {error}); "
+                    f"run it again to retry them.{Style.RESET}")
+        for src, dst in reversed(directories):
+            shutil.copystat(src, dst)
+        os.remove(journal_path)
+
+        summary = self._summary(verb, resumed)
+        if move:
+            totals = (self.files_done, self.bytes_done, time.monotonic() - self.started)
+            self.delete(sources)
+            self.files_done, self.bytes_done, elapsed = totals
+            summary = self._summary(verb, resumed, elapsed)
+        return summary
+
+    def delete(self, paths):
+        self._reset()
+        files, directories = [], []
+        for path in paths:
+            if os.path.isdir(path) and not os.path.islink(path):
+                directories.append(path)
+                for kind, entry_path, _ in self._walk(path):
+                    (directories if kind == 'dir' else files).append(entry_path)
+            else:
+                files.append(path)
+        self.total_files = len(files)
+        self._run(files, self._delete_file)
+        if self.interrupted:
+            return f"{Style.YELLOW}Delete interrupted after {self.files_done} of {self.total_files} file(s).{Style.RESET}"
+        for directory in reversed(directories):
             try:
-                current_dir = os.getcwd()
-                user_input = input(f"{Style.BOLD}{Style.BLUE}┌─[{current_dir}]\n└─▶ {Style.RESET}")
-                
-                if user_input.strip():
-                    commands = user_input.split('&&')
-                    for cmd in commands:
-                        cmd = cmd.strip()
-                        self.history.append(cmd)
-                        output = self.execute_command(cmd)
-                        if output:
-                            print(f"\n{output}\n")
-            except KeyboardInterrupt:
-                print(f"\n{Style.YELLOW}Use 'exit' to quit.{Style.RESET}")
-            except EOFError:
-                self.exit()
+                os.rmdir(directory)
+            except OSError as e:
+                self.errors.append((directory, str(e)))
+        if self.errors:
+            path, error = self.errors[0]
+            return f"{Style.RED}{len(self.errors)} item(s) could not be deleted (first: {path}: {error}){Style.RESET}"
+        return (f"{Style.GREEN}Deleted {self.files_done} file(s) and {len(directories)} folder(s) "
+                f"in {time.monotonic() - self.started:.1f}s{Style.RESET}")
 
-    def execute_command(self, command):
-        parts = command.split()
-        cmd_name = parts[0]
-        args = parts[1:]
+    def _reset(self):
+        self.cancelled = threading.Event()
+        self.interrupted = False
+        self.errors = []
+        self.renamed = 0
+        self.files_done = 0
+        self.bytes_done = 0
+        self.total_files = 0
+        self.total_bytes = 0
+        self.started = time.monotonic()
 
-        if cmd_name in self.aliases:
-            return self.execute_command(self.aliases[cmd_name] + ' ' + ' '.join(args))
+    def _plan(self, sources, target_dir):
+        directories, files, links = [], [], []
+        for src in sources:
+            dst = os.path.join(target_dir, os.path.basename(src))
+            if os.path.islink(src):
+                links.append((src, dst))
+            elif os.path.isdir(src):
+                directories.append((src, dst))
+                for kind, path, size in self._walk(src):
+                    target = os.path.join(dst, os.path.relpath(path, src))
+                    if kind == 'dir':
+                        directories.append((path, target))
+                    elif kind == 'link':
+                        links.append((path, target))
+                    else:
+                        files.append((path, target, size))
+            else:
+                files.append((src, dst, os.path.getsize(src)))
+        return directories, files, links
 
-        if cmd_name in self.commands:
-            return self.commands[cmd_name].execute(*args)
-        elif cmd_name in self.custom_commands:
-            return self.custom_commands[cmd_name].execute(*args)
-        else:
+    def _walk(self, root):
+        stack = [root]
+        while stack:
+            with os.scandir(stack.pop()) as entries:
+                for entry in entries:
+                    if entry.is_symlink():
+                        yield 'link', entry.path, 0
+                    elif entry.is_dir(follow_symlinks=False):
+                        yield 'dir', entry.path, 0
+                        stack.append(entry.path)
+                    else:
+                        yield 'file', entry.path, entry.stat(follow_symlinks=False).st_size
+
+    def _run(self, tasks, worker):
+        self.started = time.monotonic()
+        if not tasks:
+            return
+        finished = threading.Event()
+        remaining = [len(tasks)]
+
+        def run_task(task):
             try:
-                result = subprocess.run(command, shell=True, text=True, capture_output=True, timeout=30)
-                return self.format_command_output(result.stdout, result.stderr)
-            except subprocess.TimeoutExpired:
-                return f"{Style.RED}Command execution timed out after 30 seconds.{Style.RESET}"
+                if not self.cancelled.is_set():
+                    worker(task)
+            except TransferCancelled:
+                pass
             except Exception as e:
-                return f"{Style.RED}Error executing command: {str(e)}{Style.RESET}"
-            
-    def format_command_output(self, stdout, stderr):
-        output = ""
-        if stdout:
-            output += f"{Style.GREEN}Command Output:{Style.RESET}\n{stdout}\n"
-        if stderr:
-            output += f"{Style.RED}Error Output:{Style.RESET}\n{stderr}\n"
-        return output.strip()
+                with self.lock:
+                    self.errors.append((task[0] if isinstance(task, tuple) else task, str(e)))
+            finally:
+                with self.lock:
+                    remaining[0] -= 1
+                    if remaining[0] == 0:
+                        finished.set()
 
-    def exit(self):
-        term_width = os.get_terminal_size().columns
-        goodbye_msg = f"{Style.GREEN}Thank you for using Python CMD Emulator. Goodbye!{Style.RESET}"
-        print(goodbye_msg.center(term_width))
-        sys.exit(0)
+        import concurrent.futures
+        pool = concurrent.futures.ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='transfer')
+        try:
+            for task in tasks:
+                pool.submit(run_task, task)
+            while not finished.wait(0.25):
+                self._report()
+        except KeyboardInterrupt:
+            self.interrupted = True
+            self.cancelled.set()
+        finally:
+            pool.shutdown(wait=True, cancel_futures=True)
+            self._report(final=True)
 
-    def load_custom_commands(self):
-        config = configparser.ConfigParser()
-        successful_loads = 0
-        failed_commands = []
+    def _copy_file(self, task, journal):
+        src, dst, size = task
+        part = dst + '.part'
+        try:
+            with open(src, 'rb') as fsrc, open(part, 'wb') as fdst:
+                if size < self.zero_copy_threshold or not self._zero_copy(fsrc, fdst, size):
+                    self._buffered_copy(fsrc, fdst)
+            shutil.copystat(src, part)
+            os.replace(part, dst)
+        except BaseException:
+            if os.path.exists(part):
+                os.remove(part)
+            raise
+        with self.lock:
+            self.files_done += 1
+            journal.write(dst + "\n")
+            journal.flush()
 
-        if os.path.exists(self.config_file):
-            config.read(self.config_file, encoding='utf-8')
-            for section in config.sections():
-                try:
-                    name = section
-                    command = config.get(section, 'command', raw=True)
-                    help_text = config.get(section, 'help', fallback='No help available')
-                    args = config.get(section, 'args', fallback='').split()
-                    self.custom_commands[name] = CustomCommand(name, command, help_text, args)
-                    successful_loads += 1
-                except configparser.InterpolationSyntaxError as e:
-                    failed_commands.append((name, "Syntax error in command string"))
-                except configparser.Error as e:
-                    failed_commands.append((name, f"Configuration error: {str(e)}"))
-                except Exception as e:
-                    failed_commands.append((name, f"Unexpected error: {str(e)}"))
+    def _zero_copy(self, fsrc, fdst, size):
+        infd, outfd = fsrc.fileno(), fdst.fileno()
+        copy_range = getattr(os, 'copy_file_range', None)
+        if copy_range is None and not hasattr(os, 'sendfile'):
+            return False
+        offset = 0
+        while offset < size:
+            if self.cancelled.is_set():
+                raise TransferCancelled()
+            count = min(self.CHUNK_SIZE, size - offset)
+            try:
+                if copy_range:
+                    sent = copy_range(infd, outfd, count)
+                else:
+                    sent = os.sendfile(outfd, infd, offset, count)
+            except OSError as e:
+                # Not supported for this pair of files: fall back before anything was written
+                if offset == 0 and e.errno in (errno.EXDEV, errno.ENOSYS, errno.EINVAL,
+                                               getattr(errno, 'EOPNOTSUPP', errno.EINVAL),
+                                               getattr(errno, 'ENOTSOCK', errno.EINVAL)):
+                    return False
+                raise
+            if sent == 0:
+                break
+            offset += sent
+            self._advance(sent)
+        return True
 
-            print(f"{Style.GREEN}Successfully loaded {successful_loads} custom command(s).{Style.RESET}")
-            
-            if failed_commands:
-                print(f"{Style.YELLOW}The following commands failed to load:{Style.RESET}")
-                for name, error in failed_commands:
-                    print(f"{Style.RED}- {name}: {error}{Style.RESET}")
-                print(f"{Style.YELLOW}Please check your {self.config_file} file and correct these issues.{Style.RESET}")
-        else:
-            print(f"{Style.YELLOW}No {self.config_file} file found. Custom commands will not be loaded.{Style.RESET}")
+    def _buffered_copy(self, fsrc, fdst):
+        while True:
+            if self.cancelled.is_set():
+                raise TransferCancelled()
+            chunk = fsrc.read(self.BUFFER_SIZE)
+            if not chunk:
+                break
+            fdst.write(chunk)
+            self._advance(len(chunk))
 
-        return successful_loads, failed_commands
+    def _delete_file(self, path):
+        os.remove(path)
+        with self.lock:
+            self.files_done += 1
 
-    def save_custom_commands(self):
-        config = configparser.ConfigParser()
-        for name, cmd in self.custom_commands.items():
-            config[name] = {
-                'command': cmd.command,
-                'help': cmd.help_text,
-                'args': ' '.join(cmd.args)
-            }
-        with open('commands.cfg', 'w') as configfile:
-            config.write(configfile)
+    def _advance(self, count):
+        with self.lock:
+            self.bytes_done += count
 
-    def add_custom_command(self, name, command, help_text, args):
-        self.custom_commands[name] = CustomCommand(name, command, help_text, args)
-        self.save_custom_commands()
+    def _report(self, final=False):
+        elapsed = max(time.monotonic() - self.started, 1e-6)
+        line = f"{self.files_done}/{self.total_files} files"
+        if self.total_bytes:
+            rate = self.bytes_done / elapsed
+            eta = (self.total_bytes - self.bytes_done) / rate if rate else 0
+            line += (f"  {self.format_size(self.bytes_done)}/{self.format_size(self.total_bytes)}"
+                     f"  {self.format_size(rate)}/s  ETA {eta:.0f}s")
+        else:
+            line += f"  {self.files_done / elapsed:.0f} files/s"
+        self.stream.write(f"\r\033[2K{Style.CYAN}{line}{Style.RESET}" + ("\n" if final else ""))
+        self.stream.flush()
 
-    def remove_custom_command(self, name):
-        if name in self.custom_commands:
-            del self.custom_commands[name]
-            self.save_custom_commands()
+    def _summary(self, verb, resumed, elapsed=None):
+        elapsed = time.monotonic() - self.started if elapsed is None else elapsed
+        rate = self.bytes_done / elapsed if elapsed > 0 else 0
+        text = (f"{verb} {self.files_done} file(s), {self.format_size(self.bytes_done)} in {elapsed:.1f}s "
+                f"({self.format_size(rate)}/s)")
+        if self.renamed:
+            text += f", {self.renamed} item(s) renamed"
+        if resumed:
+            text += f", {resumed} already done before resuming"
+        return f"{Style.GREEN}{text}{Style.RESET}"
 
-    def refresh_commands(self):
-        print(f"{Style.CYAN}Refreshing custom commands...{Style.RESET}")
-        self.custom_commands.clear()
-        successful_loads, failed_commands = self.load_custom_commands()
-        return f"Refresh complete. {successful_loads} commands loaded successfully."
+    def _same_device(self, src, target_dir):
+        try:
+            return os.lstat(src).st_dev == os.stat(target_dir).st_dev
+        except OSError:
+            return False
 
-class CustomCommand:
-    def __init__(self, name, command, help_text, args=None):
-        self.name = name
-        self.command = command
-        self.help_text = help_text
-        self.args = args or []
+    def _journal_path(self, operation, sources, target_dir):
+        import hashlib
+        key = "\0".join([operation, target_dir] + sorted(os.path.abspath(src) for src in sources))
+        return os.path.join(self.journal_dir, hashlib.sha1(key.encode('utf-8')).hexdigest()[:16] + ".journal")
 
-    def execute(self, *args):
+    def _read_journal(self, path):
         try:
-            # Replace placeholders in the command with actual arguments
-            cmd = self.command
-            for i, arg in enumerate(args):
-                cmd = cmd.replace(f'${i+1}', arg)
-            
-            # Check if the command is a Python one-liner
-            if cmd.startswith('python -c'):
-                # Execute Python code directly
-                exec_globals = {}
-                exec(cmd[10:].strip('"'), exec_globals)
-                return str(exec_globals.get('result', ''))
-            else:
-                # Execute as a system command
-                result = subprocess.run(cmd, shell=True, text=True, capture_output=True)
-                return result.stdout + result.stderr
-        except Exception as e:
-            return f"{Style.RED}Error executing command: {str(e)}{Style.RESET}"
+            with open(path, 'r', encoding='utf-8') as f:
+                return {line for line in f.read().splitlines() if os.path.exists(line)}
+        except OSError:
+            return set()
+
+    @staticmethod
+    def format_size(size):
+        for unit in ('B', 'KB', 'MB', 'GB', 'TB'):
+            if size < 1024 or unit == 'TB':
+                return f"{size:.0f} {unit}" if unit == 'B' else f"{size:.1f} {unit}"
+            size /= 1024
 
-    def get_help(self):
-        args_help = ' '.join(f'<{arg}>' for arg in self.args)
-        return f"{self.name} {args_help}\n  {self.help_text}"
 
 class FileManager:
-    def __init__(self):
-        self.current_dir = os.getcwd()
+    PROMPT = f"{Style.BOLD}{Style.GREEN}File Manager>{Style.RESET} "
+    # Bursts of changes are drawn at most this often
+    REFRESH_INTERVAL = 0.1
+
+    def __init__(self, scanner=None, cwd=None, disk_usage=None):
+        self.scanner = scanner or DirectoryScanner()
+        self.transfers = TransferEngine()
+        self.disk_usage = disk_usage or DiskUsage()
+        self.current_dir = cwd or os.getcwd()
+        # Tree sizes of the subdirectories of sizes_dir while the size column is on, else None
+        self.dir_sizes = None
+        self.sizes_dir = None
+        self.total_size = None
+        self.sized_view = (None, None)
         self.selected_items = set()
         self.view_mode = 'list'  # 'list' or 'grid'
         self.sort_by = 'name'    # 'name', 'size', 'date'
         self.reverse_sort = False
+        self.offset = 0
+        self.page_size = 1
+        self.message = ""
+        self.previous_frame = None
+        self.previous_size = None
+        self.watcher = None
 
     def run(self):
+        self.previous_frame = None
+        # The listing follows changes on disk while the prompt waits, when there is a terminal to redraw
+        if (os.name == 'posix' and sys.stdin.isatty() and sys.stdout.isatty()
+                and os.environ.get('PYTHONCMD_FM_WATCH', '1') not in ('', '0')):
+            self.watcher = DirectoryWatcher()
+        try:
+            return self._loop()
+        finally:
+            if self.watcher is not None:
+                self.watcher.close()
+                self.watcher = None
+
+    def _loop(self):
         while True:
             self.display_interface()
-            command = input(f"{Style.BOLD}{Style.GREEN}File Manager>{Style.RESET} ").strip().lower()
+            command = self.read_command().strip().lower()
+            self.message = ""
             if command == 'q':
                 break
             elif command == 'p':
                 self.current_dir = os.path.dirname(self.current_dir)
+                self.offset = 0
             elif command.startswith('cd '):
                 self.change_directory(command[3:])
             elif command == 'v':
@@ -440,6 +4640,15 @@ class FileManager:
                 self.change_sort(command[2:])
             elif command == 'r':
                 self.reverse_sort = not self.reverse_sort
+                self.offset = 0
+            elif command == 'n':
+                self.offset += self.page_size
+            elif command == 'b':
+                self.offset = max(0, self.offset - self.page_size)
+            elif command == 'home':
+                self.offset = 0
+            elif command == 'end':
+                self.offset = len(self.get_sorted_items())
             elif command.startswith('sel '):
                 self.toggle_selection(command[4:])
             elif command == 'copy':
@@ -450,68 +4659,197 @@ class FileManager:
                 self.delete_selected()
             elif command == 'help':
                 self.show_help()
+            elif command == 'du':
+                self.toggle_sizes()
+            if self.dir_sizes is not None and self.sizes_dir != self.current_dir:
+                self.measure_sizes()
+            if command in ('copy', 'move', 'delete', 'help'):
+                # These prompt below the frame, so the next frame starts from a clean screen
+                self.previous_frame = None
+        sys.stdout.write("\n")
         return f"File manager closed. Current directory: {self.current_dir}"
 
-    def display_interface(self):
-        os.system('cls' if os.name == 'nt' else 'clear')
-        print(f"{Style.BACKGROUND_BLUE}{Style.BRIGHT}{'File Manager':^80}{Style.RESET}")
-        print(f"{Style.YELLOW}Current Directory: {self.current_dir}{Style.RESET}")
-        print(f"{Style.CYAN}View: {self.view_mode.capitalize()} | Sort: {self.sort_by.capitalize()} ({'Desc' if self.reverse_sort else 'Asc'}){Style.RESET}")
-        print("─" * 80)
+    def read_command(self):
+        if self.watcher is None:
+            return input(self.PROMPT)
+        self.watcher.watch(self.current_dir)
+        sys.stdout.write(self.PROMPT)
+        sys.stdout.flush()
+        with selectors.DefaultSelector() as everything, selectors.DefaultSelector() as keyboard:
+            everything.register(sys.stdin, selectors.EVENT_READ)
+            keyboard.register(sys.stdin, selectors.EVENT_READ)
+            if self.watcher.fileno() is not None:
+                everything.register(self.watcher.fileno(), selectors.EVENT_READ)
+            while True:
+                if any(key.fileobj is sys.stdin for key, _ in everything.select(self.watcher.timeout)):
+                    break
+                changes = self.watcher.read()
+                if changes is None or changes:
+                    self.apply_changes(changes)
+                    # Let a burst settle before drawing again, but keep answering the keyboard
+                    if keyboard.select(self.REFRESH_INTERVAL):
+                        break
+        line = sys.stdin.readline()
+        return line if line else 'q'
+
+    def toggle_sizes(self):
+        if self.dir_sizes is not None:
+            self.dir_sizes = self.sizes_dir = self.total_size = None
+            return
+        self.measure_sizes()
+
+    def measure_sizes(self):
+        sys.stdout.write(f"{Style.CYAN}Measuring directory sizes... (Ctrl-C to stop){Style.RESET}")
+        sys.stdout.flush()
+        try:
+            totals, errors = self.disk_usage.measure(self.current_dir)
+        except KeyboardInterrupt:
+            self.dir_sizes = self.sizes_dir = self.total_size = None
+            self.message = f"{Style.YELLOW}Size calculation interrupted.{Style.RESET}"
+            return
+        except OSError as e:
+            self.dir_sizes = self.sizes_dir = self.total_size = None
+            self.message = f"{Style.RED}Cannot measure {self.current_dir}: {str(e)}{Style.RESET}"
+            return
+        finally:
+            sys.stdout.write("\r\033[K")
+        self.dir_sizes = {os.path.basename(path): size for path, (size, _) in totals.items()
+                          if os.path.dirname(path) == self.current_dir}
+        self.sizes_dir = self.current_dir
+        self.total_size = totals[self.current_dir][0]
+        if errors:
+            self.message = f"{Style.YELLOW}{errors} entries could not be read.{Style.RESET}"
+
+    def apply_changes(self, names):
+        if names is None:
+            self.scanner.invalidate(self.current_dir)
+        else:
+            self.scanner.update(self.current_dir, names)
+        if shutil.get_terminal_size() != self.previous_size:
+            self.previous_frame = None
+            self.display_interface()
+            sys.stdout.write(self.PROMPT)
+            sys.stdout.flush()
+            return
+        # Redraw the rows that changed and put the cursor back where the user is typing
+        self.display_interface(park=False)
 
+    def display_interface(self, park=True):
+        width, height = shutil.get_terminal_size()
         items = self.get_sorted_items()
+        per_row = max(1, width // 20) if self.view_mode == 'grid' else 1
+        # Header (4 rows), footer (4 rows), the prompt and one spare row so Enter never scrolls
+        visible_rows = max(1, height - 10)
+        self.page_size = visible_rows * per_row
+        last_page = max(0, (len(items) - 1) // self.page_size * self.page_size)
+        self.offset = min(max(0, self.offset - self.offset % per_row), last_page)
+        window = items[self.offset:self.offset + self.page_size]
         if self.view_mode == 'list':
-            self.display_list_view(items)
+            rows = self.list_rows(window, width)
+        else:
+            rows = self.grid_rows(window, width)
+        rows += [""] * (visible_rows - len(rows))
+
+        first = self.offset + 1 if items else 0
+        frame = [
+            f"{Style.BACKGROUND_BLUE}{Style.BRIGHT}{'File Manager':^{width}}{Style.RESET}",
+            self.fit(f"{Style.YELLOW}Current Directory: {self.current_dir}{Style.RESET}", width),
+            self.fit(f"{Style.CYAN}View: {self.view_mode.capitalize()} | Sort: {self.sort_by.capitalize()} "
+                     f"({'Desc' if self.reverse_sort else 'Asc'}) | Items {first}-{self.offset + len(window)} "
+                     f"of {len(items)} | Selected: {len(self.selected_items)}"
+                     f"{f' | Total: {TransferEngine.format_size(self.total_size)}' if self.total_size is not None else ''}"
+                     f"{Style.RESET}", width),
+            "─" * width,
+        ] + rows + [
+            "─" * width,
+            self.fit(f"{Style.GREEN}Commands: cd <dir>, p (parent), v (toggle view), s <name|size|date>, r (reverse sort){Style.RESET}", width),
+            self.fit(f"{Style.GREEN}n/b (next/previous page), home, end, sel <item>, copy, move, delete, du (sizes), q (quit), help{Style.RESET}", width),
+            self.fit(self.message, width),
+        ]
+        self.render(frame, (width, height), park)
+
+    def render(self, frame, size, park=True):
+        out = [] if park else ["\0337"]
+        previous = self.previous_frame
+        if previous is None or size != self.previous_size or len(previous) != len(frame):
+            out.append("\033[H\033[2J")
+            out.append("\n".join(frame))
+        else:
+            # Only rewrite the rows that changed since the last frame
+            for row, (old, new) in enumerate(zip(previous, frame), 1):
+                if old != new:
+                    out.append(f"\033[{row};1H\033[2K{new}")
+        if park:
+            # Park the cursor on a cleared prompt row below the frame
+            out.append(f"\033[{len(frame) + 1};1H\033[J")
         else:
-            self.display_grid_view(items)
+            out.append("\0338")
+        sys.stdout.write("".join(out))
+        sys.stdout.flush()
+        self.previous_frame = frame
+        self.previous_size = size
 
-        print("─" * 80)
-        print(f"{Style.GREEN}Commands: cd <dir>, p (parent), v (toggle view), s <name|size|date>, r (reverse sort){Style.RESET}")
-        print(f"{Style.GREEN}sel <item> (select), copy, move, delete, q (quit), help{Style.RESET}")
+    def fit(self, text, width):
+        # Truncate by visible characters so colour codes never push a row onto two lines
+        visible = re.sub(r'\033\[[0-9;]*m', '', text)
+        if len(visible) <= width:
+            return text
+        return visible[:max(0, width - 1)] + "…"
 
     def get_sorted_items(self):
-        items = os.listdir(self.current_dir)
-        key_func = lambda x: x.lower()
-        if self.sort_by == 'size':
-            key_func = lambda x: os.path.getsize(os.path.join(self.current_dir, x))
-        elif self.sort_by == 'date':
-            key_func = lambda x: os.path.getmtime(os.path.join(self.current_dir, x))
-        return sorted(items, key=key_func, reverse=self.reverse_sort)
-
-    def display_list_view(self, items):
+        view = self.scanner.sorted(self.current_dir, self.sort_by, self.reverse_sort)
+        if self.dir_sizes is None or self.sort_by != 'size':
+            return view
+        # Directories sort by the size of their whole tree while the size column is on
+        source, sized = self.sized_view
+        if source is not view or sized[0] is not self.dir_sizes:
+            sizes = self.dir_sizes
+            items = sorted(view, key=lambda item: sizes.get(item.name, item.size) if item.is_dir else item.size,
+                           reverse=self.reverse_sort)
+            sized = (sizes, items)
+            self.sized_view = (view, sized)
+        return sized[1]
+
+    def list_rows(self, items, width):
+        name_width = max(10, width - 33)
+        rows = []
+        sizes = self.dir_sizes
         for item in items:
-            full_path = os.path.join(self.current_dir, item)
-            is_dir = os.path.isdir(full_path)
-            size = os.path.getsize(full_path) if not is_dir else '-'
-            mtime = datetime.datetime.fromtimestamp(os.path.getmtime(full_path)).strftime('%Y-%m-%d %H:%M')
+            if sizes is not None:
+                size = TransferEngine.format_size(sizes.get(item.name, 0) if item.is_dir else item.size)
+            else:
+                size = item.size if not item.is_dir else '-'
+            mtime = time.strftime('%Y-%m-%d %H:%M', time.localtime(item.mtime))
+            name = item.name if len(item.name) <= name_width else item.name[:name_width - 1] + "…"
             
-            item_style = Style.BLUE if is_dir else Style.NORMAL
-            select_style = Style.BACKGROUND_GREEN if item in self.selected_items else ''
+            item_style = Style.BLUE if item.is_dir else Style.NORMAL
+            select_style = Style.BACKGROUND_GREEN if item.name in self.selected_items else ''
             
-            print(f"{select_style}{item_style}{item:<30}{Style.RESET} {size:>10} {mtime:>20}")
+            rows.append(f"{select_style}{item_style}{name:<{name_width}}{Style.RESET} {size:>10} {mtime:>20}")
+        return rows
 
-    def display_grid_view(self, items):
-        term_width = 80
+    def grid_rows(self, items, width):
         item_width = 20
-        items_per_row = term_width // item_width
+        items_per_row = max(1, width // item_width)
 
-        for i, item in enumerate(items):
-            is_dir = os.path.isdir(os.path.join(self.current_dir, item))
-            item_style = Style.BLUE if is_dir else Style.NORMAL
-            select_style = Style.BACKGROUND_GREEN if item in self.selected_items else ''
-            
-            print(f"{select_style}{item_style}{item[:17]:<17}{Style.RESET}", end='  ')
-            if (i + 1) % items_per_row == 0:
-                print()
-        print()
+        rows = []
+        for start in range(0, len(items), items_per_row):
+            cells = []
+            for item in items[start:start + items_per_row]:
+                item_style = Style.BLUE if item.is_dir else Style.NORMAL
+                select_style = Style.BACKGROUND_GREEN if item.name in self.selected_items else ''
+                cells.append(f"{select_style}{item_style}{item.name[:17]:<17}{Style.RESET}")
+            rows.append("  ".join(cells))
+        return rows
 
     def change_directory(self, path):
         new_dir = os.path.join(self.current_dir, path)
         if os.path.isdir(new_dir):
             self.current_dir = os.path.abspath(new_dir)
             self.selected_items.clear()
+            self.offset = 0
         else:
-            print(f"{Style.RED}Invalid directory{Style.RESET}")
+            self.message = f"{Style.RED}Invalid directory{Style.RESET}"
 
     def toggle_view_mode(self):
         self.view_mode = 'grid' if self.view_mode == 'list' else 'list'
@@ -519,64 +4857,58 @@ class FileManager:
     def change_sort(self, sort_by):
         if sort_by in ['name', 'size', 'date']:
             self.sort_by = sort_by
+            self.offset = 0
         else:
-            print(f"{Style.RED}Invalid sort option. Use 'name', 'size', or 'date'.{Style.RESET}")
+            self.message = f"{Style.RED}Invalid sort option. Use 'name', 'size', or 'date'.{Style.RESET}"
 
     def toggle_selection(self, item):
         if item in self.selected_items:
             self.selected_items.remove(item)
-        elif item in os.listdir(self.current_dir):
+        elif any(entry.name == item for entry in self.scanner.scan(self.current_dir)):
             self.selected_items.add(item)
         else:
-            print(f"{Style.RED}Item not found: {item}{Style.RESET}")
+            self.message = f"{Style.RED}Item not found: {item}{Style.RESET}"
 
     def copy_selected(self):
         if not self.selected_items:
-            print(f"{Style.YELLOW}No items selected{Style.RESET}")
+            self.message = f"{Style.YELLOW}No items selected{Style.RESET}"
             return
         target_dir = input("Enter target directory: ")
         if os.path.isdir(target_dir):
-            for item in self.selected_items:
-                src = os.path.join(self.current_dir, item)
-                dst = os.path.join(target_dir, item)
-                if os.path.isdir(src):
-                    shutil.copytree(src, dst)
-                else:
-                    shutil.copy2(src, dst)
-            print(f"{Style.GREEN}Items copied successfully{Style.RESET}")
-            self.selected_items.clear()
+            sources = [os.path.join(self.current_dir, item) for item in sorted(self.selected_items)]
+            self.message = self.transfers.copy(sources, target_dir)
+            self.scanner.invalidate(os.path.abspath(target_dir))
+            if self.transfers.succeeded:
+                self.selected_items.clear()
         else:
-            print(f"{Style.RED}Invalid target directory{Style.RESET}")
+            self.message = f"{Style.RED}Invalid target directory{Style.RESET}"
 
     def move_selected(self):
         if not self.selected_items:
-            print(f"{Style.YELLOW}No items selected{Style.RESET}")
+            self.message = f"{Style.YELLOW}No items selected{Style.RESET}"
             return
         target_dir = input("Enter target directory: ")
         if os.path.isdir(target_dir):
-            for item in self.selected_items:
-                src = os.path.join(self.current_dir, item)
-                dst = os.path.join(target_dir, item)
-                shutil.move(src, dst)
-            print(f"{Style.GREEN}Items moved successfully{Style.RESET}")
-            self.selected_items.clear()
+            sources = [os.path.join(self.current_dir, item) for item in sorted(self.selected_items)]
+            self.message = self.transfers.copy(sources, target_dir, move=True)
+            self.scanner.invalidate(self.current_dir)
+            self.scanner.invalidate(os.path.abspath(target_dir))
+            if self.transfers.succeeded:
+                self.selected_items.clear()
         else:
-            print(f"{Style.RED}Invalid target directory{Style.RESET}")
+            self.message = f"{Style.RED}Invalid target directory{Style.RESET}"
 
     def delete_selected(self):
         if not self.selected_items:
-            print(f"{Style.YELLOW}No items selected{Style.RESET}")
+            self.message = f"{Style.YELLOW}No items selected{Style.RESET}"
             return
         confirm = input(f"{Style.RED}Are you sure you want to delete selected items? (y/n): {Style.RESET}").lower()
         if confirm == 'y':
-            for item in self.selected_items:
-                path = os.path.join(self.current_dir, item)
-                if os.path.isdir(path):
-                    shutil.rmtree(path)
-                else:
-                    os.remove(path)
-            print(f"{Style.GREEN}Items deleted successfully{Style.RESET}")
-            self.selected_items.clear()
+            paths = [os.path.join(self.current_dir, item) for item in sorted(self.selected_items)]
+            self.message = self.transfers.delete(paths)
+            self.scanner.invalidate(self.current_dir)
+            if self.transfers.succeeded:
+                self.selected_items.clear()
 
     def show_help(self):
         help_text = """
@@ -586,16 +4918,320 @@ File Manager Help:
   v            - Toggle view mode (list/grid)
   s <option>   - Change sort (name/size/date)
   r            - Reverse sort order
+  n / b        - Next / previous page
+  home / end   - First / last page
   sel <item>   - Select/deselect item
   copy         - Copy selected items
   move         - Move selected items
   delete       - Delete selected items
+  du           - Show or hide directory sizes (whole tree)
   q            - Quit file manager
   help         - Show this help
 """
         print(help_text)
         input("Press Enter to continue...")
 
+class BatchRunner:
+    def __init__(self, shell, jobs=1, tagged=False, capture_limit=8 * 1024 * 1024):
+        self.shell = shell
+        self.jobs = max(1, jobs)
+        self.tagged = tagged
+        # Output of a line beyond this many characters is spilled to a temporary file
+        self.capture_limit = capture_limit
+        self.results = []
+
+    def read_script(self, path):
+        stream = sys.stdin if path == '-' else open(path, 'r', encoding='utf-8')
+        with stream:
+            return [(number, line.strip()) for number, line in enumerate(stream, 1)
+                    if line.strip() and not line.strip().startswith('#')]
+
+    def run_file(self, path):
+        return self.run_lines(self.read_script(path))
+
+    def run_lines(self, lines):
+        # A bare 'wait' line is a barrier: everything before it finishes first
+        groups = [[]]
+        for number, line in lines:
+            if line == 'wait':
+                groups.append([])
+            else:
+                groups[-1].append((number, line))
+
+        import concurrent.futures
+        started = time.monotonic()
+        with concurrent.futures.ThreadPoolExecutor(max_workers=self.jobs, thread_name_prefix='batch') as pool:
+            for group in groups:
+                futures = [pool.submit(self.run_line, number, line) for number, line in group]
+                for future in futures:
+                    result = future.result()
+                    self.results.append(result)
+                    output = result.pop('output')
+                    if output is not None:
+                        with output:
+                            output.seek(0)
+                            shutil.copyfileobj(output, sys.stdout)
+                        sys.stdout.flush()
+        self.print_summary(time.monotonic() - started)
+        return 0 if all(result['status'] == 0 for result in self.results) else 1
+
+    def run_line(self, number, line):
+        buffer = None
+        if self.tagged:
+            sink = TaggedSink(number)
+        else:
+            buffer = tempfile.SpooledTemporaryFile(
+                max_size=self.capture_limit, mode='w+', encoding='utf-8', errors='replace'
+            )
+            buffer.write(f"{Style.BOLD}{Style.BLUE}[{number}] {line}{Style.RESET}\n")
+            sink = ConsoleSink(buffer)
+        # Parallel lines each get a copy of the shell's directory and environment, so a cd in one line
+        # cannot move another; one at a time, they share it like the lines of a script
+        context = self.shell.session_context.copy() if self.jobs > 1 else self.shell.session_context
+        self.shell.local.context = context
+        started = time.monotonic()
+        try:
+            status = self.shell.execute_command(line, sink)
+        except SystemExit as e:
+            status = e.code if isinstance(e.code, int) else 1
+        finally:
+            self.shell.local.context = None
+        sink.close()
+        return {
+            'line': number,
+            'command': line,
+            'status': status,
+            'duration': time.monotonic() - started,
+            'output': buffer,
+        }
+
+    def print_summary(self, wall_time):
+        failed = sum(1 for result in self.results if result['status'] != 0)
+        total = sum(result['duration'] for result in self.results)
+        print(f"\n{Style.BOLD}Batch summary:{Style.RESET} {len(self.results)} command(s), "
+              f"{failed} failed, {wall_time:.2f}s wall, {total:.2f}s command time, {self.jobs} worker(s)")
+        print(f"{Style.CYAN}{'line':>6}  {'status':>6}  {'time':>9}  command{Style.RESET}")
+        for result in sorted(self.results, key=lambda r: r['line']):
+            color = Style.GREEN if result['status'] == 0 else Style.RED
+            print(f"{result['line']:>6}  {color}{result['status']:>6}{Style.RESET}  "
+                  f"{result['duration']:>8.3f}s  {result['command']}")
+
+
+class Session(PythonCMD):
+    def __init__(self, runtime=None, cwd=None, history_path=None, color=False, env=None,
+                 capture_limit=8 * 1024 * 1024):
+        self.owns_runtime = runtime is None
+        super().__init__(fast=True, runtime=runtime, history=HistoryStore(history_path),
+                         context=ShellContext(cwd, env))
+        self.color = color
+        # Output of a command beyond this many characters per channel is spilled to a temporary file
+        self.capture_limit = capture_limit
+        self.paging = False
+        self.persist_aliases = False
+        self.closed = False
+        self.last_result = None
+
+    def submit(self, command, on_output=None, capture=True):
+        if self.closed:
+            raise RuntimeError("session is closed")
+        sink = CaptureSink(on_output, capture, self.color, self.capture_limit)
+        cwd = self.cwd
+        started = time.monotonic()
+        with self.reporting_to(sink):
+            self.check_config()
+        status = self.execute_command(command, sink)
+        duration = self.last_duration = time.monotonic() - started
+        if command.strip():
+            self.history.append(command.strip(), cwd, status, duration)
+        self.last_result = CommandResult(command, status, sink.text('stdout'), sink.text('stderr'),
+                                         duration, self.cwd)
+        return self.last_result
+
+    @property
+    def cwd(self):
+        return self.context.cwd
+
+    def stream(self, command):
+        chunks = queue.Queue()
+        failure = []
+
+        def run():
+            try:
+                self.submit(command, lambda channel, text: chunks.put((channel, text)), capture=False)
+            except BaseException as e:
+                failure.append(e)
+            finally:
+                chunks.put(None)
+
+        threading.Thread(target=run, daemon=True).start()
+        while True:
+            chunk = chunks.get()
+            if chunk is None:
+                break
+            yield chunk
+        if failure:
+            raise failure[0]
+
+    def close(self):
+        if self.closed:
+            return
+        self.closed = True
+        self.jobs.shutdown()
+        if self.owns_runtime:
+            self.runtime.shutdown()
+
+    def exit(self):
+        self.close()
+        return "Session closed."
+
+    def file_manager(self):
+        raise CommandError("The file manager needs a terminal.")
+
+    def add_custom_command_interactive(self):
+        raise CommandError(f"addcmd needs a terminal; edit {self.config_file} instead.")
+
+    def clear_screen(self):
+        return ""
+
+
+class SessionServer:
+    def __init__(self, path, runtime=None, max_sessions=64, cwd=None, capture_limit=8 * 1024 * 1024):
+        self.path = path
+        self.runtime = runtime or Runtime()
+        self.max_sessions = max_sessions
+        self.cwd = cwd
+        self.capture_limit = capture_limit
+        self.sessions = {}
+        self.next_id = 1
+        self.pool = None
+
+    def serve_forever(self):
+        import asyncio
+        try:
+            asyncio.run(self.serve())
+        except KeyboardInterrupt:
+            pass
+        finally:
+            for session in list(self.sessions.values()):
+                session.close()
+            self.runtime.shutdown()
+            if self.pool is not None:
+                self.pool.shutdown(wait=False, cancel_futures=True)
+            try:
+                os.unlink(self.path)
+            except OSError:
+                pass
+
+    async def serve(self):
+        import asyncio
+        import concurrent.futures
+        self.pool = concurrent.futures.ThreadPoolExecutor(max_workers=self.max_sessions, thread_name_prefix='session')
+        # A socket left behind by a server that died is replaced; anything else at the path is not touched
+        if os.path.exists(self.path) and stat.S_ISSOCK(os.stat(self.path).st_mode):
+            os.unlink(self.path)
+        server = await asyncio.start_unix_server(self.handle, path=self.path, limit=1 << 20)
+        os.chmod(self.path, 0o600)
+        print(f"{Style.GREEN}Serving sessions on {self.path}{Style.RESET}", file=sys.stderr)
+        async with server:
+            await server.serve_forever()
+
+    async def handle(self, reader, writer):
+        import asyncio
+        import json
+        if len(self.sessions) >= self.max_sessions:
+            await self.send(writer, {'error': f"too many sessions (limit {self.max_sessions})"})
+            writer.close()
+            return
+        session_id = self.next_id
+        self.next_id += 1
+        # Built off the event loop: loading the config may wait for a running command
+        session = await asyncio.get_running_loop().run_in_executor(
+            self.pool, lambda: Session(self.runtime, self.cwd, capture_limit=self.capture_limit))
+        self.sessions[session_id] = session
+        try:
+            await self.send(writer, {'session': session_id, 'cwd': session.cwd})
+            while not session.closed:
+                line = await reader.readline()
+                if not line:
+                    break
+                try:
+                    request = json.loads(line)
+                    command = request['command']
+                    if not isinstance(command, str):
+                        raise TypeError("'command' must be a string")
+                except (ValueError, KeyError, TypeError) as e:
+                    await self.send(writer, {'error': f"bad request: {str(e)}"})
+                    continue
+                await self.run(session, command, request, writer)
+        except (ConnectionError, OSError):
+            pass
+        finally:
+            del self.sessions[session_id]
+            session.close()
+            writer.close()
+
+    async def run(self, session, command, request, writer):
+        import asyncio
+        loop = asyncio.get_running_loop()
+        request_id = request.get('id')
+        if request.get('stream'):
+            def output(channel, text):
+                # Waiting for each chunk to be sent keeps a slow client from piling up output in memory
+                asyncio.run_coroutine_threadsafe(
+                    self.send(writer, {'id': request_id, 'channel': channel, 'text': text}), loop
+                ).result()
+            result = await loop.run_in_executor(self.pool, session.submit, command, output, False)
+            reply = {'id': request_id, 'status': result.status, 'duration': result.duration, 'cwd': result.cwd}
+        else:
+            result = await loop.run_in_executor(self.pool, session.submit, command)
+            reply = dict(result.as_dict(), id=request_id)
+        await self.send(writer, reply)
+
+    async def send(self, writer, message):
+        import json
+        writer.write(json.dumps(message).encode('utf-8') + b"\n")
+        await writer.drain()
+
+
 if __name__ == "__main__":
-    cmd = PythonCMD()
+    profile = StartupProfile(IMPORT_STARTED)
+    profile.lap('imports')
+    import argparse
+    parser = argparse.ArgumentParser(description="Python CMD Emulator")
+    parser.add_argument("--batch", metavar="FILE",
+                        help="run the commands in FILE ('-' for stdin) instead of starting the prompt")
+    parser.add_argument("--jobs", "-j", type=int, default=1,
+                        help="number of batch lines to run concurrently (default: 1)")
+    parser.add_argument("--tagged", action="store_true",
+                        help="stream batch output as it arrives, prefixed with the line number")
+    parser.add_argument("--capture-limit", type=int, default=8 * 1024 * 1024, metavar="CHARS",
+                        help="output kept in memory per batch line or session command before spilling "
+                             "to a temporary file")
+    parser.add_argument("-c", dest="command", metavar="COMMAND",
+                        help="run COMMAND and exit with its status")
+    parser.add_argument("--fast", action="store_true",
+                        help="skip the welcome banner and load custom commands on first use")
+    parser.add_argument("--profile-startup", action="store_true",
+                        help="print how long each part of startup took")
+    parser.add_argument("--serve", metavar="SOCKET",
+                        help="serve headless sessions over a Unix domain socket at SOCKET")
+    parser.add_argument("--max-sessions", type=int, default=64,
+                        help="number of sessions --serve accepts at once (default: 64)")
+    options = parser.parse_args()
+    profile.enabled = options.profile_startup
+    profile.lap('arguments')
+
+    if options.serve:
+        SessionServer(options.serve, max_sessions=options.max_sessions,
+                      capture_limit=options.capture_limit).serve_forever()
+        sys.exit(0)
+    cmd = PythonCMD(profile, fast=options.fast or options.command is not None or options.batch is not None)
+    if options.command is not None:
+        status = cmd.execute_command(options.command)
+        if profile.enabled:
+            profile.lap('command')
+            print(profile.report(), file=sys.stderr)
+        sys.exit(status)
+    if options.batch:
+        sys.exit(BatchRunner(cmd, options.jobs, options.tagged, options.capture_limit).run_file(options.batch))
     cmd.run()
\ No newline at end of file
@@ -0,0 +1,38 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pythonCMD  # noqa: E402
+
+
+@pytest.fixture
+def home(tmp_path, monkeypatch):
+    # Caches, snapshots and history default to ~; keep them out of the real home directory
+    home = tmp_path / "home"
+    home.mkdir()
+    monkeypatch.setenv("HOME", str(home))
+    return home
+
+
+@pytest.fixture
+def runtime(tmp_path, home):
+    runtime = pythonCMD.Runtime(str(tmp_path / "commands.cfg"))
+    yield runtime
+    runtime.shutdown()
+
+
+@pytest.fixture
+def workdir(tmp_path):
+    workdir = tmp_path / "work"
+    workdir.mkdir()
+    return workdir
+
+
+@pytest.fixture
+def session(runtime, workdir, tmp_path):
+    session = pythonCMD.Session(runtime, cwd=str(workdir), history_path=str(tmp_path / "history"))
+    yield session
+    session.close()
@@ -0,0 +1,73 @@
+import pytest
+
+import pythonCMD
+
+
+@pytest.fixture
+def resolver():
+    return pythonCMD.AliasResolver(pythonCMD.CommandParser())
+
+
+def words(resolver, text):
+    return [value for kind, value, raw in resolver.expand(resolver.parser.tokenize(text))]
+
+
+def test_chained_aliases_expand_in_command_position(resolver):
+    resolver.define("ll", "ls -l")
+    resolver.define("l", "ll -a")
+    assert words(resolver, "l src && l; echo l") == ["ls", "-l", "-a", "src", "&&", "ls", "-l", "-a", ";",
+                                                    "echo", "l"]
+
+
+def test_quoted_word_is_not_expanded(resolver):
+    resolver.define("ll", "ls -l")
+    assert words(resolver, "'ll' x") == ["ll", "x"]
+
+
+def test_alias_may_use_its_own_name(resolver):
+    resolver.define("ls", "ls -F")
+    assert words(resolver, "ls") == ["ls", "-F"]
+
+
+def test_define_rejects_cycle(resolver):
+    resolver.define("a", "b x")
+    resolver.define("b", "c y")
+    with pytest.raises(ValueError, match="a -> b -> c -> a|c -> a -> b -> c"):
+        resolver.define("c", "a z")
+    assert "c" not in resolver
+
+
+def test_cycle_in_loaded_config_is_reported_not_looped(resolver):
+    resolver.load({"a": "b 1", "b": "a 2", "ok": "echo fine"})
+    assert resolver.cyclic == {"a", "b"}
+    assert len(resolver.errors) == 2
+    # Expansion stops where a name would repeat
+    assert words(resolver, "a") == ["a", "2", "1"]
+    assert words(resolver, "ok") == ["echo", "fine"]
+
+
+def test_memoized_expansion_follows_redefinition(resolver):
+    resolver.define("ll", "ls -l")
+    resolver.define("l", "ll -a")
+    assert words(resolver, "l") == ["ls", "-l", "-a"]
+    resolver.define("ll", "ls -lh")
+    assert words(resolver, "l") == ["ls", "-lh", "-a"]
+    resolver.remove("ll")
+    assert words(resolver, "l") == ["ll", "-a"]
+
+
+def test_alias_builtin_reports_cycle(session):
+    assert session.submit("alias a b").status == 0
+    result = session.submit("alias b a")
+    assert result.status == 1
+    assert "cycle" in result.stdout
+    assert session.submit("alias hi echo hello").status == 0
+    assert session.submit("hi there").stdout.strip() == "hello there"
+
+
+@pytest.mark.parametrize("name", ["a=b", "a:b", "a b", "a\tb"])
+def test_alias_builtin_rejects_names_config_cannot_hold(session, name):
+    result = session.submit(f"alias '{name}' ls")
+    assert result.status == 1
+    assert "cannot contain" in result.stdout
+    assert name not in session.aliases.definitions
@@ -0,0 +1,61 @@
+import re
+
+import pytest
+
+from pythonCMD import BatchRunner, HistoryStore, PythonCMD, ShellContext
+
+
+@pytest.fixture
+def shell(runtime, workdir, tmp_path, monkeypatch):
+    # Batch mode runs on the interactive shell, whose context follows the process directory
+    monkeypatch.chdir(workdir)
+    shell = PythonCMD(fast=True, runtime=runtime, history=HistoryStore(str(tmp_path / "history")),
+                      context=ShellContext(str(workdir), sync_process=True))
+    yield shell
+    shell.jobs.shutdown()
+
+
+def run(shell, capsys, lines, jobs):
+    status = BatchRunner(shell, jobs=jobs, tagged=True).run_lines(list(enumerate(lines, 1)))
+    output = {}
+    for line in re.sub(r'\x1b\[[0-9;]*m', '', capsys.readouterr().out).splitlines():
+        match = re.match(r'\[(\d+)\] (.*)', line)
+        if match:
+            output.setdefault(int(match.group(1)), []).append(match.group(2))
+    return status, output
+
+
+def test_parallel_lines_have_their_own_directory(shell, workdir, capsys):
+    (workdir / "d1").mkdir()
+    status, output = run(shell, capsys, ['cd d1', 'sleep 0.3; pwd'], jobs=2)
+    assert status == 0
+    assert output[2] == [str(workdir)]
+    assert shell.context.cwd == str(workdir)
+
+
+def test_sequential_lines_share_directory(shell, workdir, capsys):
+    (workdir / "d1").mkdir()
+    status, output = run(shell, capsys, ['cd d1', 'pwd'], jobs=1)
+    assert output[2] == [str(workdir / "d1")]
+
+
+def test_exit_ends_only_its_line(shell, capsys, monkeypatch):
+    shutdowns = []
+    monkeypatch.setattr(shell.runtime, 'shutdown', lambda: shutdowns.append(True))
+    status, output = run(shell, capsys, ['exit; echo never', 'sleep 0.2; echo still', 'wait', 'echo later'], jobs=2)
+    assert status == 0
+    assert 1 not in output
+    assert output[2] == ['still']
+    assert output[4] == ['later']
+    assert not shutdowns
+
+
+def test_parallel_lines_pipe_builtins_from_their_own_directory(shell, workdir, capsys):
+    for name in ("a", "b"):
+        (workdir / name).mkdir()
+        (workdir / name / f"only_{name}").write_text("")
+    lines = [f'cd {name} && sleep 0.2 && ls | cat' for name in ("a", "b")]
+    status, output = run(shell, capsys, lines, jobs=2)
+    assert status == 0
+    assert output[1][-1:] == ["only_a"]
+    assert output[2][-1:] == ["only_b"]
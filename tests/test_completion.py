@@ -0,0 +1,67 @@
+import os
+
+import pytest
+
+import pythonCMD
+
+
+@pytest.fixture
+def completer(session, workdir, tmp_path, monkeypatch):
+    bin_dir = tmp_path / "bin"
+    bin_dir.mkdir()
+    for name in ("zzfirst", "zzsecond"):
+        tool = bin_dir / name
+        tool.write_text("#!/bin/sh\n")
+        tool.chmod(0o755)
+    (bin_dir / "zznotexec").write_text("")
+    monkeypatch.setenv("PATH", str(bin_dir))
+    monkeypatch.chdir(workdir)
+    return pythonCMD.Completer(session)
+
+
+def touch_later(path):
+    # Coarse file system timestamps: make sure the directory's mtime moves
+    stat = os.stat(path)
+    os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10 ** 9))
+
+
+def test_command_position_completes_commands(completer, session):
+    session.submit("alias zzalias echo")
+    assert completer.candidates("zz", "") == ["zzalias ", "zzfirst ", "zzsecond "]
+    assert completer.candidates("zz", "ls |") == ["zzalias ", "zzfirst ", "zzsecond "]
+    assert "history " in completer.candidates("hist", "echo x; ")
+
+
+def test_argument_position_completes_paths(completer, workdir):
+    (workdir / "notes.txt").write_text("")
+    (workdir / "notebook").mkdir()
+    (workdir / ".hidden").write_text("")
+    assert completer.candidates("no", "cat ") == ["notebook/", "notes.txt"]
+    assert completer.candidates("notes", "cat ") == ["notes.txt "]
+    assert completer.candidates("", "cat ") == ["notebook/", "notes.txt"]
+    assert completer.candidates(".h", "cat ") == [".hidden "]
+    (workdir / "notebook" / "page").write_text("")
+    assert completer.candidates("notebook/p", "cat ") == ["notebook/page "]
+
+
+def test_listing_is_cached_until_the_directory_changes(completer, workdir, monkeypatch):
+    (workdir / "alpha").write_text("")
+    assert completer.candidates("a", "cat ") == ["alpha "]
+    scans = []
+    scandir = os.scandir
+    monkeypatch.setattr(pythonCMD.os, "scandir", lambda path: scans.append(path) or scandir(path))
+    assert completer.candidates("al", "cat ") == ["alpha "]
+    assert scans == []
+    (workdir / "alps").write_text("")
+    touch_later(workdir)
+    assert completer.candidates("al", "cat ") == ["alpha", "alps"]
+    assert len(scans) == 1
+
+
+def test_path_executables_follow_path_changes(completer, tmp_path):
+    assert completer.path_executables() == ["zzfirst", "zzsecond"]
+    tool = tmp_path / "bin" / "zzthird"
+    tool.write_text("#!/bin/sh\n")
+    tool.chmod(0o755)
+    touch_later(tmp_path / "bin")
+    assert completer.path_executables() == ["zzfirst", "zzsecond", "zzthird"]
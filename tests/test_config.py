@@ -0,0 +1,63 @@
+import os
+
+import pytest
+
+import pythonCMD
+
+SAMPLE = "# my commands\n[greet]\ncommand = echo hi $1\nhelp = Say hi\nargs = name\n\n[other]\ncommand = true\n"
+
+
+def make_store(tmp_path, text, newline):
+    path = tmp_path / "commands.cfg"
+    path.write_bytes(text.replace("\n", newline).encode('utf-8'))
+    store = pythonCMD.ConfigStore(str(path), snapshot_dir=str(tmp_path / "cache"))
+    store.load()
+    return store, path
+
+
+@pytest.mark.parametrize("newline", ["\r\n", "\n"])
+def test_writes_keep_line_endings(tmp_path, newline):
+    store, path = make_store(tmp_path, SAMPLE, newline)
+    store.set_alias("ll", "ls -l")
+    store.set_command("new", "echo new", "New", ["a"])
+    store.remove_command("other")
+    data = path.read_bytes().decode('utf-8')
+    assert data.count(newline) == data.count("\n") and data.count("\r") == data.count("\r\n")
+    assert data.startswith("# my commands" + newline)
+    reloaded = pythonCMD.ConfigStore(str(path), snapshot_dir=str(tmp_path / "other-cache"))
+    reloaded.load()
+    assert reloaded.aliases == {"ll": "ls -l"}
+    assert sorted(reloaded.commands) == ["greet", "new"]
+    assert reloaded.commands["greet"]["command"] == "echo hi $1"
+
+
+def test_new_file_uses_platform_line_endings(tmp_path):
+    path = tmp_path / "commands.cfg"
+    store = pythonCMD.ConfigStore(str(path), snapshot_dir=str(tmp_path / "cache"))
+    store.load()
+    store.set_alias("ll", "ls -l")
+    assert path.read_bytes() == f"[aliases]{os.linesep}ll = ls -l{os.linesep}".encode()
+
+
+def test_reload_after_external_edit(tmp_path):
+    store, path = make_store(tmp_path, SAMPLE, "\r\n")
+    assert not store.changed()
+    path.write_bytes(path.read_bytes() + b"[extra]\r\ncommand = true\r\n")
+    os.utime(path, ns=(0, 0))
+    assert store.changed()
+    store.set_alias("x", "y")
+    assert "extra" in store.commands
+    assert b"[extra]\r\n" in path.read_bytes()
+
+
+def test_parse_matches_snapshot(tmp_path):
+    text = "GS = git status\n[aliases]\nLL = ls -l\nll = ls -la\n" + SAMPLE
+    store, path = make_store(tmp_path, text, "\n")
+    store.set_alias("Up", "cd ..")
+    fresh = pythonCMD.ConfigStore(str(path), snapshot_dir=str(tmp_path / "other-cache"))
+    fresh.load()
+    cached = pythonCMD.ConfigStore(str(path), snapshot_dir=str(tmp_path / "cache"))
+    assert cached._signature() == store.signature
+    cached.load()
+    assert fresh.aliases == cached.aliases == {"GS": "git status", "LL": "ls -l", "ll": "ls -la", "Up": "cd .."}
+    assert fresh.commands == cached.commands
@@ -0,0 +1,49 @@
+import threading
+import time
+
+import pytest
+
+
+@pytest.fixture
+def config(tmp_path):
+    path = tmp_path / "commands.cfg"
+    path.write_text(
+        "[pyhello]\n"
+        "command = python -c \"import sys; print('hello ' + '$1'); print('warn', file=sys.stderr); result = 'done'\"\n"
+        "args = name\n"
+        "\n"
+        "[pyfail]\n"
+        "command = python -c \"print('before'); raise ValueError('boom')\"\n"
+    )
+    return path
+
+
+def test_in_process_print_reaches_the_session(config, session):
+    result = session.submit("pyhello bob")
+    assert result.status == 0
+    assert result.stdout.split() == ["hello", "bob", "warn", "done"]
+
+
+def test_in_process_print_goes_through_a_pipe(config, session):
+    result = session.submit("pyhello bob | grep -c o")
+    assert result.stdout.strip() == "2"
+
+
+def test_in_process_failure_keeps_printed_output(config, session):
+    result = session.submit("pyfail || echo recovered")
+    assert "before" in result.stdout and "boom" in result.stdout
+    assert result.stdout.splitlines()[-1] == "recovered"
+
+
+def test_capture_is_limited_to_the_running_thread(config, session, capsys):
+    with open(config, 'a') as f:
+        f.write("\n[pyslow]\ncommand = python -c \"import time; print('slow'); time.sleep(0.3)\"\n")
+    results = []
+    thread = threading.Thread(target=lambda: results.append(session.submit("pyslow")))
+    thread.start()
+    while thread.is_alive():
+        print("from another thread")
+        time.sleep(0.01)
+    thread.join()
+    assert results[0].stdout.strip() == "slow"
+    assert "from another thread" in capsys.readouterr().out
@@ -0,0 +1,87 @@
+import os
+
+import pytest
+
+import pythonCMD
+
+
+@pytest.fixture
+def du(tmp_path):
+    du = pythonCMD.DiskUsage(cache_path=str(tmp_path / "du.cache"), workers=4)
+    yield du
+    du.shutdown()
+
+
+@pytest.fixture
+def tree(workdir):
+    (workdir / "a" / "deep").mkdir(parents=True)
+    (workdir / "b").mkdir()
+    (workdir / "a" / "one").write_bytes(b"x" * 10000)
+    (workdir / "a" / "deep" / "two").write_bytes(b"x" * 20000)
+    (workdir / "b" / "three").write_bytes(b"x" * 60000)
+    return workdir
+
+
+def usage(path):
+    return pythonCMD.DiskUsage(cache_path=None).usage(os.lstat(path))
+
+
+def test_totals_add_up_subdirectories(du, tree):
+    totals, errors = du.measure(str(tree))
+    assert errors == 0
+    files = [tree / "a" / "one", tree / "a" / "deep" / "two", tree / "b" / "three"]
+    assert totals[str(tree / "a")][1] == 2
+    assert totals[str(tree)][1] == 3
+    directories = usage(tree) + usage(tree / "a") + usage(tree / "a" / "deep") + usage(tree / "b")
+    assert totals[str(tree)][0] == directories + sum(usage(path) for path in files)
+
+
+def test_hardlinked_file_is_counted_once(du, tree):
+    os.link(tree / "a" / "one", tree / "b" / "one-again")
+    os.link(tree / "a" / "one", tree / "a" / "deep" / "one-more")
+    totals, _ = du.measure(str(tree))
+    directories = usage(tree) + usage(tree / "a") + usage(tree / "a" / "deep") + usage(tree / "b")
+    files = usage(tree / "a" / "one") + usage(tree / "a" / "deep" / "two") + usage(tree / "b" / "three")
+    assert totals[str(tree)] == [directories + files, 3]
+    # The first directory in path order that holds a name gets the file
+    assert totals[str(tree / "a")][1] == 2
+    assert totals[str(tree / "b")][1] == 1
+
+
+def test_cache_is_reused_until_a_directory_changes(tmp_path, tree, monkeypatch):
+    first = pythonCMD.DiskUsage(cache_path=str(tmp_path / "du.cache"), workers=1)
+    expected, _ = first.measure(str(tree))
+    first.shutdown()
+    assert (tmp_path / "du.cache").exists()
+
+    scanned = []
+    scandir = os.scandir
+
+    def counting_scandir(path):
+        scanned.append(os.fspath(path))
+        return scandir(path)
+
+    monkeypatch.setattr(os, "scandir", counting_scandir)
+    second = pythonCMD.DiskUsage(cache_path=str(tmp_path / "du.cache"), workers=1)
+    try:
+        assert second.measure(str(tree))[0] == expected
+        assert scanned == []
+
+        (tree / "b" / "four").write_bytes(b"x" * 40000)
+        os.utime(tree / "b", ns=(0, 0))
+        totals, _ = second.measure(str(tree))
+        assert scanned == [str(tree / "b")]
+        assert totals[str(tree)][1] == 4
+        assert totals[str(tree / "b")][0] == expected[str(tree / "b")][0] + usage(tree / "b" / "four")
+
+        scanned.clear()
+        second.measure(str(tree), refresh=True)
+        assert sorted(scanned) == sorted(str(path) for path in (tree, tree / "a", tree / "a" / "deep", tree / "b"))
+    finally:
+        second.shutdown()
+
+
+def test_du_builtin_reports_largest_first(session, tree):
+    lines = [pythonCMD.CaptureSink.ANSI.sub('', line) for line in session.submit("du").stdout.splitlines()]
+    assert lines[0].endswith(os.path.join(".", "b")) and lines[1].endswith(os.path.join(".", "a"))
+    assert "3 files" in lines[-1]
@@ -0,0 +1,69 @@
+import os
+
+import pytest
+
+import pythonCMD
+
+
+@pytest.fixture
+def manager(workdir, monkeypatch):
+    for i in range(45):
+        (workdir / f"file{i:02d}.txt").write_text("x" * i)
+    monkeypatch.setattr(pythonCMD.shutil, "get_terminal_size", lambda *args: os.terminal_size((80, 20)))
+    return pythonCMD.FileManager(cwd=str(workdir))
+
+
+def visible_names(frame):
+    return [row.split()[0] for row in frame if "file" in row and "Current Directory" not in row]
+
+
+def draw(manager, capsys):
+    manager.display_interface()
+    return capsys.readouterr().out
+
+
+def test_only_one_page_is_rendered(manager, capsys):
+    draw(manager, capsys)
+    # 20 rows minus header, footer and prompt leave 10 rows for entries
+    assert manager.page_size == 10
+    names = [pythonCMD.CaptureSink.ANSI.sub('', name) for name in visible_names(manager.previous_frame)]
+    assert names == [f"file{i:02d}.txt" for i in range(10)]
+    assert "Items 1-10 of 45" in manager.previous_frame[2]
+
+
+def test_paging_is_clamped_to_the_last_page(manager, capsys):
+    manager.offset = 1000
+    draw(manager, capsys)
+    assert manager.offset == 40
+    assert "Items 41-45 of 45" in manager.previous_frame[2]
+    manager.view_mode = 'grid'
+    manager.offset = 7
+    draw(manager, capsys)
+    # Grid pages start on a row boundary: four 20-column cells per row
+    assert manager.offset % 4 == 0
+
+
+def test_redraw_rewrites_only_changed_rows(manager, capsys):
+    first = draw(manager, capsys)
+    assert first.startswith("\033[H\033[2J")
+    # Nothing changed: only the cursor moves back below the frame
+    assert draw(manager, capsys) == f"\033[{len(manager.previous_frame) + 1};1H\033[J"
+    manager.selected_items.add("file03.txt")
+    update = draw(manager, capsys)
+    assert "\033[2J" not in update
+    # The status line and the selected row
+    assert update.count("\033[2K") == 2
+    assert "\033[8;1H" in update
+
+
+def test_resize_redraws_the_whole_frame(manager, capsys, monkeypatch):
+    draw(manager, capsys)
+    monkeypatch.setattr(pythonCMD.shutil, "get_terminal_size", lambda *args: os.terminal_size((100, 30)))
+    assert draw(manager, capsys).startswith("\033[H\033[2J")
+    assert manager.page_size == 20
+
+
+def test_fit_truncates_by_visible_width(manager):
+    text = f"{pythonCMD.Style.RED}{'a' * 30}{pythonCMD.Style.RESET}"
+    assert manager.fit(text, 40) == text
+    assert manager.fit(text, 10) == "a" * 9 + "…"
@@ -0,0 +1,140 @@
+import threading
+import time
+
+import pythonCMD
+
+
+def make_store(tmp_path, retention=100000):
+    return pythonCMD.HistoryStore(str(tmp_path / "history"), retention=retention)
+
+
+def test_history_persists_and_escapes(tmp_path):
+    store = make_store(tmp_path)
+    store.append("echo 'a\tb'", cwd="/tmp", status=0, duration=0.5)
+    store.append("printf 'x\\ny'", status=1)
+    reloaded = make_store(tmp_path)
+    assert list(reloaded) == ["echo 'a\tb'", "printf 'x\\ny'"]
+    first, second = reloaded.recent()
+    assert (first.cwd, first.status, first.duration) == ("/tmp", 0, 0.5)
+    assert second.status == 1 and second.duration is None
+
+
+def test_tail_reads_without_loading(tmp_path):
+    store = make_store(tmp_path)
+    for i in range(10):
+        store.append(f"echo {i}")
+    reloaded = make_store(tmp_path)
+    assert reloaded.tail(3) == ["echo 7", "echo 8", "echo 9"]
+    assert not reloaded.loaded
+
+
+def test_search_smart_case_and_frecency(tmp_path):
+    store = make_store(tmp_path)
+    for command in ("git status", "git Status", "grep foo", "git status"):
+        store.append(command)
+    assert [stats.command for stats in store.search("status")] == ["git status", "git Status"]
+    assert [stats.command for stats in store.search("Status")] == ["git Status"]
+    assert store.search("nothing here") == []
+    assert [stats.command for stats in store.search("gr")] == ["grep foo"]
+
+
+def test_index_follows_appends(tmp_path):
+    store = make_store(tmp_path)
+    store.append("make build")
+    assert store.search("build")
+    store.append("cargo test")
+    assert [stats.command for stats in store.search("test")] == ["cargo test"]
+
+
+def test_retention_drops_expired_commands_from_search(tmp_path):
+    store = make_store(tmp_path, retention=3)
+    for command in ("old one", "new a", "new b", "new c"):
+        store.append(command)
+    assert len(store) == 3
+    assert store.search("old") == []
+
+
+def test_evicted_commands_leave_every_table(tmp_path):
+    store = make_store(tmp_path, retention=50)
+    store.append("keep me")
+    assert store.search("keep")
+    for i in range(1000):
+        store.append(f"unique command {i}")
+        if i % 100 == 0:
+            store.search("command")
+    assert len(store.stats) == len(store.unique) == 50
+    assert store.search("keep") == []
+    assert [stats.command for stats in store.search("command 999")] == ["unique command 999"]
+    # Ids of evicted commands are dropped from the index once they outnumber the live ones
+    assert store.stale <= len(store.unique)
+    indexed = {command_id for posting in store.index.values() for command_id in posting}
+    assert len(indexed) <= 2 * len(store.unique)
+
+
+def test_repeated_command_survives_while_in_window(tmp_path):
+    store = make_store(tmp_path, retention=3)
+    for command in ("make", "ls", "make", "pwd", "make"):
+        store.append(command)
+    assert store.stats["make"].count == 2
+    assert "ls" not in store.stats
+    assert [stats.command for stats in store.search("mak")] == ["make"]
+
+
+def test_load_compacts_file_past_retention(tmp_path):
+    path = tmp_path / "history"
+    store = make_store(tmp_path)
+    for i in range(20):
+        store.append(f"echo {i}")
+    reloaded = make_store(tmp_path, retention=5)
+    assert list(reloaded) == [f"echo {i}" for i in range(15, 20)]
+    assert path.read_text(encoding="utf-8").count("\n") == 5
+    # The compacted file still loads the same entries
+    assert list(make_store(tmp_path, retention=5)) == list(reloaded)
+
+
+def test_append_during_load_from_another_thread(tmp_path):
+    store = make_store(tmp_path)
+    for i in range(2000):
+        store.append(f"echo {i}")
+    # A small retention makes the load compact the file too
+    shared = make_store(tmp_path, retention=100)
+    reading = threading.Event()
+    read_tail = shared._read_tail
+
+    def slow_read_tail(count):
+        # The file has been read but not yet turned into entries when the append arrives
+        result = read_tail(count)
+        reading.set()
+        time.sleep(0.2)
+        return result
+
+    shared._read_tail = slow_read_tail
+    reader = threading.Thread(target=len, args=(shared,))
+    reader.start()
+    reading.wait()
+    shared.append("newest")
+    reader.join()
+    assert list(shared)[-1] == "newest"
+    assert len(shared) == 100
+    assert list(make_store(tmp_path, retention=100))[-2:] == ["echo 1999", "newest"]
+
+
+def test_count_never_loads(tmp_path):
+    make_store(tmp_path).append("echo hi")
+    store = make_store(tmp_path)
+    assert store.count() is None
+    assert not store.loaded
+    store.append("echo again")
+    assert store.count() == 2
+
+
+def test_status_line_does_not_load_history(runtime, tmp_path):
+    make_store(tmp_path).append("echo hi")
+    session = pythonCMD.Session(runtime, cwd=str(tmp_path), history_path=str(tmp_path / "history"))
+    try:
+        assert "History: …" in session.display_status()
+        assert not session.history.loaded
+        session.submit("echo x")
+        assert "History: 2" in session.display_status()
+    finally:
+        session.close()
@@ -0,0 +1,39 @@
+import time
+
+
+def test_kill_right_after_start(session):
+    session.submit('sleep 30 &')
+    started = time.monotonic()
+    result = session.submit('kill %1')
+    assert result.status == 0
+    session.submit('wait %1')
+    assert time.monotonic() - started < 10
+    assert session.jobs.get(1).status == 'Killed'
+
+
+def test_killed_job_skips_rest_of_list(session):
+    session.submit('sleep 30 || echo after &')
+    session.submit('kill %1')
+    session.submit('wait %1')
+    job = session.jobs.get(1)
+    assert job.status == 'Killed'
+    assert not any('after' in line for line in job.sink.lines())
+
+
+def test_job_runs_whole_list(session):
+    session.submit('true && echo one; echo two &')
+    session.submit('echo three && echo four &')
+    session.submit('wait')
+    assert session.jobs.get(2).sink.lines()[-1].endswith('four')
+
+
+def test_job_pipes_builtin_from_its_own_directory(session, workdir):
+    (workdir / "sub").mkdir()
+    (workdir / "sub" / "inside").write_text("")
+    (workdir / "outside").write_text("")
+    session.submit('cd sub && ls | cat &')
+    session.submit('wait')
+    lines = [line for line in session.jobs.get(1).sink.lines() if line.strip()]
+    assert lines and lines[-1].endswith('inside')
+    assert not any('outside' in line for line in lines)
+    assert session.cwd == str(workdir)
@@ -0,0 +1,70 @@
+import json
+import sys
+
+import pytest
+
+import pythonCMD
+
+BUSY = f'{sys.executable} -c "import time; end = time.process_time() + 0.4\nwhile time.process_time() < end: pass"'
+
+
+@pytest.fixture
+def recorder(tmp_path, monkeypatch):
+    monkeypatch.setenv("PYTHONCMD_METRICS_JSONL", str(tmp_path / "metrics-{pid}.jsonl"))
+    monkeypatch.setenv("PYTHONCMD_METRICS_PROM", str(tmp_path / "metrics.prom"))
+
+
+def records(session):
+    with open(session.metrics.jsonl_path, encoding='utf-8') as f:
+        return [json.loads(line) for line in f]
+
+
+@pytest.mark.parametrize("line, key", [
+    ("ls -la /tmp", "ls"),
+    ("ls | grep -v x > out.txt", "ls | grep"),
+    ("FOO=1 BAR=2 make -j4 && make install 2>&1", "make && make"),
+    ("git status; echo 'a b' &", "git ; echo &"),
+    ("echo 'unterminated", "echo"),
+    ("", ""),
+])
+def test_key_names_the_programs_a_line_runs(line, key):
+    assert pythonCMD.MetricsRecorder().key(line) == key
+
+
+def test_jsonl_record_per_command(recorder, session):
+    session.submit("echo hi | cat")
+    session.submit("false")
+    first, second = records(session)
+    assert first['command'] == "echo | cat" and first['status'] == 0
+    assert first['output_bytes'] == 3
+    assert second['command'] == "false" and second['status'] == 1
+    assert {'time', 'session', 'wall', 'cpu', 'child_cpu', 'max_rss_kb', 'blocks_in', 'blocks_out'} <= set(first)
+
+
+@pytest.mark.skipif(not hasattr(pythonCMD.os, 'wait4'), reason="needs os.wait4")
+def test_child_cpu_is_the_commands_own(recorder, session):
+    session.submit(BUSY)
+    assert records(session)[-1]['child_cpu'] >= 0.3
+    # A background job that finishes while a foreground command runs is not charged to it
+    session.submit(BUSY + " &")
+    session.submit("sleep 1.5")
+    session.submit("wait")
+    sleep = [record for record in records(session) if record['command'] == 'sleep'][-1]
+    assert session.jobs.get(1).returncode == 0
+    assert sleep['child_cpu'] < 0.1
+
+
+def test_prometheus_textfile(recorder, session):
+    session.submit("echo one")
+    session.submit("echo two")
+    session.submit('printf "a\\"b" | false')
+    session.metrics.write_prometheus()
+    with open(session.metrics.prometheus_path, encoding='utf-8') as f:
+        lines = f.read().splitlines()
+    label = f'session="{session.metrics.session}",command="echo"'
+    assert "# TYPE pythoncmd_command_duration_seconds summary" in lines
+    assert f"pythoncmd_command_duration_seconds_count{{{label}}} 2" in lines
+    assert any(line.startswith(f'pythoncmd_command_duration_seconds{{{label},quantile="0.95"}} ') for line in lines)
+    assert f"pythoncmd_command_output_bytes_total{{{label}}} 8" in lines
+    failed = f'session="{session.metrics.session}",command="printf | false"'
+    assert f"pythoncmd_command_failures_total{{{failed}}} 1" in lines
@@ -0,0 +1,170 @@
+import pytest
+
+import pythonCMD
+
+
+@pytest.fixture
+def config(tmp_path, workdir):
+    (workdir / "data.txt").write_text("one\n")
+    (tmp_path / "commands.cfg").write_text(
+        "[slow]\n"
+        "command = echo run >> runs.log && cat data.txt\n"
+        "cache = 1h\n"
+        "\n"
+        "[watched]\n"
+        "command = echo run >> runs.log && cat data.txt\n"
+        "cache = files:*.txt\n"
+        "\n"
+        "[brief]\n"
+        "command = echo run >> runs.log && echo brief $1\n"
+        "cache = 1\n"
+        "\n"
+        "[failing]\n"
+        "command = echo run >> runs.log && exit 3\n"
+        "cache = 1h\n"
+    )
+    return tmp_path / "commands.cfg"
+
+
+def runs(workdir):
+    try:
+        return (workdir / "runs.log").read_text().count("run")
+    except FileNotFoundError:
+        return 0
+
+
+def test_repeated_command_is_served_from_cache(config, session, workdir):
+    first = session.submit("slow")
+    second = session.submit("slow")
+    assert first.stdout == second.stdout == "one\n"
+    assert first.status == second.status == 0
+    assert runs(workdir) == 1
+    report = session.submit("cache").stdout
+    assert "slow" in report and "50%" in report
+
+
+def test_arguments_and_directory_are_part_of_the_key(config, session, workdir):
+    assert session.submit("brief a").stdout == "brief a\n"
+    assert session.submit("brief b").stdout == "brief b\n"
+    assert session.submit("brief a").stdout == "brief a\n"
+    assert runs(workdir) == 2
+    (workdir / "sub").mkdir()
+    (workdir / "sub" / "data.txt").write_text("two\n")
+    session.submit("cd sub")
+    assert session.submit("slow").stdout == "two\n"
+
+
+def test_ttl_is_checked_on_memory_hits(config, session, workdir, monkeypatch):
+    session.submit("brief a")
+    now = pythonCMD.time.time()
+    monkeypatch.setattr(pythonCMD.time, "time", lambda: now + 5)
+    session.submit("brief a")
+    assert runs(workdir) == 2
+
+
+def test_changed_file_invalidates_result(config, session, workdir):
+    assert session.submit("watched").stdout == "one\n"
+    assert session.submit("watched").stdout == "one\n"
+    assert runs(workdir) == 1
+    (workdir / "data.txt").write_text("changed\n")
+    assert session.submit("watched").stdout == "changed\n"
+    (workdir / "new.txt").write_text("")
+    session.submit("watched")
+    assert runs(workdir) == 3
+
+
+def test_failures_are_not_cached(config, session, workdir):
+    assert session.submit("failing").status == 3
+    assert session.submit("failing || echo handled").stdout == "handled\n"
+    assert runs(workdir) == 2
+
+
+def test_piped_stage_bypasses_cache(config, session, workdir):
+    session.submit("slow")
+    assert session.submit("echo x | slow").stdout == "one\n"
+    assert runs(workdir) == 2
+    # A cached command may still feed a pipe
+    assert session.submit("slow | grep -c one").stdout == "1\n"
+    assert runs(workdir) == 2
+
+
+def test_results_are_reused_from_disk(config, session, workdir, tmp_path):
+    session.submit("slow")
+    runtime = pythonCMD.Runtime(str(config))
+    other = pythonCMD.Session(runtime, cwd=str(workdir))
+    try:
+        assert other.submit("slow").stdout == "one\n"
+        assert runs(workdir) == 1
+    finally:
+        other.close()
+        runtime.shutdown()
+
+
+def test_clear_removes_memory_and_disk_results(config, session, workdir):
+    session.submit("slow")
+    session.submit("brief a")
+    result = session.submit("cache clear slow")
+    assert result.status == 0 and "Removed 1 cached result(s) for slow" in result.stdout
+    session.submit("slow")
+    session.submit("brief a")
+    assert runs(workdir) == 3
+    assert "Removed 2 cached result(s)" in session.submit("cache clear").stdout
+    assert session.submit("cache drop").status == 1
+
+
+@pytest.mark.parametrize("text, ttl, patterns", [
+    ("300", 300, ()), ("10m", 600, ()), ("1.5h, files:*.py", 5400, ("*.py",)), ("files:a, files:b", None, ("a", "b")),
+])
+def test_policy_parsing(text, ttl, patterns):
+    policy = pythonCMD.CachePolicy.parse(text)
+    assert (policy.ttl, policy.patterns) == (ttl, patterns)
+    assert pythonCMD.CachePolicy.parse(str(policy)).ttl == ttl
+
+
+@pytest.mark.parametrize("text", ["", "off", "0"])
+def test_policy_disabled(text):
+    assert pythonCMD.CachePolicy.parse(text) is None
+
+
+@pytest.mark.parametrize("text", ["soon", "files:", "10 minutes"])
+def test_policy_rejects_bad_settings(text):
+    with pytest.raises(ValueError):
+        pythonCMD.CachePolicy.parse(text)
+
+
+def test_input_redirect_bypasses_cache(config, session, workdir):
+    (workdir / "input.txt").write_text("ignored\n")
+    session.submit("slow")
+    assert session.submit("slow < input.txt").stdout == "one\n"
+    assert runs(workdir) == 2
+
+
+def test_error_output_is_kept_apart(tmp_path, session, workdir):
+    (tmp_path / "commands.cfg").write_text(
+        "[noisy]\n"
+        "command = echo run >> runs.log && echo out && echo warning >&2\n"
+        "cache = 1h\n"
+    )
+    session.submit("true")  # picks up the new config
+    for _ in range(2):
+        result = session.submit("noisy")
+        assert result.status == 0
+        assert result.stdout == "out\n"
+        assert result.stderr == "warning\n"
+    assert runs(workdir) == 1
+    piped = session.submit("noisy | cat")
+    assert piped.stdout == "out\n" and piped.stderr == "warning\n"
+    assert runs(workdir) == 1
+
+
+def test_results_without_error_output_are_run_again(config, session, workdir, tmp_path):
+    session.submit("slow")
+    cache = session.runtime.output_cache
+    ident, = list(cache.entries)
+    entry = dict(cache.entries[ident])
+    del entry['errors']
+    with open(f"{cache.cache_dir}/{ident}", 'wb') as f:
+        pythonCMD.marshal.dump(entry, f)
+    cache.entries.clear()
+    assert session.submit("slow").stdout == "one\n"
+    assert runs(workdir) == 2
@@ -0,0 +1,68 @@
+import pytest
+
+from pythonCMD import CommandParser, ParseError
+
+
+@pytest.fixture
+def parser():
+    return CommandParser(escapes=True)
+
+
+def stages(parser, line):
+    return [[(stage.words, stage.redirects, stage.compound) for stage in pipeline.stages]
+            for command_list in parser.parse(line) for _, pipeline in command_list.items]
+
+
+def test_quotes_and_escapes(parser):
+    assert parser.parse('echo "a b" \'c d\' e\\ f')[0].items[0][1].stages[0].words == ['echo', 'a b', 'c d', 'e f']
+
+
+def test_operators_split_lists_and_pipelines(parser):
+    command_lists = parser.parse('a | b && c || d; e &')
+    assert [connector for connector, _ in command_lists[0].items] == [None, '&&', '||']
+    assert len(command_lists[0].items[0][1].stages) == 2
+    assert not command_lists[0].background
+    assert command_lists[1].background
+
+
+def test_redirections_are_tokens_at_every_position(parser):
+    assert stages(parser, 'echo hi 2>&1 | cat') == [[(['echo', 'hi'], [(2, '>&', 1)], False), (['cat'], [], False)]]
+    assert stages(parser, 'cmd <in >out 2>>err') == [[(['cmd'], [(0, '<', 'in'), (1, '>', 'out'), (2, '>>', 'err')], False)]]
+    assert stages(parser, 'echo >&2 x') == [[(['echo', 'x'], [(1, '>&', 2)], False)]]
+
+
+def test_descriptor_number_only_at_word_start(parser):
+    assert stages(parser, 'echo a2>x') == [[(['echo', 'a2'], [(1, '>', 'x')], False)]]
+    assert stages(parser, 'echo 2 > x') == [[(['echo', '2'], [(1, '>', 'x')], False)]]
+
+
+def test_subshell_after_operator(parser):
+    assert stages(parser, 'timeout 1; (sleep 3; echo x)') == [
+        [(['timeout', '1'], [], False)],
+        [(['( sleep 3 ; echo x )'], [], True)],
+    ]
+
+
+def test_keyword_compound_in_any_position(parser):
+    result = stages(parser, 'echo done && for i in 1 2; do echo $i; done > out')
+    assert result[0] == [(['echo', 'done'], [], False)]
+    assert result[1] == [(['for i in 1 2 ; do echo $i ; done'], [(1, '>', 'out')], True)]
+
+
+def test_nested_compound(parser):
+    result = stages(parser, 'if true; then while false; do :; done; fi | cat')
+    assert result == [[(['if true ; then while false ; do : ; done ; fi'], [], True), (['cat'], [], False)]]
+
+
+def test_keyword_as_argument_is_a_word(parser):
+    assert stages(parser, 'echo if for done') == [[(['echo', 'if', 'for', 'done'], [], False)]]
+
+
+def test_command_substitution_stays_in_word(parser):
+    assert stages(parser, 'echo $(date +%s) x') == [[(['echo', '$(date +%s)', 'x'], [], False)]]
+
+
+@pytest.mark.parametrize('line', ['echo (', 'a ||', '| b', 'echo >', '(echo', 'for i in 1; do x', 'echo "open'])
+def test_syntax_errors(parser, line):
+    with pytest.raises(ParseError):
+        parser.parse(line)
@@ -0,0 +1,65 @@
+import sys
+
+import pythonCMD
+
+
+def test_stderr_duplicated_into_pipe(session):
+    result = session.submit('echo hi 2>&1 | cat')
+    assert result.stdout == "hi\n"
+    result = session.submit(f'{sys.executable} -c "import sys; sys.stderr.write(\'oops\\\\n\')" 2>&1 | cat')
+    assert result.stdout == "oops\n"
+    assert result.stderr == ""
+
+
+def test_stderr_of_earlier_stage_reaches_sink(session):
+    result = session.submit(f'{sys.executable} -c "import sys; sys.stderr.write(\'early\\\\n\')" | echo after')
+    assert result.stdout == "after\n"
+    assert result.stderr == "early\n"
+
+
+def test_redirect_to_stderr(session):
+    result = session.submit('echo moved >&2')
+    assert result.stdout == ""
+    assert result.stderr == "moved\n"
+
+
+def test_file_redirections(session, workdir):
+    assert session.submit('echo one > out.txt; echo two >> out.txt').status == 0
+    assert (workdir / "out.txt").read_text() == "one\ntwo\n"
+    assert session.submit('cat < out.txt').stdout == "one\ntwo\n"
+    assert session.submit('search two < out.txt').stdout == "two\n"
+
+
+def test_subshell_after_operator_runs_in_shell(session):
+    result = session.submit('echo start; (echo a; echo b) | sort -r')
+    assert result.stdout == "start\nb\na\n"
+
+
+def test_timeout_applies_to_subshell(session):
+    result = session.submit('timeout 0.5; (sleep 3; echo x)')
+    assert result.status == 124
+    assert "x" not in result.stdout.splitlines()
+
+
+def test_builtin_output_reaches_a_file_without_colour(session, workdir):
+    (workdir / "sub").mkdir()
+    (workdir / "data.txt").write_text("x\n")
+    assert session.submit('ls > listing.txt').status == 0
+    text = (workdir / "listing.txt").read_text()
+    assert "\033" not in text and "data.txt" in text
+
+
+def test_builtin_output_reaches_a_pipe_without_colour(runtime, workdir, tmp_path):
+    (workdir / "sub").mkdir()
+    (workdir / "data.txt").write_text("x\n")
+    session = pythonCMD.Session(runtime, cwd=str(workdir), history_path=str(tmp_path / "colour"), color=True)
+    try:
+        listing = session.submit('ls | cat')
+        assert listing.status == 0
+        assert "data.txt" in listing.stdout and "\033" not in listing.stdout
+        assert session.submit('ls | cat > piped.txt').status == 0
+        assert "\033" not in (workdir / "piped.txt").read_text()
+        names = session.submit('ls | xargs ls -d')
+        assert names.status == 0 and "data.txt" in names.stdout
+    finally:
+        session.close()
@@ -0,0 +1,94 @@
+import threading
+import time
+
+import pytest
+
+import pythonCMD
+
+
+@pytest.fixture
+def status():
+    return pythonCMD.PromptStatus()
+
+
+def test_slow_segment_does_not_hold_up_the_prompt(status):
+    release = threading.Event()
+    calls = []
+
+    def slow(key):
+        calls.append(key)
+        release.wait(5)
+        return f"value for {key}"
+
+    status.add('slow', slow, timeout=0.05)
+    started = time.monotonic()
+    assert status.get('/a') == {}
+    assert status.get('/a') == {}
+    assert time.monotonic() - started < 1
+    # Still running from the first prompt, so it was not started again
+    assert calls == ['/a']
+    release.set()
+    deadline = time.monotonic() + 5
+    while not status.get('/a') and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert status.get('/a') == {'slow': "value for /a"}
+
+
+def test_value_is_reused_within_ttl(status):
+    calls = []
+    status.add('count', lambda key: calls.append(key) or len(calls), ttl=60)
+    assert status.get('/a') == {'count': 1}
+    assert status.get('/a') == {'count': 1}
+    assert calls == ['/a']
+
+
+def test_value_for_another_key_is_not_shown(status):
+    release = threading.Event()
+
+    def directory(key):
+        if key != '/a':
+            release.wait(5)
+        return key
+
+    status.add('dir', directory, timeout=0.05, ttl=60)
+    assert status.get('/a') == {'dir': '/a'}
+    assert status.get('/b') == {}
+    release.set()
+
+
+def test_failed_segment_is_left_out(status):
+    def broken(key):
+        raise OSError("stale file handle")
+
+    status.add('broken', broken)
+    status.add('fine', lambda key: 'ok')
+    assert status.get('/a') == {'fine': 'ok'}
+
+
+def test_git_branch(tmp_path):
+    repo = tmp_path / "repo"
+    (repo / ".git").mkdir(parents=True)
+    (repo / "src" / "deep").mkdir(parents=True)
+    head = repo / ".git" / "HEAD"
+    head.write_text("ref: refs/heads/feature/x\n")
+    assert pythonCMD.PromptStatus.git_branch(str(repo / "src" / "deep")) == "feature/x"
+    head.write_text("0123456789abcdef\n")
+    assert pythonCMD.PromptStatus.git_branch(str(repo)) == "0123456"
+    # A worktree's .git is a file naming the real git directory
+    worktree = tmp_path / "worktree"
+    worktree.mkdir()
+    (tmp_path / "real").mkdir()
+    (tmp_path / "real" / "HEAD").write_text("ref: refs/heads/other\n")
+    (worktree / ".git").write_text(f"gitdir: {tmp_path / 'real'}\n")
+    assert pythonCMD.PromptStatus.git_branch(str(worktree)) == "other"
+    assert pythonCMD.PromptStatus.git_branch(str(tmp_path)) is None
+
+
+def test_status_line_shows_segments(session, workdir):
+    (workdir / ".git").mkdir()
+    (workdir / ".git" / "HEAD").write_text("ref: refs/heads/main\n")
+    session.submit("false")
+    line = pythonCMD.CaptureSink.ANSI.sub('', session.display_status())
+    assert "Branch: main" in line
+    assert "Last: 1" in line
+    assert "Took: " in line
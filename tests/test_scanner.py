@@ -0,0 +1,81 @@
+import os
+
+import pytest
+
+import pythonCMD
+
+
+@pytest.fixture
+def scanner():
+    return pythonCMD.DirectoryScanner(max_directories=2)
+
+
+def bump_mtime(path):
+    stat = os.stat(path)
+    os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10 ** 9))
+
+
+def names(entries):
+    return [entry.name for entry in entries]
+
+
+def test_scan_is_cached_until_the_directory_mtime_changes(scanner, workdir, monkeypatch):
+    (workdir / "b.txt").write_text("bb")
+    (workdir / "a").mkdir()
+    assert sorted(names(scanner.scan(str(workdir)))) == ["a", "b.txt"]
+    scans = []
+    scandir = os.scandir
+    monkeypatch.setattr(pythonCMD.os, "scandir", lambda path: scans.append(path) or scandir(path))
+    scanner.scan(str(workdir))
+    assert scans == []
+    (workdir / "c.txt").write_text("")
+    bump_mtime(workdir)
+    assert sorted(names(scanner.scan(str(workdir)))) == ["a", "b.txt", "c.txt"]
+    assert scans == [str(workdir)]
+
+
+def test_sorted_views(scanner, workdir):
+    for name, size in (("Beta", 30), ("alpha", 10), ("gamma", 20)):
+        (workdir / name).write_text("x" * size)
+    path = str(workdir)
+    assert names(scanner.sorted(path)) == ["alpha", "Beta", "gamma"]
+    assert names(scanner.sorted(path, 'size')) == ["alpha", "gamma", "Beta"]
+    assert names(scanner.sorted(path, 'size', reverse=True)) == ["Beta", "gamma", "alpha"]
+    # Views are kept with the listing
+    assert scanner.sorted(path, 'size') is scanner.sorted(path, 'size')
+
+
+def test_update_applies_changes_without_rescanning(scanner, workdir, monkeypatch):
+    for name in ("a", "c", "e"):
+        (workdir / name).write_text(name)
+    path = str(workdir)
+    scanner.sorted(path)
+    scanner.sorted(path, 'size')
+    scanner.sorted(path, reverse=True)
+    (workdir / "d").write_text("dddd")
+    (workdir / "a").unlink()
+    (workdir / "c").write_text("cccccc")
+    monkeypatch.setattr(pythonCMD.os, "scandir", None)
+    scanner.update(path, ["d", "a", "c"])
+    assert names(scanner.sorted(path)) == ["c", "d", "e"]
+    assert names(scanner.sorted(path, 'size')) == ["e", "d", "c"]
+    assert names(scanner.sorted(path, reverse=True)) == ["e", "d", "c"]
+    # The update records the new mtime, so the next scan is still a cache hit
+    assert sorted(names(scanner.scan(path))) == ["c", "d", "e"]
+
+
+def test_cache_keeps_only_recent_directories(scanner, tmp_path):
+    paths = []
+    for name in ("one", "two", "three"):
+        (tmp_path / name).mkdir()
+        paths.append(str(tmp_path / name))
+        scanner.scan(paths[-1])
+    assert list(scanner.cache) == paths[1:]
+
+
+def test_ls_sees_new_files(session, workdir):
+    (workdir / "first").write_text("")
+    assert "first" in session.submit("ls").stdout
+    (workdir / "second").write_text("")
+    bump_mtime(workdir)
+    assert "second" in session.submit("ls").stdout
@@ -0,0 +1,20 @@
+import pythonCMD
+
+
+def test_workers_do_not_fork_the_shell():
+    assert pythonCMD.FileSearch.process_context().get_start_method() in ('forkserver', 'spawn')
+
+
+def test_find_and_grep(session, workdir):
+    (workdir / "src").mkdir()
+    (workdir / "src" / "main.py").write_text("import os\nprint('needle')\n")
+    (workdir / "notes.txt").write_text("no match here\n")
+    (workdir / ".gitignore").write_text("build/\n")
+    (workdir / "build").mkdir()
+    (workdir / "build" / "main.py").write_text("needle\n")
+    found = session.submit("ffind main.py")
+    assert found.status == 0
+    assert "main.py" in found.stdout and "build" not in found.stdout
+    grepped = session.submit("fsearch needle")
+    assert grepped.status == 0
+    assert "src/main.py" in grepped.stdout and "build" not in grepped.stdout
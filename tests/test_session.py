@@ -0,0 +1,57 @@
+import time
+
+import pytest
+
+import pythonCMD
+
+
+@pytest.fixture
+def other(runtime, tmp_path):
+    session = pythonCMD.Session(runtime, cwd=str(tmp_path), history_path=str(tmp_path / "other-history"))
+    yield session
+    session.close()
+
+
+def test_sessions_keep_their_own_timeout(session, other):
+    assert session.submit("timeout 0.5").status == 0
+    assert other.submit("timeout").stdout.strip() == "Command timeout: disabled"
+    started = time.monotonic()
+    assert other.submit("sleep 1").status == 0
+    assert time.monotonic() - started >= 1
+    assert session.submit("sleep 3").status == 124
+    assert session.submit("timeout off").status == 0
+    assert session.submit("timeout").stdout.strip() == "Command timeout: disabled"
+
+
+@pytest.mark.parametrize("value", ["0", "-1", "soon", "nan", "inf"])
+def test_timeout_rejects_invalid_values(session, value):
+    result = session.submit(f"timeout {value}")
+    assert result.status == 1
+    assert "Invalid timeout" in result.stdout
+    assert session.submit("timeout").stdout.strip() == "Command timeout: disabled"
+
+
+def test_background_job_inherits_timeout(session):
+    session.submit("timeout 0.5")
+    session.submit("sleep 3 &")
+    session.submit("wait %1")
+    assert session.jobs.get(1).returncode == 124
+
+
+def test_config_messages_go_to_the_session(session, tmp_path, capsys):
+    (tmp_path / "commands.cfg").write_text("[aliases]\na = b\nb = a\n\n[broken]\nhelp = no command\n")
+    result = session.submit("echo x")
+    assert result.stdout == "x\n"
+    assert "changed on disk" in result.stderr
+    assert "alias a: cycle" in result.stderr
+    assert "broken: Configuration error" in result.stderr
+    assert capsys.readouterr().out == ""
+
+
+def test_foreground_job_output_goes_to_the_session(session, capsys):
+    session.submit("sleep 0.3 && echo from-job &")
+    result = session.submit("fg %1")
+    assert result.status == 0
+    assert "from-job" in result.stdout
+    assert "sleep 0.3 && echo from-job" in result.stdout
+    assert capsys.readouterr().out == ""
@@ -0,0 +1,91 @@
+import io
+import os
+import shutil
+
+import pytest
+
+import pythonCMD
+
+
+class ScriptedPager(pythonCMD.Pager):
+    def __init__(self, stream, keys):
+        super().__init__(stream)
+        self.keys = list(keys)
+
+    def read_key(self):
+        self.stream.write("<wait>")
+        return self.keys.pop(0)
+
+
+@pytest.fixture
+def console(monkeypatch):
+    monkeypatch.setattr(shutil, "get_terminal_size", lambda *args: os.terminal_size((20, 5)))
+
+    def make(keys=" " * 10):
+        stream = io.StringIO()
+        sink = pythonCMD.ConsoleSink(stream)
+        sink.pager = ScriptedPager(stream, keys)
+        return sink, stream
+    return make
+
+
+def pages(stream):
+    # The blank header row of built-in output takes the first row
+    text = stream.getvalue().replace(pythonCMD.Pager.PROMPT, "").replace("\r\033[K", "")
+    assert text.startswith("\n")
+    return text[1:].split("<wait>")
+
+
+def test_pager_counts_short_lines(console):
+    sink, stream = console()
+    sink.write('output', "".join(f"{i}\n" for i in range(10)))
+    sink.close()
+    assert pages(stream) == ["0\n1\n2\n", "3\n4\n5\n6\n", "7\n8\n9\n"]
+
+
+def test_pager_counts_wrapped_rows(console):
+    sink, stream = console()
+    # 45 characters take three rows of a 20 column terminal; exactly 20 take one
+    sink.write('output', "w" * 45 + "\n" + "x" * 20 + "\nb\nc\nd\ne\n")
+    sink.close()
+    assert pages(stream) == ["w" * 45 + "\n", "x" * 20 + "\nb\nc\nd\n", "e\n"]
+
+
+def test_pager_ignores_colour_codes_and_joins_partial_writes(console):
+    sink, stream = console()
+    for chunk in ("\033[92m" + "c" * 15, "c" * 10 + "\033[0m\n", "d\n", "e\n"):
+        sink.write('output', chunk)
+    sink.close()
+    assert pages(stream)[0] == "\033[92m" + "c" * 25 + "\033[0m\nd\n"
+
+
+def test_line_taller_than_page_is_shown_whole(console):
+    sink, stream = console()
+    sink.write('output', "y" * 200 + "\nz\n")
+    sink.close()
+    assert pages(stream) == ["", "y" * 200 + "\n", "z\n"]
+
+
+def test_capture_sink_spills_past_limit():
+    sink = pythonCMD.CaptureSink(limit=10)
+    sink.write('stdout', "12345")
+    sink.write('stderr', "err\n")
+    assert not sink.spilled
+    sink.write('stdout', "678901")
+    sink.write('stdout', "more")
+    assert list(sink.spilled) == ['stdout'] and sink.chunks['stdout'] == []
+    assert sink.text('stdout') == "12345678901more"
+    sink.write('stdout', "!")
+    assert sink.text('stdout') == "12345678901more!"
+    assert sink.text('stderr') == "err\n"
+
+
+def test_session_output_spills_past_capture_limit(runtime, workdir, tmp_path):
+    session = pythonCMD.Session(runtime, cwd=str(workdir), history_path=str(tmp_path / "history"),
+                                capture_limit=1000)
+    try:
+        result = session.submit("seq 1 2000")
+        assert result.status == 0
+        assert result.stdout.split() == [str(i) for i in range(1, 2001)]
+    finally:
+        session.close()
@@ -0,0 +1,55 @@
+import os
+import subprocess
+import sys
+
+import pythonCMD
+
+SCRIPT = os.path.abspath(pythonCMD.__file__)
+
+
+def run(workdir, *args):
+    return subprocess.run([sys.executable, SCRIPT, *args], cwd=workdir, capture_output=True, text=True,
+                          stdin=subprocess.DEVNULL, timeout=60)
+
+
+def test_profile_laps_and_report():
+    profile = pythonCMD.StartupProfile(started=10.0)
+    profile.last = 10.0
+    profile.phases.append(('imports', 0.004))
+    profile.lap('config')
+    assert [name for name, seconds in profile.phases] == ['imports', 'config']
+    report = profile.report()
+    assert 'imports' in report and '4.00 ms' in report
+    assert 'total' in report.splitlines()[-1]
+
+
+def test_custom_commands_are_built_on_first_use(tmp_path, home, workdir):
+    config = tmp_path / "commands.cfg"
+    config.write_text("[greet]\ncommand = echo hi $1\nhelp = Say hi\nargs = name\n")
+    runtime = pythonCMD.Runtime(str(config))
+    try:
+        session = pythonCMD.Session(runtime, cwd=str(workdir), history_path=str(tmp_path / "history"))
+        assert runtime.custom_commands is None
+        assert session.submit("echo plain").stdout.strip() == "plain"
+        assert runtime.custom_commands is None
+        assert session.submit("greet you").stdout.strip() == "hi you"
+        assert "greet" in runtime.custom_commands
+        session.close()
+    finally:
+        runtime.shutdown()
+
+
+def test_command_option_runs_with_profile(home, workdir):
+    (workdir / "commands.cfg").write_text("[greet]\ncommand = echo hi $1\nhelp = Say hi\n")
+    result = run(workdir, "--profile-startup", "-c", "greet there")
+    assert result.returncode == 0
+    assert result.stdout.strip().endswith("hi there")
+    assert "Welcome" not in result.stdout
+    for phase in ('imports', 'arguments', 'subsystems', 'built-in commands', 'config', 'command', 'total'):
+        assert phase in result.stderr
+
+
+def test_command_option_exits_with_status(home, workdir):
+    assert run(workdir, "-c", "false").returncode == 1
+    result = run(workdir, "-c", "echo quiet")
+    assert result.returncode == 0 and result.stderr == ""
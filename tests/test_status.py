@@ -0,0 +1,35 @@
+def test_failed_cd_stops_and_chain(session, workdir):
+    result = session.submit("cd /nonexistent && pwd")
+    assert result.status == 1
+    assert "Error changing directory" in result.stdout
+    assert str(workdir) not in result.stdout
+
+
+def test_failed_cd_runs_or_chain(session):
+    result = session.submit("cd /nonexistent || echo failed")
+    assert result.status == 0
+    assert result.stdout.splitlines()[-1] == "failed"
+
+
+def test_successful_builtin_keeps_and_chain(session, workdir):
+    (workdir / "sub").mkdir()
+    result = session.submit("cd sub && pwd")
+    assert result.status == 0
+    assert result.stdout.splitlines()[-1] == str(workdir / "sub")
+
+
+def test_generator_builtin_failure_sets_status(session):
+    assert session.submit("du /nonexistent").status == 1
+    assert session.submit("du /nonexistent || echo failed").stdout.splitlines()[-1] == "failed"
+
+
+def test_builtin_errors_set_status(session):
+    assert session.submit("unalias nothing").status == 1
+    assert session.submit("export =x").status == 1
+    assert session.submit("help nothing").status == 1
+    assert session.submit("ls").status == 0
+
+
+def test_status_of_pipeline_is_last_stage(session):
+    assert session.submit("unalias nothing | echo ok").status == 0
+    assert session.submit("echo ok | false").status == 1
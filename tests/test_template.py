@@ -0,0 +1,90 @@
+import shlex
+import subprocess
+
+import pytest
+
+import pythonCMD
+
+pytestmark = pytest.mark.skipif(pythonCMD.os.name == 'nt', reason="POSIX quoting")
+
+
+def test_direct_template_builds_argv():
+    template = pythonCMD.CommandTemplate('grep -n "$1" ${2:-.}')
+    assert template.words is not None
+    assert template.argv(["a b"]) == ["grep", "-n", "a b", "."]
+    assert template.argv(["x", "src"]) == ["grep", "-n", "x", "src"]
+
+
+def test_all_arguments_expand_to_separate_words():
+    template = pythonCMD.CommandTemplate('echo $@ end')
+    assert template.argv(["one", "two words", ""]) == ["echo", "one", "two words", "end"]
+
+
+@pytest.mark.parametrize("text", ['printf "<%s>" $@', 'printf "<%s>" "$@"', "printf '<%s>' '$@'"])
+def test_shell_and_direct_runs_split_arguments_alike(text):
+    template = pythonCMD.CommandTemplate(text)
+    args = ["a b", "it's", '"q"']
+    direct = subprocess.run(template.argv(args), capture_output=True, text=True).stdout
+    shell = subprocess.run(template.render(args), shell=True, capture_output=True, text=True).stdout
+    assert direct == shell == "<a b><it's><\"q\">"
+
+
+def test_missing_unquoted_argument_disappears():
+    template = pythonCMD.CommandTemplate('ls $1 -l')
+    assert template.argv([]) == ["ls", "-l"]
+    assert pythonCMD.CommandTemplate('ls "$1" -l').argv([]) == ["ls", "", "-l"]
+
+
+@pytest.mark.parametrize("text", ['echo $1 | wc -c', 'FOO=1 echo $1', 'echo $(date) $1', 'echo *.py'])
+def test_shell_features_keep_the_shell(text):
+    assert pythonCMD.CommandTemplate(text).words is None
+
+
+@pytest.mark.parametrize("value", ["plain", "it's", 'say "hi"', "$HOME `id` \\n", "a;b|c", ""])
+@pytest.mark.parametrize("text", ['printf %s $1', 'printf %s "$1"', "printf %s '$1'"])
+def test_rendered_arguments_reach_the_program_verbatim(text, value):
+    rendered = pythonCMD.CommandTemplate(text).render([value])
+    output = subprocess.run(rendered, shell=True, capture_output=True, text=True).stdout
+    assert output == value
+
+
+def test_rendered_unquoted_argument_is_one_word():
+    rendered = pythonCMD.CommandTemplate('printf "<%s>" $1 $2').render(["a b", "c"])
+    assert shlex.split(rendered) == ["printf", "<%s>", "a b", "c"]
+
+
+@pytest.mark.parametrize("value", ["it's", 'say "hi"', "back\\slash", "two\nlines"])
+def test_python_template_quotes_string_literals(value):
+    template = pythonCMD.CommandTemplate("result = '$1' + \"$1\"", language='python')
+    namespace = {}
+    exec(template.render([value]), namespace)
+    assert namespace['result'] == value * 2
+
+
+def make_tool(directory, name):
+    directory.mkdir(exist_ok=True)
+    tool = directory / name
+    tool.write_text("#!/bin/sh\necho \"tool:$1\"\n")
+    tool.chmod(0o755)
+    return tool
+
+
+def test_executable_uses_the_given_path_and_directory(tmp_path):
+    tool = make_tool(tmp_path / "bin", "only-in-session-path")
+    template = pythonCMD.CommandTemplate('only-in-session-path $1')
+    assert template.executable(str(tmp_path), {'PATH': str(tmp_path / "bin")}) == str(tool)
+    assert template.executable(str(tmp_path), {'PATH': "bin"}) == str(tool)
+    assert template.executable(str(tmp_path), {'PATH': "/nonexistent"}) is None
+    relative = pythonCMD.CommandTemplate('bin/only-in-session-path $1')
+    assert relative.executable(str(tmp_path), {}) == str(tool)
+    assert relative.executable(str(tmp_path / "bin"), {}) is None
+
+
+def test_custom_command_runs_from_the_session_path(session, workdir, tmp_path):
+    make_tool(workdir / "bin", "sessiontool")
+    (tmp_path / "commands.cfg").write_text("[tool]\ncommand = sessiontool $1\n\n[local]\ncommand = ./bin/sessiontool $1\n")
+    session.submit(f"export PATH={workdir / 'bin'}:{pythonCMD.os.environ['PATH']}")
+    assert session.submit("tool 'a b'").stdout == "tool:a b\n"
+    assert session.submit("local x").stdout == "tool:x\n"
+    assert session.custom_commands["tool"].external(["y"], session.cwd, session.context.env) == ["sessiontool", "y"]
+    assert session.custom_commands["local"].external(["y"], session.cwd, None) == ["./bin/sessiontool", "y"]
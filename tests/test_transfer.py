@@ -0,0 +1,93 @@
+import _thread
+import io
+import os
+
+import pytest
+
+import pythonCMD
+
+
+@pytest.fixture
+def engine(tmp_path):
+    return pythonCMD.TransferEngine(workers=1, journal_dir=str(tmp_path / "journal"), stream=io.StringIO())
+
+
+@pytest.fixture
+def tree(workdir):
+    source = workdir / "src"
+    (source / "nested").mkdir(parents=True)
+    for i in range(5):
+        (source / f"file{i}.txt").write_text(f"content {i}\n")
+    (source / "nested" / "deep.txt").write_text("deep\n")
+    os.symlink("file0.txt", source / "link")
+    target = workdir / "dst"
+    target.mkdir()
+    return source, target
+
+
+def test_copy_tree(engine, tree):
+    source, target = tree
+    message = engine.copy([str(source)], str(target))
+    assert "Copied 6 file(s)" in message and engine.succeeded
+    copied = target / "src"
+    assert (copied / "nested" / "deep.txt").read_text() == "deep\n"
+    assert os.readlink(copied / "link") == "file0.txt"
+    assert not list(copied.rglob("*.part"))
+    assert os.listdir(engine.journal_dir) == []
+
+
+def test_interrupted_copy_resumes(engine, tree, monkeypatch):
+    source, target = tree
+    copy_file = engine._copy_file
+    copied = []
+
+    def copy_then_interrupt(task, journal):
+        copy_file(task, journal)
+        copied.append(task[1])
+        if len(copied) == 2:
+            # What Ctrl-C does to the thread waiting for the workers
+            _thread.interrupt_main()
+            assert engine.cancelled.wait(5)
+
+    monkeypatch.setattr(engine, "_copy_file", copy_then_interrupt)
+    message = engine.copy([str(source)], str(target))
+    assert "interrupted" in message and not engine.succeeded
+    assert len(copied) == 2
+    journal, = os.listdir(engine.journal_dir)
+
+    # A file finished before the interruption is not copied again, even if it differs from its source
+    done = copied[0]
+    with open(done, "w") as f:
+        f.write("left alone\n")
+    monkeypatch.setattr(engine, "_copy_file", copy_file)
+    message = engine.copy([str(source)], str(target))
+    assert engine.succeeded
+    assert f"{len(copied)} already done before resuming" in message
+    assert open(done).read() == "left alone\n"
+    for i in range(5):
+        assert (target / "src" / f"file{i}.txt").exists()
+    assert not list((target / "src").rglob("*.part"))
+    assert os.listdir(engine.journal_dir) == []
+
+
+def test_cancelled_file_leaves_no_part_file(engine, tree):
+    source, target = tree
+    engine.cancelled.set()
+    task = (str(source / "file1.txt"), str(target / "file1.txt"), 10)
+    with pytest.raises(pythonCMD.TransferCancelled):
+        engine._copy_file(task, io.StringIO())
+    assert os.listdir(target) == []
+
+
+def test_move_within_a_file_system_renames(engine, tree):
+    source, target = tree
+    message = engine.copy([str(source)], str(target), move=True)
+    assert "by rename" in message
+    assert not source.exists() and (target / "src" / "nested" / "deep.txt").exists()
+
+
+def test_delete_tree(engine, tree):
+    source, _ = tree
+    message = engine.delete([str(source)])
+    assert "Deleted 7 file(s) and 2 folder(s)" in message
+    assert not source.exists()
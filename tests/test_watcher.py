@@ -0,0 +1,90 @@
+import os
+import sys
+
+import pytest
+
+import pythonCMD
+
+inotify = pytest.mark.skipif(not sys.platform.startswith('linux'), reason="inotify is Linux only")
+
+
+@pytest.fixture
+def watcher():
+    watcher = pythonCMD.DirectoryWatcher(interval=0.01)
+    yield watcher
+    watcher.close()
+
+
+@pytest.fixture
+def poller(monkeypatch):
+    # What the watcher falls back to without inotify, or when it is out of watches
+    monkeypatch.setattr(pythonCMD.DirectoryWatcher, "_init_inotify", lambda self: None)
+    watcher = pythonCMD.DirectoryWatcher(interval=0.01)
+    yield watcher
+    watcher.close()
+
+
+@inotify
+def test_inotify_reports_changed_names(watcher, workdir):
+    (workdir / "old").write_text("")
+    watcher.watch(str(workdir))
+    assert watcher.fileno() is not None and watcher.timeout is None
+    assert watcher.read() == set()
+    (workdir / "new").write_text("data")
+    os.rename(workdir / "old", workdir / "renamed")
+    assert watcher.read() == {"new", "old", "renamed"}
+    assert watcher.read() == set()
+
+
+@inotify
+def test_inotify_ignores_a_directory_it_stopped_watching(watcher, workdir):
+    other = workdir / "other"
+    other.mkdir()
+    watcher.watch(str(workdir))
+    watcher.watch(str(other))
+    (workdir / "elsewhere").write_text("")
+    (other / "here").write_text("")
+    assert watcher.read() == {"here"}
+
+
+@inotify
+def test_inotify_asks_for_rescan_when_directory_goes(watcher, workdir):
+    target = workdir / "gone"
+    target.mkdir()
+    watcher.watch(str(target))
+    target.rmdir()
+    assert watcher.read() is None
+
+
+def test_polling_rescans_when_mtime_changes(poller, workdir):
+    poller.watch(str(workdir))
+    assert poller.fileno() is None and poller.timeout == 0.01
+    assert poller.read() == set()
+    (workdir / "new").write_text("")
+    os.utime(workdir, ns=(0, 0))
+    assert poller.read() is None
+    assert poller.read() == set()
+
+
+def test_unwatched_reports_nothing(poller, workdir):
+    assert poller.read() == set()
+    poller.watch(str(workdir))
+    poller.unwatch()
+    (workdir / "new").write_text("")
+    os.utime(workdir, ns=(0, 0))
+    assert poller.read() == set()
+
+
+@inotify
+def test_file_manager_listing_follows_watched_changes(watcher, workdir, monkeypatch, capsys):
+    monkeypatch.setattr(pythonCMD.shutil, "get_terminal_size", lambda *args: os.terminal_size((80, 20)))
+    (workdir / "first.txt").write_text("")
+    manager = pythonCMD.FileManager(cwd=str(workdir))
+    manager.display_interface()
+    watcher.watch(str(workdir))
+    (workdir / "second.txt").write_text("")
+    (workdir / "first.txt").unlink()
+    manager.apply_changes(watcher.read())
+    names = [item.name for item in manager.get_sorted_items()]
+    assert names == ["second.txt"]
+    assert "second.txt" in capsys.readouterr().out
@@ -0,0 +1,64 @@
+import threading
+
+import pytest
+
+import pythonCMD
+
+
+@pytest.fixture
+def worker():
+    worker = pythonCMD.PythonWorker(memory_limit=256)
+    yield worker
+    worker.stop()
+
+
+def test_worker_runs_code_with_args_and_cwd(worker, workdir):
+    source = "import os\nprint('cwd', os.getcwd() == cwd)\nresult = '-'.join(args)"
+    output, status = worker.run(source, "<join>", ["a", "b"], timeout=30, cwd=str(workdir))
+    assert status == 0
+    assert output == "cwd True\na-b"
+    # The same process serves the next call
+    process = worker.process
+    assert worker.run("result = 1", "<one>", timeout=30) == ("1", 0)
+    assert worker.process is process
+
+
+@pytest.mark.skipif(pythonCMD.resource is None, reason="needs the resource module")
+def test_worker_memory_limit(worker):
+    output, status = worker.run("data = bytearray(1024 * 1024 * 1024)", "<big>", timeout=30)
+    assert status == 1
+    assert "Error executing command" in output
+    # A failed allocation does not cost the worker
+    assert worker.process.is_alive()
+    assert worker.run("result = len(bytearray(1024))", "<small>", timeout=30) == ("1024", 0)
+
+
+def test_worker_restarts_after_timeout(worker):
+    output, status = worker.run("while True: pass", "<loop>", timeout=1)
+    assert status == 124 and worker.process is None
+    assert worker.run("result = 'back'", "<back>", timeout=30) == ("back", 0)
+
+
+def test_custom_command_runs_in_worker(worker, workdir):
+    command = pythonCMD.CustomCommand("where", "python -c \"import os; result = os.getcwd()\"", "", worker=worker)
+    assert command.run_python(command.python_source(command.command), cwd=str(workdir)) == (str(workdir), 0)
+
+
+def test_code_cache_shared_between_threads():
+    cache = pythonCMD.CodeCache(max_entries=8)
+    errors = []
+
+    def compile_many(offset):
+        try:
+            for i in range(2000):
+                cache.compile(f"x = {(i + offset) % 32}")
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=compile_many, args=(n,)) for n in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert errors == []
+    assert len(cache.entries) <= 8